@@ -1,18 +1,27 @@
 import os
+import sys
 import argparse
+import numpy as np
 from pandas.errors import EmptyDataError
 from pandas import read_csv, DataFrame
 
+SESSION_PATH = os.path.join("..", "Session")
+sys.path.insert(0, SESSION_PATH)
+from Session import SessionReader, SessionWriter
 
-def csv_merge(date, srate, n_channels):
+
+def csv_merge(date, srate, n_channels, input_format='csv', output_format='csv'):
     """
-    Fuses the 3 csv files generated by the receiver into a single one that can be used for offline reproduction of
-    the experiment.
+    Fuses the 3 csv files (or the binary session) generated by the receiver into a single one that can be used for
+    offline reproduction of the experiment.
 
     Parameters:
         date (str): The date of the experiment to be processed.
         srate (int): The sample rate of the signal to be processed.
         n_channels (int): Number of considered channels.
+        input_format (str): Format of the recording, 'csv' or 'binary'.
+        output_format (str): Format of the result, 'csv' (with two columns marking the events) or 'binary' (session
+            containing the kept samples and the events marked on them).
     """
 
     # setup paths for loading and saving files
@@ -20,29 +29,42 @@ def csv_merge(date, srate, n_channels):
     eeg_path = os.path.join(OUTPUT_PATH, 'eeg_session_' + date + '.csv')
     events_path = os.path.join(OUTPUT_PATH, 'evs_session_' + date + '.csv')
     discard_path = os.path.join(OUTPUT_PATH, 'disc_session_' + date + '.csv')
+    session_path = os.path.join(OUTPUT_PATH, 'bin_session_' + date)
 
-    # load file as pandas DataFrames
-    # catch error if there is no file to read for the given date
     discard_flag = True  # initialize flag before check
-    try:
-        eeg = read_csv(eeg_path, header=None, index_col=False)
-    except:
-        print("No file was found for the given date.")
-    events = read_csv(events_path, header=None, index_col=False)
-    try:
-        discard = read_csv(discard_path, header=None, index_col=False)
-    except EmptyDataError:
-        discard_flag = False
-
-    # add 2 zero columns to the frame for the events
-    eeg.insert(eeg.shape[1], eeg.shape[1], 0)
-    eeg.insert(eeg.shape[1], eeg.shape[1], 0)
-
-    # switch from dataframes to lists for faster access
-    eeg = eeg.values.tolist()
-    events = events.values.tolist()
-    if discard_flag:
-        discards = discard.values.tolist()
+    header = {"srate": srate, "labels": ["ch" + str(i + 1) for i in range(n_channels)]}
+    if input_format == 'binary':
+        # samples are memory-mapped, converted to lists (with 2 zero columns for the events) as done for the csv files
+        if not os.path.exists(session_path):
+            print("No file was found for the given date.")
+        session = SessionReader(session_path)
+        header = session.header
+        eeg = np.column_stack((session.times, session.data, np.zeros((len(session), 2)))).tolist()
+        events = [[time, str([label])] for time, label in zip(session.events['time'].tolist(), session.event_labels())]
+        discards = session.discards.tolist()
+        discard_flag = len(discards) > 0
+    else:
+        # load file as pandas DataFrames
+        # catch error if there is no file to read for the given date
+        try:
+            eeg = read_csv(eeg_path, header=None, index_col=False)
+        except:
+            print("No file was found for the given date.")
+        events = read_csv(events_path, header=None, index_col=False)
+        try:
+            discard = read_csv(discard_path, header=None, index_col=False)
+        except EmptyDataError:
+            discard_flag = False
+
+        # add 2 zero columns to the frame for the events
+        eeg.insert(eeg.shape[1], eeg.shape[1], 0)
+        eeg.insert(eeg.shape[1], eeg.shape[1], 0)
+
+        # switch from dataframes to lists for faster access
+        eeg = eeg.values.tolist()
+        events = events.values.tolist()
+        if discard_flag:
+            discards = discard.values.tolist()
 
     # initialize the list for processed data
     compound = []
@@ -50,7 +72,7 @@ def csv_merge(date, srate, n_channels):
     # initialize everything necessary for the loop
     event_idx = 0
     discard_idx = 0
-    event_flag = True
+    event_flag = len(events) > 0
     win_offset = 0.001
 
     print('Processing...', end='')
@@ -88,10 +110,18 @@ def csv_merge(date, srate, n_channels):
                 event_flag = False
         compound.append(eeg_row)
 
-    # move back to DataFrames for saving
-    compound_df = DataFrame(compound)
-    dest_path = os.path.join(OUTPUT_PATH, 'proc_session_' + date + '.csv')
-    compound_df.to_csv(dest_path, index=False, header=False)
+    if output_format == 'binary':
+        compound = np.array(compound).reshape(-1, n_channels + 3)
+        stims = np.flatnonzero(compound[:, n_channels + 1] == 1)
+        proc_session = SessionWriter(os.path.join(OUTPUT_PATH, 'proc_session_' + date), header)
+        proc_session.append_eeg(compound[:, 0], compound[:, 1:n_channels + 1])
+        proc_session.append_events(compound[stims, 0], ['R' if compound[i, n_channels + 2] == 1 else 'F' for i in stims])
+        proc_session.close()
+    else:
+        # move back to DataFrames for saving
+        compound_df = DataFrame(compound)
+        dest_path = os.path.join(OUTPUT_PATH, 'proc_session_' + date + '.csv')
+        compound_df.to_csv(dest_path, index=False, header=False)
     print(' done!')
 
 
@@ -100,6 +130,8 @@ if __name__ == '__main__':
     parser.add_argument("exp_date", help="Date of the experiment to be processed", type=str)
     parser.add_argument("sample_rate", help="Sample rate of the signal to be processed", type=int)
     parser.add_argument("n_channels", help="Number of considered channels", type=int)
+    parser.add_argument("-i", "--input_format", help="Format of the recording", choices=['csv', 'binary'], default='csv')
+    parser.add_argument("-o", "--output_format", help="Format of the result", choices=['csv', 'binary'], default='csv')
     args = parser.parse_args()
 
-    csv_merge(args.exp_date, args.sample_rate, args.n_channels)
+    csv_merge(args.exp_date, args.sample_rate, args.n_channels, args.input_format, args.output_format)
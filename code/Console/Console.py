@@ -1,6 +1,7 @@
 import os
 from os import listdir
 from os.path import isfile
+from threading import Thread
 from time import sleep
 
 import PySimpleGUI as sg
@@ -16,6 +17,7 @@ import UnicornPy
 DEBUG_PRINT = False
 USE_GUI = True
 USE_DEVICE = True
+DISCARD_SECONDS = 10  # default number of seconds discarded by the discard command
 
 #===================== THEME SETTINGS =======================================
 sg.theme('black')
@@ -252,6 +254,7 @@ def loading_window(console_outlet):
     stream_receiver_found = False
     stream_sender_created = True
     # ==================== Done ========================
+    receiver_inlet = None  # kept open, to relay the messages of the Receiver (stopping criterion reached)
 
     text = ""
 
@@ -334,7 +337,6 @@ def loading_window(console_outlet):
                         stream_receiver_found = True
                         if USE_GUI:
                             window['_RECEIVER-STREAM_'].Update(visible=stream_receiver_found)
-                        receiver_inlet.close_stream()
 
             if event == sg.WINDOW_CLOSED or event == 'Next':
                 console_outlet.push_sample(['NEXT'])
@@ -352,15 +354,49 @@ def loading_window(console_outlet):
         if data_streams != []:
             data_inlet = StreamInlet(data_streams[0], recover=False)
 
+        receiver_streams = resolve_byprop('name', 'Receiver', timeout=pylsl.FOREVER)
+        if receiver_streams != []:
+            receiver_inlet = StreamInlet(receiver_streams[0], recover=False)
+
         input("Press enter when all the streams are ready!")
         console_outlet.push_sample(['NEXT'])
 
-    console_window(console_outlet, plotter_inlet, data_inlet)
+    console_window(console_outlet, plotter_inlet, data_inlet, receiver_inlet)
+
+
+def criterion_reached(receiver_inlet):
+    '''
+    Drains the messages of the Receiver (e.g. the "OK" of the setup still queued) looking for the one of the stopping criterion
+    :param receiver_inlet:
+    :return: True if the Receiver has reached the stopping criterion
+    '''
+    if receiver_inlet is None:
+        return False
+    msgs, timestamps = receiver_inlet.pull_chunk(timeout=0)
+    return any(msg[0] == 'CRITERION' for msg in msgs)
+
+
+def relay_criterion(console_outlet, receiver_inlet):
+    '''
+    Forwards to Stims and Sender the message of the stopping criterion reached by the Receiver, so that they can end the
+    block early. Run in background when the commands are read from the terminal (blocking input)
+    :param console_outlet:
+    :param receiver_inlet:
+    :return:
+    '''
+    while True:
+        try:
+            msg, timestamp = receiver_inlet.pull_sample()  # blocking call
+        except pylsl.pylsl.LostError:
+            return
+        if msg is not None and msg[0] == 'CRITERION':
+            console_outlet.push_sample(['CRITERION'])
+            print("\nCriterion reached, the block ends early")
 
 
-def console_window(console_outlet, plotter_inlet, data_inlet):
+def console_window(console_outlet, plotter_inlet, data_inlet, receiver_inlet=None):
     '''
-    This window provides three buttons for play/pause, stop and discard (10 seconds) the recording.
+    This window provides three buttons for play/pause, stop and discard (the chosen number of seconds) the recording.
     TODO for further works: Add battery status in case of device
     TODO for further works: Add textarea for debug
     :param console_outlet:
@@ -374,7 +410,12 @@ def console_window(console_outlet, plotter_inlet, data_inlet):
                    sg.Button(use_ttk_buttons=True, button_color=(button_background, sg.theme_background_color()), key='_STOP_',
                              image_filename=image_stop, disabled=True),
                    sg.Button(use_ttk_buttons=True, button_color=(button_background, sg.theme_background_color()), key='_DISCARD_',
-                             image_filename=image_discard, disabled=True)]]
+                             image_filename=image_discard, disabled=True),
+                   sg.Spin(values=list(range(1, 61)), initial_value=DISCARD_SECONDS, key='_DISCARD_S_', size=(3, 1),
+                           tooltip='Seconds to discard')],
+                  [sg.Input(key='_CONFIG_S_', size=(20, 1), tooltip='<pause_pre_ev> <event_length> <pause_post_ev> '
+                                                                     '[<channels> | ALL] (e.g. 0.2 0.8 0.2 Cz,Pz)'),
+                   sg.Button('Apply', key='_CONFIG_', button_color=text_color, font=text_font)]]
 
         # Create the form and show it without the plot
         window = sg.Window('P300 RealTime', layout, finalize=True,
@@ -398,6 +439,12 @@ def console_window(console_outlet, plotter_inlet, data_inlet):
                     sg.popup('End of file reached', text_color=text_color, font=text_font, keep_on_top=True, non_blocking=False)
                     break
 
+            if criterion_reached(receiver_inlet):
+                if DEBUG_PRINT: print("Criterion reached")
+                console_outlet.push_sample(['CRITERION'])  # the Stims (or the Sender) end the block early
+                sg.popup('Criterion reached, the block ends early', text_color=text_color, font=text_font, keep_on_top=True,
+                         non_blocking=True)
+
             if event == '_PP_':
                 if DEBUG_PRINT: print("PP")
 
@@ -419,7 +466,11 @@ def console_window(console_outlet, plotter_inlet, data_inlet):
 
             elif event == '_DISCARD_':
                 if DEBUG_PRINT: print("Discard")
-                console_outlet.push_sample(['DISCARD'])
+                console_outlet.push_sample(['DISCARD ' + str(values['_DISCARD_S_'])])
+
+            elif event == '_CONFIG_':
+                if DEBUG_PRINT: print("Config")
+                console_outlet.push_sample(['CONFIG ' + values['_CONFIG_S_'].strip()])  # checked by the Receiver
 
             # See if user wants to quit or window was closed
             if event == sg.WINDOW_CLOSED:
@@ -432,21 +483,25 @@ def console_window(console_outlet, plotter_inlet, data_inlet):
 
     else: # If do not use graphic
         text_first = "List of commands:\n\tPLAY (or A) to start the acquisition\n\tPAUSE (or P) to pause the acquisition\n\tSTOP (or S) to reset all"
-        text_discard = "\n\tDISCARD (or D) to discard the last 10 seconds"
+        text_discard = "\n\tDISCARD (or D) [seconds] to discard the last seconds (" + str(DISCARD_SECONDS) + " if not given)"
+        text_config = "\n\tCONFIG (or C) <pause_pre_ev> <event_length> <pause_post_ev> [<channels> | ALL] to change the " \
+                      "window of the epochs\n\t\tand the channels averaged (e.g. C 0.2 0.8 0.2 CZ,PZ)"
         text_second = "\n\tQUIT (or Q) to terminate the process\n\tHELP (or H) to repeat this message"
         init_s = "Digit PLAY or A to start the acquisition: "
         state = "init"
 
         if USE_DEVICE:
-            text = text_first + text_discard + text_second
+            text = text_first + text_discard + text_config + text_second
         else:
-            text = text_first + text_second
+            text = text_first + text_config + text_second
         print()
         print(text)
         if not USE_DEVICE:
             print("**Check whether the end of file is reached by checking the Sender terminal, then press Q**\n")
         else:
             print()
+        if receiver_inlet is not None:
+            Thread(target=relay_criterion, args=(console_outlet, receiver_inlet), daemon=True).start()
         while True:
             if not USE_DEVICE:
                 msg, timestamp = data_inlet.pull_sample(timeout=0)
@@ -457,12 +512,19 @@ def console_window(console_outlet, plotter_inlet, data_inlet):
                 cmd = input(init_s).upper()
             else:
                 cmd = input(state + " state - " + "Command: ").upper()
+            # optional argument of the command (seconds to discard)
+            words = cmd.split()
+            cmd = words[0] if len(words) > 0 else ""
+            discard_msg = 'DISCARD ' + (words[1] if len(words) > 1 and words[1].replace('.', '', 1).isdigit()
+                                        else str(DISCARD_SECONDS))
             with switch.Switch(cmd) as case:
                 if case("QUIT", "Q"):
                     console_outlet.push_sample(['QUIT'])
                     break
                 elif case("HELP", "H"):
                     print(text)
+                elif case("CONFIG", "C"):  # in any state
+                    console_outlet.push_sample(['CONFIG ' + " ".join(words[1:])])
                 else:
                     if state == "init":
                         if case("PLAY", "A"):
@@ -485,7 +547,7 @@ def console_window(console_outlet, plotter_inlet, data_inlet):
                         elif case("STOP", "S"):
                             pass
                         elif case("DISCARD", "D") and USE_DEVICE:
-                            console_outlet.push_sample(['DISCARD'])
+                            console_outlet.push_sample([discard_msg])
                         else:
                             print("Unkown command. Digit HELP or H to see the available commands.")
                     elif state == "Pause":
@@ -498,7 +560,7 @@ def console_window(console_outlet, plotter_inlet, data_inlet):
                             console_outlet.push_sample(['STOP'])
                             state = "Stop"
                         elif case("DISCARD", "D") and USE_DEVICE:
-                            console_outlet.push_sample(['DISCARD'])
+                            console_outlet.push_sample([discard_msg])
                         else:
                             print("Unkown command. Digit HELP or H to see the available commands.")
                     elif state == "Stop":
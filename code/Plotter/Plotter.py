@@ -19,8 +19,15 @@ OUTPUT_FILE = 'channels_avg_' + time.strftime("%Y_%b_%d_%H%M") + '.png'  # file
 # plots values
 MAX_COLS = 4
 MAX_ROWS = 8
+COND_COLORS = [(0.42, 0.68, 0.84, 1), (0.98, 0.42, 0.29, 1), (0.40, 0.74, 0.39, 1), (0.62, 0.48, 0.77, 1), (0.94, 0.70, 0.24, 1),
+               (0.55, 0.34, 0.29, 1)]  # colors of the conditions (first two: rare and frequent)
+# id of the avg stream to be plotted, when the Receiver sends one for each subject (multi-stream mode, e.g. 'myuid2425_0'),
+# None to plot the first avg stream found
+AVG_SOURCE_ID = None
 
 # Flags and variables for optional features --------------------------------------------------------------------------------------
+SHARED_MEMORY = False   # flag to read the averages from the Receiver on the same host through shared memory, instead of LSL
+
 USING_CONSOLE = True    # flag to enable the console control
 
 DEBUG_PRINT = False     # flag to enable verbose prints
@@ -30,100 +37,216 @@ if USING_CONSOLE:
     sys.path.insert(0, CONSOLE_PATH)
     from Console import DEBUG_PRINT  # overwrite the value of DEBUG_PRINT flag with the one inside Console file
 
+if SHARED_MEMORY:
+    SHARED_AVG_PATH = os.path.join("..", "SharedAvg")
+    sys.path.insert(0, SHARED_AVG_PATH)
+    from SharedAvg import SharedAvgReader  # OBS: requires Python >= 3.8
+
 
 def warning_on_one_line(message, category, filename, lineno, file=None, line=None):  # define format of warning prints
     return '%s: %s\n' % (category.__name__, message)
 
 
-def y_lim(f_segment_avg, r_segment_avg, diff):  # return global min and max values of y axes for all subplots
-    f_min = np.amin(f_segment_avg)
-    r_min = np.amin(r_segment_avg)
-    d_min = np.amin(diff)
-    f_max = np.amax(f_segment_avg)
-    r_max = np.amax(r_segment_avg)
-    d_max = np.amax(diff)
-    return np.amin(np.array([f_min, r_min, d_min])), np.amax(np.array([f_max, r_max, d_max]))
+def y_lim(segment_avgs, diff):  # return global min and max values of y axes for all subplots
+    return min(np.amin(segment_avgs), np.amin(diff)), max(np.amax(segment_avgs), np.amax(diff))
+
+
+def avg_diff(segment_avgs):  # difference between the first two conditions (e.g. rare - frequent)
+    if len(segment_avgs) < 2:
+        return np.zeros_like(segment_avgs[0])
+    return segment_avgs[0] - segment_avgs[1]
+
 
+def trials_info(cond_names, n_trials, n_rejected, cond_modes):  # number of averaged (and rejected) trials of each condition
+    # OBS: the averaging mode is shown only if not cumulative (e.g. "window 50", i.e. only the last 50 trials averaged)
+    return "   ".join(name.capitalize() + ": " + str(n_trials[c]) + " trials (" + str(n_rejected[c]) + " rejected" +
+                       (", " + cond_modes[c] if cond_modes[c] not in ("", "cumulative") else "") + ")"
+                       for c, name in enumerate(cond_names))
 
-def channels_plot(fig, axs, time_steps, f_segment_avg, r_segment_avg, event_init, s_type, rare_line, freq_line, diff_line):
-    diff = r_segment_avg - f_segment_avg
-    y_min, y_max = y_lim(f_segment_avg, r_segment_avg, diff)
+
+def channels_plot(fig, axs, time_steps, segment_avgs, event_init, cond_ids, cond_lines, diff_line, trials_text=""):
+    diff = avg_diff(segment_avgs)
+    y_min, y_max = y_lim(segment_avgs, diff)
     for i in range(len(axs)):  # for each subplot
-        if s_type == 1:  # rare event
-            rare_line[i].remove()
-            rare_line[i], = axs[i].plot(time_steps, r_segment_avg[:, i], color=(0.42, 0.68, 0.84, 1))
-        else:  # frequent event
-            freq_line[i].remove()
-            freq_line[i], = axs[i].plot(time_steps, f_segment_avg[:, i], color=(0.98, 0.42, 0.29, 1))
+        for cond_id in cond_ids:  # only the updated conditions
+            cond_lines[cond_id][i].remove()
+            cond_lines[cond_id][i], = axs[i].plot(time_steps, segment_avgs[cond_id][:, i],
+                                                  color=COND_COLORS[cond_id % len(COND_COLORS)])
         diff_line[i].remove()
         diff_line[i], = axs[i].plot(time_steps, diff[:, i], color='k')
         axs[i].set_ylim(y_min - 0.15 * abs(y_min), y_max + 0.15 * abs(y_max))  # update ylim
-    fig.suptitle("Last event at time: " + str(event_init), horizontalalignment='center', fontsize=10)
+    fig.suptitle("Last event at time: " + str(event_init) + "\n" + trials_text, horizontalalignment='center', fontsize=10)
     fig.canvas.draw()
     fig.canvas.flush_events()  # needed to immediately update plot
     plt.pause(0.001)
-    return rare_line, freq_line, diff_line
+    return cond_lines, diff_line
 
 
-def reset_plot(fig, axs, time_steps, f_segment_avg, r_segment_avg, event_init, rare_line, freq_line, diff_line):
-    diff = r_segment_avg - f_segment_avg
-    y_min, y_max = y_lim(f_segment_avg, r_segment_avg, diff)
+def reset_plot(fig, axs, time_steps, segment_avgs, event_init, cond_lines, diff_line, trials_text=""):
+    diff = avg_diff(segment_avgs)
+    y_min, y_max = y_lim(segment_avgs, diff)
     for i in range(len(axs)):  # for each subplot
-        rare_line[i].remove()
-        freq_line[i].remove()
+        for cond_id in range(len(segment_avgs)):
+            cond_lines[cond_id][i].remove()
+            cond_lines[cond_id][i], = axs[i].plot(time_steps, segment_avgs[cond_id][:, i],
+                                                  color=COND_COLORS[cond_id % len(COND_COLORS)])
         diff_line[i].remove()
-        rare_line[i], = axs[i].plot(time_steps, r_segment_avg[:, i], color=(0.42, 0.68, 0.84, 1))
-        freq_line[i], = axs[i].plot(time_steps, f_segment_avg[:, i], color=(0.98, 0.42, 0.29, 1))
         diff_line[i], = axs[i].plot(time_steps, diff[:, i], color='k')
         if not y_min == y_max == 0:
             axs[i].set_ylim(y_min - 0.15 * abs(y_min), y_max + 0.15 * abs(y_max))  # update ylim
-    fig.suptitle("Avgs reset at time: " + str(event_init), horizontalalignment='center', fontsize=10)
+    fig.suptitle("Avgs reset at time: " + str(event_init) + "\n" + trials_text, horizontalalignment='center', fontsize=10)
     fig.canvas.draw()
     fig.canvas.flush_events()  # needed to immediately update plot
     plt.pause(0.001)
-    return rare_line, freq_line, diff_line
+    return cond_lines, diff_line
 
 
-def main():
-    # Get data from LSL ----------------------------------------------------------------------------------------------------------
-    # first resolve the avg stream on the lsl network
-    print("Looking for the avg stream...", end=" ")
-    avg_streams = resolve_stream('name', 'avgStream')
-    # create a new inlet to read from the stream
-    avg_inlet = StreamInlet(avg_streams[0], recover=False)
-    print("done!")
+def resolve_avg_stream(created_after=0.0):  # avg stream to be plotted, created after the given time (the newest one)
+    # OBS: once reconfigured, the Receiver keeps its previous stream until the new one has been resolved
+    while True:
+        if AVG_SOURCE_ID is None:
+            avg_streams = resolve_stream('name', 'avgStream')
+        else:
+            avg_streams = resolve_stream('source_id', AVG_SOURCE_ID)
+        avg_streams = [stream for stream in avg_streams if stream.created_at() > created_after]
+        if len(avg_streams) > 0:
+            return max(avg_streams, key=lambda stream: stream.created_at())
+        time.sleep(0.1)
 
-    # get stream info
-    info = avg_inlet.info()
-    n_channels = info.channel_count()
+
+def avg_stream_meta(info):
+    """
+    Metadata of the avg stream sent by the Receiver.
+
+    Parameters:
+        info (StreamInfo): Full info of the stream (as returned by the inlet).
+
+    Returns:
+        tuple: Number of samples of the averages, names and averaging modes of the conditions, labels of the channels, columns
+            of the condition id, of the number of averaged trials and of rejected ones (None if not sent), baseline duration
+            (s), rate of the samples of the averages, name of the EEG stream (multi-stream mode, empty otherwise).
+    """
     dequeues_len = int(info.desc().child("chunk").child_value("size"))
 
+    cond = info.desc().child("conditions").child("condition")
+    cond_names = []
+    cond_modes = []  # averaging mode of each condition (empty if not given)
+    while not cond.empty():
+        cond_names.append(cond.child_value("name"))
+        cond_modes.append(cond.child_value("averaging"))
+        cond = cond.next_sibling()
+
+    # OBS: last channels (type "meta") carry the condition id, the number of averaged trials and of rejected ones
     ch = info.desc().child("channels").child("channel")
     labels = []
-    for i in range(n_channels):
-        labels.append(ch.child_value("label"))
+    meta_ids = {}
+    for i in range(info.channel_count()):
+        if ch.child_value("type") == "meta":
+            meta_ids[ch.child_value("label")] = i
+        else:
+            labels.append(ch.child_value("label"))
         ch = ch.next_sibling()
 
     x_info = info.desc().child("x_info")
     pause_pre_ev = float(x_info.child_value("pause_pre_ev"))
-    event_length = float(x_info.child_value("event_length"))
-    pause_post_ev = float(x_info.child_value("pause_post_ev"))
     EEG_srate = float(x_info.child_value("EEG_srate"))
-    time_steps = np.arange(-pause_pre_ev, event_length + pause_post_ev, 1 / EEG_srate)  # list containing steps, used in plot
+    # OBS: averages may be sent at a lower rate than the EEG one
+    output_srate = float(x_info.child_value("output_srate")) if x_info.child_value("output_srate") != "" else EEG_srate
+    subject = x_info.child_value("subject")  # name of the EEG stream of the averages, in multi-stream mode
+    return dequeues_len, cond_names, cond_modes, labels, meta_ids["condition"], meta_ids["n_trials"], \
+        meta_ids.get("n_rejected"), pause_pre_ev, output_srate, subject
+
+
+def grid_shape(n_channels):  # number of columns and rows of the subplots
+    n_col = int(np.ceil(n_channels / MAX_ROWS))
+    return n_col, int(np.ceil(n_channels / n_col))
+
+
+def create_plots(fig, time_steps, segment_avgs, labels, cond_names):  # (re)create one subplot for each channel
+    fig.clear()
+    n_channels = len(labels)
+    n_conditions = len(cond_names)
+    n_col, n_row = grid_shape(n_channels)
+    # create subplots structure (according to n_channels)
+    spec = gridspec.GridSpec(ncols=n_col, nrows=n_row, figure=fig)
+    cond_lines = [[0 for _ in range(n_channels)] for _ in range(n_conditions)]
+    diff_line = [0 for _ in range(n_channels)]
+    axs = []
+    for i in range(n_channels):
+        row = i % n_row
+        col = int(i / n_row)
+        ax = fig.add_subplot(spec[row, col])
+        for c in range(n_conditions):
+            cond_lines[c][i], = ax.plot(time_steps, segment_avgs[c][:, i], color=COND_COLORS[c % len(COND_COLORS)])
+        diff_line[i], = ax.plot(time_steps, avg_diff(segment_avgs)[:, i], color='k')
+        ax.plot(time_steps, avg_diff(segment_avgs)[:, i], ':', color='grey')  # dashed line at y==0
+        ax.set(ylabel=labels[i] + " [$\mu$V]")  # put channel label
+        if (i % n_row) != (n_row - 1) and i != (n_channels - 1):
+            ax.tick_params(axis='x', label1On=False)  # want to show x_ticks only in last row of grid
+        else:
+            ax.set(xlabel="Time [s]")
+        axs.append(ax)
+    line_labels = [name.capitalize() + " event" for name in cond_names] + ["Difference"]
+    fig.legend(labels=line_labels, loc='upper right', borderaxespad=0.1, prop={'size': 8})
+    fig.suptitle("\n", horizontalalignment='center', fontsize=5)  # just to leave same space occupied later by real title
+    fig.canvas.draw()
+    fig.canvas.flush_events()
+    plt.pause(0.1)
+    return axs, cond_lines, diff_line
+
+
+def main():
+    if SHARED_MEMORY:
+        # Get data from shared memory ------------------------------------------------------------------------------------------
+        print("Looking for the shared avgs...", end=" ")
+        shared_avg = SharedAvgReader()  # waits for the receiver to create them
+        print("done!")
+
+        dequeues_len = shared_avg.length
+        cond_names = shared_avg.meta["condition_names"]
+        n_conditions = len(cond_names)
+        cond_modes = shared_avg.meta.get("averaging", [""] * n_conditions)  # averaging mode of each condition
+        labels = shared_avg.meta["labels"]
+        n_channels = len(labels)
+        pause_pre_ev = float(shared_avg.meta["pause_pre_ev"])
+        output_srate = float(shared_avg.meta["output_srate"])
+        subject = ""
+    else:
+        # Get data from LSL ----------------------------------------------------------------------------------------------------
+        # first resolve the avg stream on the lsl network
+        print("Looking for the avg stream...", end=" ")
+        avg_stream = resolve_avg_stream()
+        # create a new inlet to read from the stream
+        avg_inlet = StreamInlet(avg_stream, recover=False)
+        print("done!")
+
+        # get stream info
+        info = avg_inlet.info()
+        dequeues_len, cond_names, cond_modes, labels, cond_col, trials_col, rejected_col, pause_pre_ev, output_srate, \
+            subject = avg_stream_meta(info)
+        n_conditions = len(cond_names)
+        n_channels = len(labels)
+        chunk = np.zeros((dequeues_len, info.channel_count()))
+    # one plot for each subject, in multi-stream mode
+    output_file = OUTPUT_FILE if AVG_SOURCE_ID is None else OUTPUT_FILE.replace('.png', '_' + AVG_SOURCE_ID + '.png')
+    time_steps = np.arange(dequeues_len) / output_srate - pause_pre_ev  # list containing steps, used in plot
 
     # Initialization -------------------------------------------------------------------------------------------------------------
-    f_segment_avg = np.zeros((dequeues_len, n_channels))
-    r_segment_avg = np.zeros((dequeues_len, n_channels))
-    chunk = np.zeros((dequeues_len, n_channels))
+    # averaged potentials of each condition (with shared memory, the copy of the newest ones kept by the reader)
+    segment_avgs = shared_avg.averages if SHARED_MEMORY else np.zeros((n_conditions, dequeues_len, n_channels))
+    n_trials = np.zeros(n_conditions, dtype=int)  # number of trials averaged for each condition
+    n_rejected = np.zeros(n_conditions, dtype=int)  # number of trials rejected for each condition
     event_init = 0
-    s_type = 0
+    cond_id = 0
+    resets = 0  # number of resets (restart or discard) already plotted, with shared memory
+    closing = False
+    reconfigured = False  # the Receiver has changed the window of the epochs or the channels (config command)
 
     plotting = False  # used to know if execution interrupted while updating plots
     plt.ion()  # to plot always on same window
 
     # window sizing warning
-    n_col = int(np.ceil(n_channels / MAX_ROWS))
-    n_row = int(np.ceil(n_channels / n_col))
+    n_col, n_row = grid_shape(n_channels)
     if n_channels > MAX_ROWS * MAX_COLS:
         warnings.formatwarning = warning_on_one_line
         warnings.warn("the detected EEG stream has more than {} channels, thus the window of the plots may be not correctly sized."
@@ -142,34 +265,9 @@ def main():
                      figsize=((monitor_w / my_dpi) * n_col / MAX_COLS, ((0.97 * monitor_h) / my_dpi) * n_row / MAX_ROWS),
                      dpi=my_dpi)
     fig.set_constrained_layout_pads(w_pad=0.1, h_pad=0.1)  # add some margin
-    fig.canvas.manager.set_window_title('Channels averaging')
+    fig.canvas.manager.set_window_title('Channels averaging' + (" - " + subject if subject != "" else ""))
 
-    # create subplots structure (according to n_channels)
-    spec = gridspec.GridSpec(ncols=n_col, nrows=n_row, figure=fig)
-    rare_line = [0 for _ in range(n_channels)]
-    freq_line = [0 for _ in range(n_channels)]
-    diff_line = [0 for _ in range(n_channels)]
-    axs = []
-    for i in range(n_channels):
-        row = i % n_row
-        col = int(i / n_row)
-        ax = fig.add_subplot(spec[row, col])
-        rare_line[i], = ax.plot(time_steps, r_segment_avg[:, i], color=(0.42, 0.68, 0.84, 1))
-        freq_line[i], = ax.plot(time_steps, f_segment_avg[:, i], color=(0.98, 0.42, 0.29, 1))
-        diff_line[i], = ax.plot(time_steps, r_segment_avg[:, i] - f_segment_avg[:, i], color='k')
-        ax.plot(time_steps, r_segment_avg[:, i] - f_segment_avg[:, i], ':', color='grey')  # dashed line at y==0
-        ax.set(ylabel=labels[i] + " [$\mu$V]")  # put channel label
-        if (i % n_row) != (n_row - 1) and i != (n_channels - 1):
-            ax.tick_params(axis='x', label1On=False)  # want to show x_ticks only in last row of grid
-        else:
-            ax.set(xlabel="Time [s]")
-        axs.append(ax)
-    line_labels = ["Rare event", "Frequent event", "Difference"]
-    fig.legend(labels=line_labels, loc='upper right', borderaxespad=0.1, prop={'size': 8})
-    fig.suptitle("\n", horizontalalignment='center', fontsize=5)  # just to leave same space occupied later by real title
-    fig.canvas.draw()
-    fig.canvas.flush_events()
-    plt.pause(0.1)
+    axs, cond_lines, diff_line = create_plots(fig, time_steps, segment_avgs, labels, cond_names)
 
     # define handler for whenever the application is interrupted (e.g. with ctrl+c), to save current plots
     def sigint_handler():
@@ -178,12 +276,12 @@ def main():
         print("Saving obtained plots in 'output' folder...", end=" ")
         if plotting:  # i.e. code interrupted while updating plots
             print("(finishing the plot latest event, occurred at " + str(event_init) + "s, from where interrupted...", end=" ")
-            channels_plot(fig, axs, time_steps, f_segment_avg, r_segment_avg,
-                          event_init, s_type, rare_line, freq_line, diff_line)  # to make sure to have it updated!
+            channels_plot(fig, axs, time_steps, segment_avgs, event_init, [cond_id], cond_lines, diff_line,
+                          trials_info(cond_names, n_trials, n_rejected, cond_modes))  # to make sure to have it updated!
             print("done!)", end=" ")
         if not os.path.exists(OUTPUT_PATH):
             os.makedirs(OUTPUT_PATH)
-        plt.savefig(os.path.join(OUTPUT_PATH, OUTPUT_FILE))
+        plt.savefig(os.path.join(OUTPUT_PATH, output_file))
         print("done!")
         sys.exit()
 
@@ -219,19 +317,91 @@ def main():
     # Read data ------------------------------------------------------------------------------------------------------------------
     while True:
         try:
+            if SHARED_MEMORY:
+                # newest averages of all the conditions (those published while plotting are coalesced)
+                if not shared_avg.wait(timeout=1):
+                    if shared_avg.closed:
+                        break  # closing condition, exit the while cycle
+                    continue
+                if shared_avg.resets != resets:  # in case of a discard/restart (stop + play) command
+                    resets = shared_avg.resets
+                    n_trials[:], n_rejected[:] = shared_avg.n_trials, shared_avg.n_rejected
+                    if shared_avg.reset_time == 0.00001:  # restart (stop + play) case
+                        print("Resetting to start from scratch...", end="")
+                        event_init = 0.0
+                        print("done!")
+                    else:
+                        event_init = round(shared_avg.reset_time, 4)
+                    plotting = True
+                    cond_lines, diff_line = reset_plot(fig, axs, time_steps, segment_avgs, event_init, cond_lines, diff_line,
+                                                       trials_info(cond_names, n_trials, n_rejected, cond_modes))
+                    plotting = False
+                    if DEBUG_PRINT:
+                        print("Avgs reset at " + str(event_init) + "s")
+                        print("===========================================================")
+                    continue  # goes to next iteration
+                if n_trials.sum() == 0:  # i.e. first time printed something in this cycle (or after restart)
+                    print("Receiving data...")
+                # conditions updated since the last plot
+                cond_ids = np.flatnonzero((shared_avg.n_trials != n_trials) | (shared_avg.n_rejected != n_rejected))
+                n_trials[:], n_rejected[:] = shared_avg.n_trials, shared_avg.n_rejected
+                event_init = round(shared_avg.event_time, 4)
+                if len(cond_ids) > 0:
+                    cond_id = cond_ids[-1]
+                if DEBUG_PRINT:
+                    print("Avg data: ")
+                    print("\ttimestamp: " + str(event_init))
+                    print("\tconditions: " + ", ".join(cond_names[c] + " (" + str(n_trials[c]) + " trials, " +
+                                                       str(n_rejected[c]) + " rejected)" for c in cond_ids))
+                    print("===========================================================")
+                plotting = True
+                cond_lines, diff_line = channels_plot(fig, axs, time_steps, segment_avgs, event_init, cond_ids, cond_lines,
+                                                      diff_line, trials_info(cond_names, n_trials, n_rejected, cond_modes))
+                plotting = False
+                continue  # goes to next iteration
+
             # get new chunk
             for i in range(dequeues_len):
                 chunk[i], event_init = avg_inlet.pull_sample()  # blocking call
-                if (chunk[i] == 0).sum() == chunk[i].size and event_init != 0.00001:  # all elements are 0 == closing condition
-                    s_type = -1  # flag to close everything
+                if (chunk[i] == 0).sum() == chunk[i].size and event_init == 0.00002:  # all elements are 0 == reconfigured
+                    reconfigured = True
                     break  # exit the for cycle
-            if s_type == -1:
+                if (chunk[i] == 0).sum() == chunk[i].size and event_init == 0.00003:  # all elements are 0 == closing condition
+                    closing = True  # flag to close everything
+                    break  # exit the for cycle
+            if closing:
                 break  # exit the while cycle
+            if reconfigured:  # new window of the epochs and/or channels, sent on a new avg stream
+                reconfigured = False
+                sys.stdout.write("\n")
+                print("Receiver reconfigured, looking for the new avg stream...", end=" ")
+                created_at = info.created_at()
+                avg_inlet.close_stream()
+                avg_inlet = StreamInlet(resolve_avg_stream(created_at), recover=False)
+                info = avg_inlet.info()
+                dequeues_len, cond_names, cond_modes, labels, cond_col, trials_col, rejected_col, pause_pre_ev, \
+                    output_srate, subject = avg_stream_meta(info)
+                n_channels = len(labels)
+                chunk = np.zeros((dequeues_len, info.channel_count()))
+                time_steps = np.arange(dequeues_len) / output_srate - pause_pre_ev
+                segment_avgs = np.zeros((n_conditions, dequeues_len, n_channels))
+                # re-layout of the subplots (the averages follow, as after a reset)
+                n_col, n_row = grid_shape(n_channels)
+                fig.set_size_inches((monitor_w / my_dpi) * n_col / MAX_COLS, ((0.97 * monitor_h) / my_dpi) * n_row / MAX_ROWS)
+                axs, cond_lines, diff_line = create_plots(fig, time_steps, segment_avgs, labels, cond_names)
+                print("done!")
+                continue  # goes to next iteration
             if USING_CONSOLE and event_init == 0.00001:  # in case of a discard/restart (stop + play) command
-                r_segment_avg[:] = chunk
-                for i in range(dequeues_len):  # pull new chunk
-                    chunk[i], event_init = avg_inlet.pull_sample()  # blocking call
-                f_segment_avg[:] = chunk
+                # one chunk for each condition, the last one with the time of the reset
+                for c in range(n_conditions):
+                    if c > 0:
+                        for i in range(dequeues_len):  # pull new chunk
+                            chunk[i], event_init = avg_inlet.pull_sample()  # blocking call
+                    cond_id = int(round(chunk[0, cond_col]))
+                    segment_avgs[cond_id] = chunk[:, :n_channels]
+                    n_trials[cond_id] = int(round(chunk[0, trials_col]))
+                    if rejected_col is not None:
+                        n_rejected[cond_id] = int(round(chunk[0, rejected_col]))
                 if event_init == 0.00001:  # restart (stop + play) case
                     print("Resetting to start from scratch...", end="")
                     event_init = 0.0
@@ -239,45 +409,42 @@ def main():
                 else:
                     event_init = round(event_init, 4)
                 plotting = True
-                rare_line, freq_line, diff_line = reset_plot(fig, axs, time_steps, f_segment_avg, r_segment_avg,
-                                                             event_init, rare_line, freq_line, diff_line)
+                cond_lines, diff_line = reset_plot(fig, axs, time_steps, segment_avgs, event_init, cond_lines, diff_line,
+                                                   trials_info(cond_names, n_trials, n_rejected, cond_modes))
                 plotting = False
                 if DEBUG_PRINT:
                     print("Avgs reset at " + str(event_init) + "s")
                     print("===========================================================")
                 continue  # goes to next iteration
-            if f_segment_avg[0][0] - r_segment_avg[0][0] == 0:  # i.e. first time printed something in this cycle (or after restart)
+            if n_trials.sum() == 0:  # i.e. first time printed something in this cycle (or after restart)
                 print("Receiving data...")
             if DEBUG_PRINT:
-                if f_segment_avg[0][0] - r_segment_avg[0][0] == 0:
+                if n_trials.sum() == 0:
                     print("")
                 print("Avg data: ")
                 print("\ttimestamp: " + str(round(event_init, 4)))
                 print("\tchunk: " + str(chunk))
                 print("----------------------------------------")
-            if event_init < 0:  # rare event
-                s_type = 1
-                event_init = abs(round(event_init, 4))  # recover real timestamp
-                r_segment_avg[:] = chunk
-            elif event_init > 0:  # frequent event
-                s_type = 0
-                event_init = round(event_init, 4)
-                f_segment_avg[:] = chunk
+            # recover condition, number of averaged trials and averaged potentials
+            cond_id = int(round(chunk[0, cond_col]))
+            n_trials[cond_id] = int(round(chunk[0, trials_col]))
+            if rejected_col is not None:
+                n_rejected[cond_id] = int(round(chunk[0, rejected_col]))
+            segment_avgs[cond_id] = chunk[:, :n_channels]
+            event_init = round(event_init, 4)
             if DEBUG_PRINT:
                 print("\ttimestamp: " + str(event_init))
-                print("\ts_type: " + str(s_type))
+                print("\tcondition: " + cond_names[cond_id] + " (" + str(n_trials[cond_id]) + " trials, " +
+                      str(n_rejected[cond_id]) + " rejected)")
                 print("===========================================================")
 
             plotting = True
-            rare_line, freq_line, diff_line = channels_plot(fig, axs, time_steps, f_segment_avg, r_segment_avg,
-                                                            event_init, s_type, rare_line, freq_line, diff_line)
+            cond_lines, diff_line = channels_plot(fig, axs, time_steps, segment_avgs, event_init, [cond_id], cond_lines,
+                                                  diff_line, trials_info(cond_names, n_trials, n_rejected, cond_modes))
             plotting = False
 
             if DEBUG_PRINT:
-                if s_type == 1:  # rare event
-                    print("Plotted rare event occurred at " + str(event_init) + "s")
-                else:  # frequent event
-                    print("Plotted frequent event occurred at " + str(event_init) + "s")
+                print("Plotted " + cond_names[cond_id] + " event occurred at " + str(event_init) + "s")
                 print("===========================================================")
 
         except (pylsl.pylsl.LostError, pylsl.pylsl.TimeoutError):  # i.e. if connection lost
@@ -290,19 +457,22 @@ def main():
             print("done!")
             if not os.path.exists(OUTPUT_PATH):
                 os.makedirs(OUTPUT_PATH)
-            plt.savefig(os.path.join(OUTPUT_PATH, OUTPUT_FILE))
+            plt.savefig(os.path.join(OUTPUT_PATH, output_file))
             print("Saving obtained plots in 'output' folder... done!")
             sys.exit()
 
     sys.stdout.write("\n")
     print('Session ended!')
     print("Closing streams...", end=" ")
-    avg_inlet.close_stream()
+    if SHARED_MEMORY:
+        shared_avg.close()
+    else:
+        avg_inlet.close_stream()
     print("done!")
     print("Saving obtained plots in 'output' folder...", end=" ")
     if not os.path.exists(OUTPUT_PATH):
         os.makedirs(OUTPUT_PATH)
-    plt.savefig(os.path.join(OUTPUT_PATH, OUTPUT_FILE))
+    plt.savefig(os.path.join(OUTPUT_PATH, output_file))
     print("done!")
     if USING_CONSOLE:
         # send msg to console
@@ -0,0 +1,261 @@
+"""Online averaging of the epochs received by the Receiver, separately for each condition (i.e. marker type)"""
+import numpy as np
+
+
+# averaging modes: all the epochs with the same weight, only the last ones, or weights halved every <half_life> epochs
+MODES = ['cumulative', 'window', 'exponential']
+
+
+class EpochWindow:
+    """
+    Ring of the last <size> epochs of a condition, with their running sum and sum of squares, so that an epoch is added (and
+    the oldest one subtracted) in O(1) and in place.
+    Once restored to a previous state (e.g. rolled back), the epochs of the window that have been overwritten meanwhile are
+    missing from the ring: their sum is kept, and each of them leaves the window with an equal share of it.
+
+    Parameters:
+        size (int): Number of epochs kept.
+        length (int): Number of samples of each epoch.
+        n_channels (int): Number of channels of each epoch.
+    """
+
+    def __init__(self, size, length, n_channels):
+        self.epochs = np.zeros((size, length, n_channels))
+        self.index = np.zeros(size, dtype=int)  # number of each epoch in the condition (1 for the first), 0 if empty slot
+        self.total = np.zeros((length, n_channels))
+        self.total_sq = np.zeros((length, n_channels))
+        self.n = 0  # number of epochs in the window
+        self.missing = 0  # number of epochs in the window but missing from the ring (overwritten before a restore)
+        self.missing_total = np.zeros((length, n_channels))
+        self.missing_total_sq = np.zeros((length, n_channels))
+
+    def reset(self):
+        self.index[:] = 0
+        self.total[:] = 0
+        self.total_sq[:] = 0
+        self.n = 0
+        self.missing = 0
+        self.missing_total[:] = 0
+        self.missing_total_sq[:] = 0
+
+    def add(self, number, epoch, scratch):  # add the <number>-th epoch of the condition, in place of the oldest one
+        slot = (number - 1) % len(self.index)
+        if self.index[slot] > 0:  # full ring, the oldest epoch leaves it
+            self.total -= self.epochs[slot]
+            np.multiply(self.epochs[slot], self.epochs[slot], out=scratch)
+            self.total_sq -= scratch
+        elif self.missing > 0 and number > len(self.index):  # the oldest epoch is a missing one, its share leaves the sums
+            np.divide(self.missing_total, self.missing, out=scratch)
+            self.total -= scratch
+            self.missing_total -= scratch
+            np.divide(self.missing_total_sq, self.missing, out=scratch)
+            self.total_sq -= scratch
+            self.missing_total_sq -= scratch
+            self.missing -= 1
+        else:
+            self.n += 1
+        np.copyto(self.epochs[slot], epoch)
+        self.index[slot] = number
+        self.total += epoch
+        np.multiply(epoch, epoch, out=scratch)
+        self.total_sq += scratch
+
+    def restore(self, number, mean, m2):
+        """
+        Restores the window as it was after the <number>-th epoch (e.g. rolled back), given its mean and M2 at that time: the
+        epochs following it are dropped, the ones overwritten meanwhile are counted as missing.
+        """
+        self.index[self.index > number] = 0
+        kept = self.index > 0
+        self.n = min(number, len(self.index))
+        self.missing = self.n - int(kept.sum())
+        np.multiply(mean, self.n, out=self.total)
+        np.multiply(self.total, mean, out=self.total_sq)
+        self.total_sq += m2
+        np.subtract(self.total, np.sum(self.epochs[kept], axis=0), out=self.missing_total)
+        np.subtract(self.total_sq, np.sum(self.epochs[kept] ** 2, axis=0), out=self.missing_total_sq)
+
+
+class ConditionAverages:
+    """
+    Registry of the conditions to be averaged, keyed by marker string. For each condition it keeps, in preallocated arrays
+    updated in place, the running mean of the epochs, the sum of squared deviations from it (M2, to get variance and standard
+    error), the number of averaged epochs and the number of rejected ones.
+    Each condition has its own averaging mode (see MODES): 'cumulative' (Welford's algorithm, all the epochs with the same
+    weight), 'window' (the last <window> epochs, see EpochWindow) or 'exponential' (weighted Welford's algorithm, the weight
+    of each epoch halved every <half_life> epochs). The sum of the weights (and of their squares) gives the effective number
+    of averaged epochs; the count is always the number of all the averaged epochs.
+
+    Parameters:
+        conditions (list): Marker strings of the conditions, the position in the list is the id of the condition.
+        length (int): Number of samples of each epoch.
+        n_channels (int): Number of channels of each epoch.
+        modes (list): Averaging mode of each condition, None for all 'cumulative'.
+        window (int): Number of the last epochs averaged, for the 'window' mode.
+        half_life (float): Number of epochs after which the weight of an epoch is halved, for the 'exponential' mode.
+    """
+
+    def __init__(self, conditions, length, n_channels, modes=None, window=50, half_life=20):
+        self.conditions = list(conditions)
+        self.ids = {marker: i for i, marker in enumerate(self.conditions)}
+        self.modes = list(modes) if modes is not None else ['cumulative'] * len(self.conditions)
+        unknown = [mode for mode in self.modes if mode not in MODES]
+        if len(self.modes) != len(self.conditions) or len(unknown) > 0:
+            raise ValueError("expected one averaging mode for each condition, among " + str(MODES) + ", got " + str(modes))
+        self.window = window
+        self.half_life = half_life
+        self.mean = np.zeros((len(self.conditions), length, n_channels))
+        self.m2 = np.zeros((len(self.conditions), length, n_channels))
+        self.count = np.zeros(len(self.conditions), dtype=int)
+        self.rejected = np.zeros(len(self.conditions), dtype=int)
+        self.weight = np.zeros(len(self.conditions))   # sum of the weights of the averaged epochs
+        self.weight2 = np.zeros(len(self.conditions))  # sum of their squares
+        # factor applied to the weights at each new epoch (1 if cumulative)
+        self.decay = np.array([0.5 ** (1 / half_life) if mode == 'exponential' else 1.0 for mode in self.modes])
+        self.windows = {cond_id: EpochWindow(window, length, n_channels)
+                        for cond_id, mode in enumerate(self.modes) if mode == 'window'}
+        # scratch buffers, to avoid allocations at each update
+        self._delta = np.zeros((length, n_channels))
+        self._delta_new = np.zeros((length, n_channels))
+
+    def reset(self):
+        self.mean[:] = 0
+        self.m2[:] = 0
+        self.count[:] = 0
+        self.rejected[:] = 0
+        self.weight[:] = 0
+        self.weight2[:] = 0
+        for window in self.windows.values():
+            window.reset()
+
+    def describe(self, cond_id):  # averaging mode of the given condition, with its parameter (e.g. for the Plotter)
+        mode = self.modes[cond_id]
+        if mode == 'window':
+            return "window " + str(self.window)
+        if mode == 'exponential':
+            return "exponential " + str(self.half_life)
+        return mode
+
+    def reject(self, cond_id):  # count an epoch of the given condition not averaged (e.g. containing artifacts)
+        self.rejected[cond_id] += 1
+
+    def update(self, cond_id, epoch):  # add a (samples x channels) epoch to the averages of the given condition
+        self.count[cond_id] += 1
+        if cond_id in self.windows:
+            self._update_window(cond_id, epoch)
+            return
+        decay = self.decay[cond_id]
+        if decay != 1:  # weights of the previous epochs reduced (M2 is a weighted sum as well)
+            self.m2[cond_id] *= decay
+        self.weight[cond_id] = decay * self.weight[cond_id] + 1
+        self.weight2[cond_id] = decay ** 2 * self.weight2[cond_id] + 1
+        np.subtract(epoch, self.mean[cond_id], out=self._delta)
+        np.divide(self._delta, self.weight[cond_id], out=self._delta_new)
+        self.mean[cond_id] += self._delta_new
+        np.subtract(epoch, self.mean[cond_id], out=self._delta_new)
+        self._delta_new *= self._delta
+        self.m2[cond_id] += self._delta_new
+
+    def _update_window(self, cond_id, epoch):
+        window = self.windows[cond_id]
+        window.add(self.count[cond_id], epoch, self._delta)
+        self._window_stats(cond_id)
+
+    def _window_stats(self, cond_id):  # mean and M2 of the epochs in the window, from their sums
+        window = self.windows[cond_id]
+        self.weight[cond_id] = window.n
+        self.weight2[cond_id] = window.n
+        if window.n == 0:
+            self.mean[cond_id] = 0
+            self.m2[cond_id] = 0
+            return
+        np.divide(window.total, window.n, out=self.mean[cond_id])
+        np.multiply(window.total, self.mean[cond_id], out=self._delta)
+        np.subtract(window.total_sq, self._delta, out=self.m2[cond_id])
+        np.maximum(self.m2[cond_id], 0, out=self.m2[cond_id])  # OBS: rounding errors could make it slightly negative
+
+    def restored(self):  # windows restored from the (rolled back) counts, means and M2, see EpochWindow.restore
+        for cond_id, window in self.windows.items():
+            window.restore(self.count[cond_id], self.mean[cond_id], self.m2[cond_id])
+            self._window_stats(cond_id)
+
+    def effective_count(self, cond_id):  # number of epochs equivalent to the weighted ones (the count itself if cumulative)
+        if self.weight2[cond_id] == 0:
+            return 0.0
+        return self.weight[cond_id] ** 2 / self.weight2[cond_id]
+
+    def variance(self, cond_id):  # sample variance of the epochs of the given condition, for each sample and channel
+        if self.count[cond_id] < 2 or self.effective_count(cond_id) <= 1:
+            return np.zeros_like(self.m2[cond_id])
+        # OBS: unbiased for reliability weights, i.e. M2 / (count - 1) if cumulative
+        return self.m2[cond_id] / (self.weight[cond_id] - self.weight2[cond_id] / self.weight[cond_id])
+
+    def std_error(self, cond_id):  # standard error of the mean of the given condition
+        if self.count[cond_id] < 2 or self.effective_count(cond_id) <= 1:
+            return np.zeros_like(self.m2[cond_id])
+        return np.sqrt(self.variance(cond_id) / self.effective_count(cond_id))
+
+
+class CheckpointRing:
+    """
+    Bounded ring of snapshots of the averages (mean, M2, count, rejected epochs and weights of each condition), taken every
+    <interval> seconds of data in preallocated memory, so that the averages can be rolled back by up to <window> seconds
+    (e.g. to discard data).
+    Since snapshots are taken at a fixed cadence, the one to roll back to is found with an index computation.
+
+    Parameters:
+        averages (ConditionAverages): Averages to be saved.
+        interval (float): Time (s) between consecutive snapshots.
+        window (float): Maximum time (s) that can be rolled back.
+    """
+
+    def __init__(self, averages, interval, window):
+        self.interval = interval
+        self.n_slots = int(np.ceil(window / interval)) + 1
+        self.mean = np.zeros((self.n_slots,) + averages.mean.shape)
+        self.m2 = np.zeros((self.n_slots,) + averages.m2.shape)
+        self.count = np.zeros((self.n_slots,) + averages.count.shape, dtype=int)
+        self.rejected = np.zeros((self.n_slots,) + averages.rejected.shape, dtype=int)
+        self.weight = np.zeros((self.n_slots,) + averages.weight.shape)
+        self.weight2 = np.zeros((self.n_slots,) + averages.weight2.shape)
+        self.first_time = None  # time of the first snapshot
+        self.n_taken = 0
+
+    def reset(self):
+        self.first_time = None
+        self.n_taken = 0
+
+    def update(self, averages, data_time):  # take the snapshots due at time <data_time> (of the newest sample)
+        if self.first_time is None:
+            self.first_time = data_time
+        # OBS: if more than one snapshot is due (e.g. after a gap), all of them get the current state
+        n_due = int(np.floor((data_time - self.first_time) / self.interval)) + 1
+        for n in range(max(self.n_taken, n_due - self.n_slots), n_due):
+            slot = n % self.n_slots
+            np.copyto(self.mean[slot], averages.mean)
+            np.copyto(self.m2[slot], averages.m2)
+            np.copyto(self.count[slot], averages.count)
+            np.copyto(self.rejected[slot], averages.rejected)
+            np.copyto(self.weight[slot], averages.weight)
+            np.copyto(self.weight2[slot], averages.weight2)
+        self.n_taken = max(self.n_taken, n_due)
+
+    def rollback(self, averages, data_time, seconds):
+        """
+        Restores in <averages> the newest snapshot taken at least <seconds> before <data_time> (or the oldest one available),
+        and drops the following ones. Returns the time of the restored snapshot, or None if no snapshot is available.
+        """
+        if self.n_taken == 0:
+            return None
+        n = int(np.floor((data_time - seconds - self.first_time) / self.interval))
+        n = min(max(n, self.n_taken - self.n_slots, 0), self.n_taken - 1)
+        slot = n % self.n_slots
+        np.copyto(averages.mean, self.mean[slot])
+        np.copyto(averages.m2, self.m2[slot])
+        np.copyto(averages.count, self.count[slot])
+        np.copyto(averages.rejected, self.rejected[slot])
+        np.copyto(averages.weight, self.weight[slot])
+        np.copyto(averages.weight2, self.weight2[slot])
+        averages.restored()  # OBS: the epochs of the windows are not saved, their sums are derived from the restored averages
+        self.n_taken = n + 1  # following snapshots refer to discarded data
+        return self.first_time + n * self.interval
@@ -0,0 +1,206 @@
+"""Headless throughput benchmark of the Receiver: its processing core (see Core.py) is driven as fast as possible by a synthetic
+EEG stream generated in the same process, without LSL streams nor the Console.
+
+The synthetic EEG is gaussian noise, with a P300-like positive peak added to all the channels after each rare marker; a marker
+is sent every ISI seconds, rare with probability P_RARE and frequent otherwise. The processing is the one set by the DSP
+pipeline (re-referencing and filters, see DspPipeline.py) and by the constants and flags of Processing.py (window of the epochs,
+gap policy, rejection, adaptive stopping): the averages are computed but not published, nothing is recorded. Only the
+processing is timed, not the generation of the samples.
+"""
+import getopt
+import os
+import sys
+import time
+
+import numpy as np
+
+import Processing
+from Processing import CONDITIONS, CONDITION_NAMES, DSP_PIPELINE, MAX_CHUNK_SAMPLES, build_core, load_dsp_pipeline
+
+# Constants -------------------------------------------------------------------------------------------------------------------------
+SRATE = 250             # Hz, sampling rate of the synthetic stream
+N_CHANNELS = 8          # number of channels of the synthetic stream
+ISI = 0.5               # s, time between consecutive markers
+DURATION = 600          # s, duration of the synthetic stream
+CHUNK_DURATION = 0.05   # s, duration of each block (as pulled by the chunked ingestion, at most MAX_CHUNK_SAMPLES)
+P_RARE = 0.2            # probability of each marker being rare (first condition), otherwise frequent (second condition)
+SEED = 0                # seed of the random generator
+
+# labels of the channels (the ones of Unicorn first, then numbered), so that the re-referencing of the Receiver can be applied
+CHANNEL_LABELS = ['Fz', 'C3', 'Cz', 'C4', 'Pz', 'PO7', 'Oz', 'PO8']
+
+# values defining the synthetic EEG (in the unit of the data, e.g. uV)
+NOISE_STD = 5.0         # standard deviation of the background noise
+P300_AMPLITUDE = 10.0   # peak of the response added after each rare marker
+P300_LATENCY = 0.3      # s, latency of the peak from the marker
+P300_WIDTH = 0.05       # s, width of the (gaussian) peak
+START_TIME = 1.0        # s, timestamp of the first sample (OBS: samples with timestamp 0 are not checked for gaps)
+
+PERCENTILES = [50, 95, 99]
+
+# Flags and variables for optional features -----------------------------------------------------------------------------------------
+TRACE_MEMORY = False    # flag to trace the peak of the memory allocated by the processing (slower), besides the peak RSS
+
+if TRACE_MEMORY:
+    import tracemalloc
+
+if os.name == 'posix':
+    import resource  # OBS: peak RSS not available on Windows
+
+
+class SyntheticSource:
+    """
+    Synthetic EEG stream, generated block by block: gaussian noise on all the channels, plus the P300 response following each
+    rare marker (spanning consecutive blocks if needed). Each block comes with the markers sent during it, each one with the
+    timestamp of the sample it refers to.
+
+    Parameters:
+        srate (float): Sampling rate of the stream.
+        n_channels (int): Number of channels of the stream.
+        isi (float): Time (s) between consecutive markers.
+        p_rare (float): Probability of each marker being rare.
+        chunk (int): Number of samples of each block.
+        seed (int): Seed of the random generator.
+    """
+
+    def __init__(self, srate, n_channels, isi, p_rare, chunk, seed=0):
+        self.srate = srate
+        self.n_channels = n_channels
+        self.isi_samples = max(int(round(isi * srate)), 1)
+        self.p_rare = p_rare
+        self.chunk = chunk
+        self.rng = np.random.default_rng(seed)
+        response_times = np.arange(int(np.ceil((P300_LATENCY + 3 * P300_WIDTH) * srate))) / srate
+        self.response = (P300_AMPLITUDE * np.exp(-((response_times - P300_LATENCY) / P300_WIDTH) ** 2)).astype(np.float32)
+        self.n_sent = 0                         # samples generated so far
+        self.next_marker = self.isi_samples     # index of the sample of the next marker
+        self.onsets = []                        # indexes of the samples of the rare markers whose response is not over yet
+
+    def next_block(self):  # next (samples x channels) block, with its timestamps and its (marker, timestamp) markers
+        start = self.n_sent
+        stop = start + self.chunk
+        block = self.rng.normal(0, NOISE_STD, (self.chunk, self.n_channels)).astype(np.float32)
+        times = START_TIME + np.arange(start, stop) / self.srate
+        markers = []
+        while self.next_marker < stop:
+            rare = self.rng.random() < self.p_rare
+            markers.append((CONDITIONS[0] if rare else CONDITIONS[1], START_TIME + self.next_marker / self.srate))
+            if rare:
+                self.onsets.append(self.next_marker)
+            self.next_marker += self.isi_samples
+        for onset in self.onsets:  # part of each response falling in this block
+            first = max(start - onset, 0)
+            last = min(stop - onset, len(self.response))
+            if last > first:
+                block[onset + first - start:onset + last - start] += self.response[first:last, np.newaxis]
+        self.onsets = [onset for onset in self.onsets if onset + len(self.response) > stop]
+        self.n_sent = stop
+        return block, times, markers
+
+
+def percentiles_string(values):  # percentiles (and maximum) of a list of durations, in ms
+    if len(values) == 0:
+        return "-"
+    values = np.array(values) * 1000
+    return ", ".join("p" + str(p) + " " + "{:.3f}".format(np.percentile(values, p)) for p in PERCENTILES) + \
+        ", max " + "{:.3f}".format(values.max())
+
+
+def main(argv):
+    srate = SRATE
+    n_channels = N_CHANNELS
+    isi = ISI
+    duration = DURATION
+    dsp_pipeline = DSP_PIPELINE
+
+    help_string = 'Benchmark.py -s <srate> -c <n_channels> -i <isi> -d <duration> -f <dsp_pipeline>'
+    try:
+        opts, args = getopt.getopt(argv, "hs:c:i:d:f:", longopts=["srate=", "channels=", "isi=", "duration=", "dsp_pipeline="])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt in ("-s", "--srate"):
+            srate = float(arg)
+        elif opt in ("-c", "--channels"):
+            n_channels = int(arg)
+        elif opt in ("-i", "--isi"):
+            isi = float(arg)
+        elif opt in ("-d", "--duration"):
+            duration = float(arg)
+        elif opt in ("-f", "--dsp_pipeline"):
+            dsp_pipeline = arg
+
+    labels = (CHANNEL_LABELS + ['Ch' + str(i + 1) for i in range(len(CHANNEL_LABELS), n_channels)])[:n_channels]
+    chunk = min(max(int(CHUNK_DURATION * srate), 1), MAX_CHUNK_SAMPLES)
+    source = SyntheticSource(srate, n_channels, isi, P_RARE, chunk, SEED)
+    n_blocks = int(np.ceil(duration * srate / chunk))
+
+    dsp_pipeline = load_dsp_pipeline(dsp_pipeline)
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    core = build_core(srate, labels, Processing.PAUSE_PRE_EV, Processing.EVENT_LENGTH, Processing.PAUSE_POST_EV, dsp_pipeline)
+    averages = core.averages
+    stopping = Processing.stopping_criterion(core) if Processing.ADAPTIVE_STOPPING else None
+    criterion_epochs = None  # epochs of each condition when the stopping criterion has been reached
+
+    block_times = []    # s, processing time of each block
+    event_times = []    # s, processing time of each epoch (filter, rejection and averaging of the epochs completed together)
+    elapsed = 0.0
+    print("Processing " + str(duration) + " s of " + str(n_channels) + " channels at " + str(srate) + " Hz...")
+    for _ in range(n_blocks):
+        block, times, markers = source.next_block()
+        start = time.perf_counter()
+        block, times, _ = core.receive(block, times)
+        core.buffer(block, times)
+        for marker, marker_time in markers:
+            core.schedule(marker, marker_time)
+        events, segments, gapped = core.pop_epochs()
+        if segments is not None:
+            epochs_start = time.perf_counter()
+            segments = core.filter(segments)
+            rejected, skipped = core.reject(segments, gapped)
+            for i, ((_, cond_id, _), data_array) in enumerate(zip(events, segments)):
+                if skipped[i]:
+                    continue
+                if rejected[i]:
+                    averages.reject(cond_id)
+                else:
+                    averages.update(cond_id, data_array)
+                    if stopping is not None and stopping.update(cond_id, data_array):
+                        criterion_epochs = stopping.count.copy()
+            stop = time.perf_counter()
+            event_times.extend([(stop - epochs_start) / len(events)] * len(events))
+        else:
+            stop = time.perf_counter()
+        block_times.append(stop - start)
+        elapsed += stop - start
+
+    n_samples = n_blocks * chunk
+    print("Processed " + str(n_samples) + " samples and " + str(len(event_times)) + " epochs in " +
+          "{:.3f}".format(elapsed) + " s")
+    print("Throughput: " + "{:.0f}".format(n_samples / elapsed) + " samples/s (" +
+          "{:.1f}".format(n_samples / elapsed / srate) + " times real time)")
+    print("Block processing time (ms, " + str(chunk) + " samples): " + percentiles_string(block_times))
+    print("Epoch processing time (ms): " + percentiles_string(event_times))
+    if os.name == 'posix':
+        # OBS: ru_maxrss is in kB on Linux, in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+        print("Peak RSS: " + "{:.1f}".format(max_rss) + " MB")
+    if TRACE_MEMORY:
+        print("Peak memory allocated by the processing: " +
+              "{:.1f}".format(tracemalloc.get_traced_memory()[1] / 2 ** 20) + " MB")
+        tracemalloc.stop()
+    print("Averaged epochs: " + ", ".join(name + " " + str(averages.count[c]) + " (rejected " + str(averages.rejected[c]) +
+                                          ")" for c, name in enumerate(CONDITION_NAMES)))
+    if stopping is not None:
+        print("Stopping criterion: " + ("reached after " + " and ".join(str(n) + " " + CONDITION_NAMES[c] for c, n in
+                                                                          enumerate(criterion_epochs)) + " epochs"
+                                        if criterion_epochs is not None else "not reached"))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+"""Online single-trial classification of the filtered epochs (target vs non-target), by xDAWN spatial filters + shrinkage LDA"""
+import numpy as np
+from scipy import linalg
+from scipy.linalg import blas
+
+
+class P300Classifier:
+    """
+    Single-trial classifier of the epochs, trained online during a calibration phase.
+    The epochs are decimated (mean over consecutive blocks of <decimation> samples); for each class the running mean of
+    the decimated epochs is kept, together with the pooled within-class scatter matrix (rank-one update at each trial, in
+    place) and the spatial covariance of the data. Since the features in the space of the spatial filters are a linear
+    projection of the decimated epochs, training needs no stored trials: xDAWN filters are computed from the mean target
+    epoch and the spatial covariance, then means and scatter are projected on them and the shrinkage LDA is solved.
+
+    Parameters:
+        length (int): Number of samples of each epoch.
+        n_channels (int): Number of channels of each epoch.
+        decimation (int): Number of consecutive samples averaged into each feature.
+        n_filters (int): Number of xDAWN spatial filters.
+        shrinkage (float): Shrinkage (between 0 and 1) of the covariance of the features towards a scaled identity.
+    """
+
+    def __init__(self, length, n_channels, decimation, n_filters, shrinkage):
+        self.decimation = decimation
+        self.n_dec = length // decimation  # OBS: last samples not filling a block are ignored
+        self.n_channels = n_channels
+        self.n_filters = min(n_filters, n_channels)
+        self.shrinkage = shrinkage
+        n_features = self.n_dec * n_channels
+        self.mean = np.zeros((2, n_features))   # mean decimated epoch of non-targets (0) and targets (1)
+        self.count = np.zeros(2, dtype=int)
+        # OBS: Fortran order, to be updated in place by BLAS
+        self.scatter = np.zeros((n_features, n_features), order='F')  # pooled within-class scatter
+        self.spatial_cov = np.zeros((n_channels, n_channels))          # sum of the spatial covariance of the epochs
+        self._delta = np.zeros(n_features)  # scratch buffer
+        self.filters = None     # (channels x filters) xDAWN spatial filters
+        self.weights = None     # LDA weights in the space of the filtered features
+        self.bias = 0.0
+
+    def reset(self):
+        self.mean[:] = 0
+        self.count[:] = 0
+        self.scatter[:] = 0
+        self.spatial_cov[:] = 0
+        self.filters = None
+        self.weights = None
+        self.bias = 0.0
+
+    @property
+    def trained(self):
+        return self.weights is not None
+
+    def decimate(self, epochs):  # (epochs x samples x channels) -> (epochs x decimated samples x channels)
+        n_used = self.n_dec * self.decimation
+        return epochs[:, :n_used].reshape(len(epochs), self.n_dec, self.decimation, self.n_channels).mean(axis=2)
+
+    def update(self, epoch, is_target):  # add a (samples x channels) epoch of the given class to the calibration statistics
+        x = self.decimate(epoch[np.newaxis])[0]
+        np.add(self.spatial_cov, x.T @ x, out=self.spatial_cov)
+        x = x.ravel()
+        k = int(is_target)
+        self.count[k] += 1
+        np.subtract(x, self.mean[k], out=self._delta)
+        self.mean[k] += self._delta / self.count[k]
+        # scatter += delta (x - new mean)^T, as rank-one update in place
+        blas.dger(1.0, self._delta, x - self.mean[k], a=self.scatter, overwrite_a=True)
+
+    def train(self):  # compute spatial filters and LDA weights from the statistics collected so far; False if not possible
+        if self.count.min() < 2:
+            return False
+        # xDAWN: filters maximizing the power of the mean target response w.r.t. the power of the whole signal
+        target = self.mean[1].reshape(self.n_dec, self.n_channels)
+        signal_cov = target.T @ target
+        data_cov = self.spatial_cov / (self.count.sum() * self.n_dec)
+        data_cov += 1e-9 * np.trace(data_cov) / self.n_channels * np.eye(self.n_channels)  # regularization, for flat channels
+        _, vectors = linalg.eigh(signal_cov, data_cov)
+        self.filters = vectors[:, ::-1][:, :self.n_filters]  # OBS: eigenvalues in ascending order
+        # projection of class means and scatter on the filters
+        means = (self.mean.reshape(2, self.n_dec, self.n_channels) @ self.filters).reshape(2, -1)
+        scatter = self.scatter.reshape(self.n_dec, self.n_channels, self.n_dec, self.n_channels)
+        scatter = np.einsum('aibj,ik,jl->akbl', scatter, self.filters, self.filters, optimize=True)
+        n_features = self.n_dec * self.n_filters
+        cov = scatter.reshape(n_features, n_features) / (self.count.sum() - 2)
+        # shrinkage towards the identity scaled by the mean variance
+        cov = (1 - self.shrinkage) * cov + self.shrinkage * np.trace(cov) / n_features * np.eye(n_features)
+        self.weights = linalg.solve(cov, means[1] - means[0], assume_a='pos')
+        self.bias = -self.weights @ (means[1] + means[0]) / 2
+        return True
+
+    def score(self, epochs):  # scores of a (epochs x samples x channels) stack, positive for targets (classifier trained)
+        features = (self.decimate(epochs) @ self.filters).reshape(len(epochs), -1)
+        return features @ self.weights + self.bias
@@ -0,0 +1,115 @@
+"""Processing core of the Receiver for one EEG stream, independent of LSL and of the console (see Receiver.py, Benchmark.py)"""
+import numpy as np
+
+from Averaging import ConditionAverages
+from EpochRing import EpochRing
+from EpochScheduler import EpochScheduler
+
+
+class ReceiverCore:
+    """
+    Everything done by the Receiver between the samples and markers received and the averages of the conditions: each block
+    of samples is projected (re-referencing and selection of the channels), checked for lost samples, filtered (streaming
+    mode) and buffered in the ring; each marker of a condition schedules an epoch; the completed epochs are filtered all
+    together (zero-phase filter, unless already filtered) and checked for artifacts, then averaged by the caller.
+
+    Parameters:
+        srate (float): Sampling rate of the stream.
+        conditions (list): Marker strings of the conditions averaged separately.
+        samples_pre_ev (int): Number of samples of each epoch before the event.
+        length (int): Number of samples of each epoch.
+        max_samples (int): Maximum number of samples received at once.
+        projection (ChannelProjection): Re-referencing and selection of the channels of the stream.
+        epoch_filter (EpochFilter): Zero-phase filter of the epochs, not used if <stream_filter> is given.
+        gaps (GapDetector): Detector of the lost samples.
+        gap_policy (str): Handling of the epochs containing lost samples (see Gaps.POLICIES).
+        stream_filter (StreamingFilter): Causal filter of the incoming samples, None to filter the epochs instead.
+        delay_time (float): Time (s) the samples filtered by <stream_filter> are shifted back by (group delay).
+        rejector (EpochRejector): Rejection of the epochs containing artifacts, None to not reject them.
+        modes (list): Averaging mode of each condition (see Averaging.MODES), None for all 'cumulative'.
+        window (int): Number of the last epochs averaged, for the 'window' mode.
+        half_life (float): Number of epochs after which the weight of an epoch is halved, for the 'exponential' mode.
+    """
+
+    def __init__(self, srate, conditions, samples_pre_ev, length, max_samples, projection, epoch_filter, gaps,
+                 gap_policy='average', stream_filter=None, delay_time=0.0, rejector=None, modes=None, window=50, half_life=20):
+        self.srate = srate
+        self.samples_pre_ev = samples_pre_ev
+        self.length = length
+        self.projection = projection
+        self.epoch_filter = epoch_filter
+        self.gaps = gaps
+        self.gap_policy = gap_policy
+        self.stream_filter = stream_filter
+        self.delay_time = delay_time
+        self.rejector = rejector
+        self.labels = projection.labels
+        self.n_channels = len(self.labels)
+        # ring of EEG data and timestamps (preallocated), holding the last <length> samples plus the ones of a whole block
+        # and 1 s of margin for late markers, so that segments completed by a block are never overwritten
+        self.ring = EpochRing(length + max_samples + int(srate), self.n_channels)
+        # scheduler of the events occurred but yet not considered, completed when the whole segment has been received
+        self.scheduler = EpochScheduler(samples_pre_ev, length, 1 / srate)
+        self.averages = ConditionAverages(conditions, length, self.n_channels, modes, window, half_life)
+        self.last_data_time = 0.0  # timestamp of the last sample received
+
+    def reset(self):  # restart from scratch (stop + play msgs)
+        self.ring.reset()
+        self.gaps.reset()
+        if self.stream_filter is not None:
+            self.stream_filter.reset()
+        self.scheduler.clear()
+        self.averages.reset()
+        if self.rejector is not None:
+            self.rejector.reset()
+
+    def receive(self, chunk, times):
+        """
+        Projects a (samples x channels) chunk of the stream and checks its timestamps. Returns the block and the timestamps to
+        be buffered (with the short gaps filled, if required) and the gaps found (see GapDetector.process).
+        """
+        block, times, gaps = self.gaps.process(self.projection.process(chunk), times)
+        self.last_data_time = times[-1]
+        return block, times, gaps
+
+    def buffer(self, block, times):  # append a block to the ring (filtered first in streaming mode)
+        if self.stream_filter is not None:
+            self.ring.extend(self.stream_filter.process(block), times - self.delay_time)
+        else:
+            self.ring.extend(block, times)
+
+    def schedule(self, marker, marker_time):  # schedule the epoch of a marker, if related to a condition; True if scheduled
+        if marker not in self.averages.ids:
+            return False
+        self.scheduler.add(marker_time, self.averages.ids[marker])  # with the id of the condition
+        return True
+
+    def pop_epochs(self):
+        """
+        Returns the (event timestamp, condition id, absolute index of first sample) of the epochs completed by the samples
+        received, in order of completion, the (epochs x samples x channels) stack of their segments (not filtered yet) and
+        which ones contain lost samples; the stack is None if no epoch has been completed.
+        """
+        completed = self.scheduler.pop_ready(self.ring)
+        if len(completed) == 0:
+            return completed, None, None
+        windows = [self.ring.window(seg_start, self.length) for _, _, seg_start in completed]
+        segments = np.stack([data for data, _ in windows])
+        gapped = self.gaps.check_epochs(np.stack([times for _, times in windows]))
+        return completed, segments, gapped
+
+    def filter(self, segments):  # zero-phase filter of a stack of segments (already filtered in streaming mode)
+        return segments if self.stream_filter is not None else self.epoch_filter.process(segments)
+
+    def reject(self, segments, gapped):
+        """
+        Checks a stack of filtered segments. Returns which ones are rejected (containing artifacts, or lost samples according
+        to the gap policy) and which ones are skipped (containing lost samples, 'skip' policy).
+        """
+        rejected = np.zeros(len(segments), dtype=bool)
+        if self.rejector is not None:  # all the segments checked at once
+            rejected, _ = self.rejector.process(segments)
+        if self.gap_policy in ('invalid', 'interpolate'):  # OBS: with interpolation, only gaps too long to be filled remain
+            rejected = rejected | gapped
+        skipped = gapped if self.gap_policy == 'skip' else np.zeros(len(segments), dtype=bool)
+        return rejected, skipped
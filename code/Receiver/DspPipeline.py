@@ -0,0 +1,153 @@
+"""Declarative description of the DSP pipeline of the Receiver (json or yaml file), with the filter designs cached on disk"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from scipy import signal as dsp
+
+from Filters import design_streaming_sos
+
+# stages of a pipeline (in the order they are applied) and default values of their parameters, missing stages not applied
+STAGES = {
+    'reference': {'reference': None,    # None (as received), 'car', 'laplacian' or 'bipolar' (see Projection.py)
+                  'neighbours': {},     # labels of the neighbours of each channel, for the 'laplacian' reference
+                  'pairs': []},         # (first, second) labels of the channels, for the 'bipolar' reference
+    'bandpass': {'lower_cof': 1.0,      # Hz, lower cutoff frequency
+                 'upper_cof': 24.0,     # Hz, upper cutoff frequency
+                 'fir_numtaps': 1000,   # number of taps of the FIR filter of the epochs
+                 'iir_order': 4},       # order of the Butterworth filter of the streaming mode
+    'notch': {'notch_freq': 50.0,       # Hz, frequency to be removed from signal
+              'quality_factor': 30.0},
+    'resample': {'output_rate': None},  # Hz, rate of the averages sent to the Plotter (None for the rate of the EEG)
+}
+
+
+def load_pipeline(path):
+    """
+    Reads the description of a pipeline: a json (or yaml) object with an optional "description" and the list of its
+    "stages", each one an object with the name of the "stage" (see STAGES) and the values of the parameters changed.
+
+    Parameters:
+        path (str): Location of the file (yaml if its extension is .yaml or .yml).
+
+    Returns:
+        dict: Description of the pipeline.
+    """
+    with open(path) as file:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            import yaml  # OBS: requires PyYAML
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+class FilterCache:
+    """
+    Persistent cache of the filter designs, one .npy file for each design, named after the hash of its kind, its parameters
+    and the sampling rate. The designs found are also kept in memory (e.g. for several streams with the same rate).
+
+    Parameters:
+        path (str): Folder of the cache (created if missing), None to keep the designs in memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.designs = {}
+
+    def get(self, kind, params, srate, design):  # cached design, computed by design() (and saved) if missing
+        key = hashlib.sha1(json.dumps([kind, params, float(srate)], sort_keys=True).encode()).hexdigest()[:16]
+        if key in self.designs:
+            return self.designs[key]
+        file_path = os.path.join(self.path, kind + "_" + key + ".npy") if self.path is not None else None
+        if file_path is not None and os.path.isfile(file_path):
+            self.designs[key] = np.load(file_path)
+            return self.designs[key]
+        self.designs[key] = design()
+        if file_path is not None:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                tmp_path = file_path + ".tmp"
+                with open(tmp_path, 'wb') as file:
+                    np.save(file, self.designs[key])
+                os.replace(tmp_path, file_path)  # OBS: atomic, so that a partially written design is never read
+            except OSError as e:
+                print("Filter design not cached: " + str(e))
+        return self.designs[key]
+
+
+class DspPipeline:
+    """
+    Stages of the processing applied by the Receiver (re-referencing, band-pass and notch filters, resampling of the averages),
+    with the default values of the parameters not given. The filters are designed for the actual rate of each stream and
+    taken from <cache> when already designed for the same parameters and rate.
+
+    Parameters:
+        config (dict): Description of the pipeline (see load_pipeline).
+        cache (FilterCache): Cache of the filter designs.
+        name (str): Name of the pipeline (e.g. its file).
+    """
+
+    def __init__(self, config, cache, name=""):
+        self.name = name
+        self.description = config.get('description', "")
+        self.cache = cache
+        self.stages = {}
+        order = list(STAGES)
+        for stage in config.get('stages', []):
+            params = dict(stage)
+            kind = params.pop('stage', None)
+            if kind not in STAGES:
+                raise ValueError("unknown stage '" + str(kind) + "', expected one of " + str(order))
+            if kind in self.stages:
+                raise ValueError("stage '" + kind + "' given twice")
+            if len(self.stages) > 0 and order.index(kind) < order.index(list(self.stages)[-1]):
+                raise ValueError("stage '" + kind + "' out of order, the stages are applied as " + str(order))
+            unknown = [param for param in params if param not in STAGES[kind]]
+            if len(unknown) > 0:
+                raise ValueError("unknown parameters of stage '" + kind + "': " + str(unknown))
+            self.stages[kind] = dict(STAGES[kind], **params)
+
+    def params(self, kind):  # parameters of a stage, None if not in the pipeline
+        return self.stages.get(kind)
+
+    @property
+    def reference(self):
+        return self.stages['reference']['reference'] if 'reference' in self.stages else None
+
+    @property
+    def output_rate(self):
+        return self.stages['resample']['output_rate'] if 'resample' in self.stages else None
+
+    def fir(self, srate):  # coefficients of the FIR band-pass filter of the epochs (a single unit tap without band-pass)
+        band = self.params('bandpass')
+        if band is None:
+            return np.ones(1)
+        return self.cache.get('fir', band, srate, lambda: dsp.firwin(band['fir_numtaps'], [band['lower_cof'], band['upper_cof']],
+                                                                      pass_zero=False, fs=srate))
+
+    def notch_sos(self, srate):  # second-order sections of the notch filter, None without notch (or if above Nyquist)
+        notch = self.params('notch')
+        if notch is None or notch['notch_freq'] >= srate / 2:
+            return None
+        return self.cache.get('notch', notch, srate,
+                              lambda: dsp.tf2sos(*dsp.iirnotch(notch['notch_freq'], notch['quality_factor'], srate)))
+
+    def streaming_sos(self, srate):  # second-order sections of the whole cascade of the streaming mode, None if no filters
+        band = self.params('bandpass')
+        notch = self.params('notch')
+        if notch is not None and notch['notch_freq'] >= srate / 2:  # nothing to remove, frequency not in the signal
+            notch = None
+        if band is None and notch is None:
+            return None
+        params = {'bandpass': band, 'notch': notch}
+        return self.cache.get('streaming', params, srate, lambda: design_streaming_sos(
+            srate, band['lower_cof'] if band else None, band['upper_cof'] if band else None, band['iir_order'] if band else None,
+            notch['notch_freq'] if notch else None, notch['quality_factor'] if notch else None))
+
+    def centre_freq(self):  # frequency (Hz) the group delay of the streaming filter is evaluated at, None without band-pass
+        band = self.params('bandpass')
+        return np.sqrt(band['lower_cof'] * band['upper_cof']) if band is not None else None
+
+    def to_dict(self):  # description of the pipeline as applied (with the default values), e.g. for the recorded metadata
+        return {'name': self.name, 'description': self.description,
+                'stages': [dict(stage=kind, **params) for kind, params in self.stages.items()]}
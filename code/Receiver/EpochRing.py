@@ -0,0 +1,94 @@
+"""Preallocated ring buffer holding the latest EEG samples and their timestamps, used by the Receiver to extract epochs"""
+import numpy as np
+
+
+class EpochRing:
+    """
+    Fixed-size (samples x channels) ring of EEG data, with a parallel float64 ring of timestamps.
+
+    Every sample is written twice, at position i and i + capacity of a buffer twice as long as the ring, so that any window
+    of up to <capacity> consecutive samples is always available as a contiguous view (no copies, no wrap-around handling).
+    Samples are identified by their absolute index, i.e. the number of samples appended before them since the last reset.
+
+    Parameters:
+        capacity (int): Number of samples kept in memory.
+        n_channels (int): Number of channels of each sample.
+        dtype (type): Data type of the EEG values.
+    """
+
+    def __init__(self, capacity, n_channels, dtype=np.float64):
+        self.capacity = capacity
+        self.n_channels = n_channels
+        self.data = np.zeros((2 * capacity, n_channels), dtype=dtype)
+        self.times = np.zeros(2 * capacity)
+        self.n_written = 0   # absolute index of the next sample to be written
+        self.valid_from = 0  # absolute index of the first sample not belonging to discarded data
+
+    def reset(self):  # restart from scratch (e.g. stop + play)
+        self.data[:] = 0
+        self.times[:] = 0
+        self.n_written = 0
+        self.valid_from = 0
+
+    def invalidate(self):  # mark everything received so far as dirty (e.g. after a discard)
+        self.valid_from = self.n_written
+
+    def n_valid(self):  # number of consecutive clean samples currently available
+        return min(self.n_written - self.valid_from, self.capacity)
+
+    def append(self, sample, timestamp):
+        i = self.n_written % self.capacity
+        self.data[i] = sample
+        self.data[i + self.capacity] = sample
+        self.times[i] = timestamp
+        self.times[i + self.capacity] = timestamp
+        self.n_written += 1
+
+    def extend(self, block, timestamps):  # append a whole (samples x channels) block at once
+        n = len(block)
+        if n > self.capacity:  # only the last <capacity> samples would survive anyway
+            self.n_written += n - self.capacity
+            block = block[-self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+            n = self.capacity
+        i = self.n_written % self.capacity
+        first = min(n, self.capacity - i)  # samples fitting before the end of the first half
+        for offset in (0, self.capacity):
+            self.data[i + offset:i + offset + first] = block[:first]
+            self.times[i + offset:i + offset + first] = timestamps[:first]
+        if first < n:  # wrap around to the beginning of both halves
+            for offset in (0, self.capacity):
+                self.data[offset:offset + n - first] = block[first:]
+                self.times[offset:offset + n - first] = timestamps[first:]
+        self.n_written += n
+
+    def window(self, start, length):
+        """
+        Returns contiguous views (no copies) of data and timestamps of <length> samples, starting from absolute index <start>.
+        The requested samples must have been already received and not yet overwritten.
+        """
+        if start < max(self.n_written - self.capacity, 0) or start + length > self.n_written:
+            raise IndexError("samples [{}, {}) not available in the ring (received {}, capacity {})"
+                             .format(start, start + length, self.n_written, self.capacity))
+        i = self.n_written % self.capacity + self.capacity - (self.n_written - start)  # position of <start> in the mirror
+        return self.data[i:i + length], self.times[i:i + length]
+
+    def latest(self, length):  # views of the last <length> samples (zero-filled if not yet received)
+        end = self.n_written % self.capacity + self.capacity
+        return self.data[end - length:end], self.times[end - length:end]
+
+    def index_of(self, timestamp, tolerance):
+        """
+        Returns the absolute index of the buffered sample closest to <timestamp> (binary search on the timestamps, that are
+        increasing), or None if no sample within <tolerance> seconds is available.
+        """
+        n = min(self.n_written, self.capacity)
+        if n == 0:
+            return None
+        _, times = self.latest(n)
+        i = int(np.searchsorted(times, timestamp))
+        if i == n or (i > 0 and timestamp - times[i - 1] < times[i] - timestamp):
+            i -= 1  # previous sample is the closest one
+        if abs(times[i] - timestamp) > tolerance:
+            return None
+        return self.n_written - n + i
@@ -0,0 +1,55 @@
+"""Scheduler of the epochs still to be completed by the Receiver, one for each received marker"""
+import heapq
+from collections import deque
+
+
+class EpochScheduler:
+    """
+    Keeps the pending epochs in a min-heap ordered by the absolute index (in the ring) of the sample completing them, so that
+    after each block all the completed epochs are popped at once, whatever their number and their overlap.
+    The timestamp of each marker is converted to the absolute index of the related sample only once, by a binary search in
+    the timestamps of the ring; markers related to samples not received yet wait (in order of time) until they arrive.
+
+    Parameters:
+        samples_pre_ev (int): Number of samples of the epoch before the one related to the marker.
+        length (int): Number of samples of the epoch.
+        tolerance (float): Maximum distance (s) between the marker and the related sample.
+    """
+
+    def __init__(self, samples_pre_ev, length, tolerance):
+        self.samples_pre_ev = samples_pre_ev
+        self.length = length
+        self.tolerance = tolerance
+        self.waiting = deque()  # (timestamp, label) of markers whose sample has not been received yet
+        self.pending = []       # heap of (index completing the epoch, order of arrival, index of first sample, timestamp, label)
+        self.n_added = 0
+
+    def clear(self):
+        self.waiting.clear()
+        self.pending = []
+
+    def add(self, marker_time, label):
+        self.waiting.append((marker_time, label))
+
+    def pop_ready(self, ring):
+        """
+        Returns (timestamp, label, absolute index of first sample) of every epoch completed by the samples in <ring>, in order
+        of completion. Epochs whose sample is lost, or containing discarded data, are dropped.
+        """
+        # locate markers whose related sample should have been received by now
+        newest_time = ring.latest(1)[1][0]
+        while len(self.waiting) > 0 and ring.n_written > 0 and self.waiting[0][0] <= newest_time:
+            marker_time, label = self.waiting.popleft()
+            ev_idx = ring.index_of(marker_time, self.tolerance)
+            if ev_idx is None:
+                continue  # sample related to the marker lost (or already overwritten)
+            start = ev_idx - self.samples_pre_ev
+            heapq.heappush(self.pending, (start + self.length, self.n_added, start, marker_time, label))
+            self.n_added += 1
+
+        ready = []
+        while len(self.pending) > 0 and self.pending[0][0] <= ring.n_written:
+            _, _, start, marker_time, label = heapq.heappop(self.pending)
+            if start >= ring.valid_from and start >= ring.n_written - ring.capacity:
+                ready.append((marker_time, label, start))
+        return ready
@@ -0,0 +1,133 @@
+"""Filters applied by the Receiver to the EEG data (before averaging) and to the averages (before sending them)"""
+from fractions import Fraction
+
+import numpy as np
+from scipy import fft as sp_fft
+from scipy import signal as dsp
+
+
+def design_streaming_sos(srate, lower_cof, upper_cof, order, notch_freq, quality_factor):
+    """
+    Designs the cascade (band-pass + notch) used in streaming mode, as second-order sections.
+
+    Parameters:
+        srate (float): Sample rate of the EEG stream (Hz).
+        lower_cof (float): Lower cutoff frequency of the band-pass filter (Hz), None for no band-pass filter.
+        upper_cof (float): Upper cutoff frequency of the band-pass filter (Hz).
+        order (int): Order of the Butterworth band-pass filter.
+        notch_freq (float): Frequency to be removed from signal (Hz), None for no notch filter.
+        quality_factor (float): Quality factor of the notch filter.
+
+    Returns:
+        sos (ndarray): Second-order sections of the whole cascade.
+    """
+    sections = []
+    if lower_cof is not None:
+        sections.append(dsp.butter(order, [lower_cof, upper_cof], btype='bandpass', fs=srate, output='sos'))
+    if notch_freq is not None and notch_freq < srate / 2:  # otherwise nothing to remove, frequency not in the signal
+        b_notch, a_notch = dsp.iirnotch(notch_freq, quality_factor, srate)
+        sections.append(dsp.tf2sos(b_notch, a_notch))
+    return np.vstack(sections) if len(sections) > 0 else None
+
+
+def group_delay_samples(sos, freq, srate):  # group delay (in samples, rounded) of the cascade at the given frequency
+    b, a = dsp.sos2tf(sos)
+    _, gd = dsp.group_delay((b, a), w=[freq], fs=srate)
+    return int(round(gd[0]))
+
+
+class StreamingFilter:
+    """
+    Causal IIR filter applied to consecutive blocks of (samples x channels) data, carrying the filter state between calls,
+    so that every sample is filtered exactly once.
+
+    Parameters:
+        sos (ndarray): Second-order sections of the filter.
+        n_channels (int): Number of channels of each sample.
+    """
+
+    def __init__(self, sos, n_channels):
+        self.sos = sos
+        self.zi_step = dsp.sosfilt_zi(sos)[:, :, np.newaxis]  # state for a unit step input, for each section
+        self.zi = np.zeros((sos.shape[0], 2, n_channels))
+        self.initialized = False
+
+    def reset(self):
+        self.zi[:] = 0
+        self.initialized = False
+
+    def process(self, block):  # filter a (samples x channels) block, returns the filtered block
+        if not self.initialized:  # start from steady state w.r.t. the first sample, to avoid the initial transient
+            self.zi = self.zi_step * np.asarray(block[0], dtype=float)
+            self.initialized = True
+        filtered, self.zi = dsp.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return filtered
+
+
+class EpochFilter:
+    """
+    Zero-phase filtering of whole epochs: FIR band-pass (FFT convolution, with the spectrum of the filter computed once)
+    followed by a forward-backward notch, applied to all the channels (and to all the given epochs) in a single call.
+    The result is the same obtained by filtering each channel of each epoch padded with zeros on both sides.
+
+    Parameters:
+        fir (ndarray): Coefficients of the FIR band-pass filter.
+        sos_notch (ndarray): Second-order sections of the notch filter, None for no notch filter.
+        length (int): Number of samples of each epoch.
+        pad (int): Number of zeros added before and after each epoch, to avoid filter distortion.
+    """
+
+    def __init__(self, fir, sos_notch, length, pad):
+        self.sos_notch = sos_notch
+        self.length = length
+        self.pad = pad
+        self.n_full = length + len(fir) - 1  # length of the full convolution of an epoch with the FIR filter
+        self.n_fft = sp_fft.next_fast_len(self.n_full, real=True)
+        self.fir_spectrum = sp_fft.rfft(fir, self.n_fft)
+        # position of the full convolution inside the padded segment, as given by a "same" mode convolution
+        self.offset = pad - (len(fir) - 1) // 2
+        self.first = max(-self.offset, 0)  # first samples of the full convolution that fall before the padded segment
+        self.last = min(self.n_full, length + 2 * pad - self.offset)
+
+    def process(self, epochs):  # filter a (samples x channels) epoch or a (epochs x samples x channels) stack of them
+        single = epochs.ndim == 2
+        if single:
+            epochs = epochs[np.newaxis]
+        epochs = epochs.transpose(0, 2, 1)  # (epochs x channels x samples), so that filters run on contiguous memory
+        # applying band-pass filter (only the epoch is convolved, the padding zeros would not contribute)
+        full = sp_fft.irfft(sp_fft.rfft(epochs, self.n_fft, axis=-1) * self.fir_spectrum, self.n_fft, axis=-1)
+        padded = np.zeros((epochs.shape[0], epochs.shape[1], self.length + 2 * self.pad))
+        padded[:, :, self.offset + self.first:self.offset + self.last] = full[:, :, self.first:self.last]
+        if self.sos_notch is not None:
+            padded = dsp.sosfiltfilt(self.sos_notch, padded, axis=-1)  # applying notch filter
+        filtered = padded[:, :, self.pad:self.pad + self.length].transpose(0, 2, 1)  # recover filtered data
+        return filtered[0] if single else filtered
+
+
+class OutputDecimator:
+    """
+    Anti-aliased polyphase resampling of the averaged epochs to (about) <out_rate> Hz, before sending them to the plotter.
+    The low-pass FIR filter is designed once (the same designed at each call by resample_poly); the rate is reduced only.
+
+    Parameters:
+        srate (float): Sample rate of the EEG stream (Hz).
+        out_rate (float): Wanted output rate (Hz), ignored if not lower than <srate>.
+    """
+
+    def __init__(self, srate, out_rate):
+        ratio = Fraction(out_rate / srate).limit_denominator(1000) if out_rate is not None and out_rate < srate else 1
+        self.up, self.down = ratio.numerator, ratio.denominator
+        self.rate = srate * self.up / self.down  # actual output rate
+        self.window = None
+        if self.up != self.down:
+            max_rate = max(self.up, self.down)
+            self.window = dsp.firwin(2 * 10 * max_rate + 1, 1 / max_rate, window=('kaiser', 5.0))
+
+    def output_length(self, length):  # number of samples of a resampled epoch of <length> samples
+        return -(-length * self.up // self.down)
+
+    def process(self, epoch):  # resample a (samples x channels) epoch
+        if self.up == self.down:
+            return epoch
+        # OBS: edges extended linearly, to avoid the distortion that padding with zeros would introduce
+        return dsp.resample_poly(epoch, self.up, self.down, axis=0, window=self.window, padtype='line')
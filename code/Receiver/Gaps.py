@@ -0,0 +1,96 @@
+"""Detection of the EEG samples lost between consecutive timestamps, with their statistics and the filling of short gaps"""
+import numpy as np
+
+# handling of the epochs containing lost samples: averaged anyway, counted as rejected, ignored, or filled (short gaps)
+POLICIES = ['average', 'invalid', 'skip', 'interpolate']
+
+# upper edges (n of lost samples) of the buckets of the gap lengths, plus one for longer gaps
+GAP_EDGES = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+STATS_LABELS = ['gaps', 'lost_samples', 'filled_samples', 'affected_epochs', 'max_gap'] + \
+               ['gaps_upto_' + str(edge) for edge in GAP_EDGES] + ['gaps_over_' + str(GAP_EDGES[-1])]
+
+
+class GapDetector:
+    """
+    Finds the gaps of each block of timestamps with a single np.diff (a step longer than 1.5 sampling periods means that at
+    least one sample has been lost), keeps the counters and the histogram of their lengths (n of lost samples) for the whole
+    session, and fills the gaps of at most <max_fill> samples by linear interpolation, if required.
+    Steps following a timestamp equal to 0 are not checked (first sample of a recorded session, see Receiver).
+
+    Parameters:
+        srate (float): Sampling rate of the stream.
+        max_fill (int): Maximum number of lost samples filled by interpolation, 0 to never fill.
+    """
+
+    def __init__(self, srate, max_fill=0):
+        self.srate = srate
+        self.max_fill = max_fill
+        self.hist = np.zeros(len(GAP_EDGES) + 1, dtype=int)
+        self.n_gaps = 0
+        self.n_lost = 0
+        self.n_filled = 0
+        self.n_affected = 0     # epochs containing lost samples
+        self.max_gap = 0
+        self.last_sample = None  # last sample of the previous block, with its timestamp
+        self.last_time = None
+
+    def reset(self):  # restart from scratch (stop + play msgs), the statistics are kept for the whole session
+        self.last_sample = None
+        self.last_time = None
+
+    def carry_stats(self, previous):  # continue the statistics of another detector (e.g. replaced by a reconfiguration)
+        self.hist[:] = previous.hist
+        self.n_gaps = previous.n_gaps
+        self.n_lost = previous.n_lost
+        self.n_filled = previous.n_filled
+        self.n_affected = previous.n_affected
+        self.max_gap = previous.max_gap
+
+    def process(self, block, times):
+        """
+        Checks a (samples x channels) block and its timestamps, following the previous block. Returns the block and the
+        timestamps to be buffered (with the short gaps filled, if required) and, for each gap found, the timestamps before and
+        after it and the number of samples lost.
+        """
+        prepend = self.last_time is not None
+        all_times = np.concatenate(([self.last_time], times)) if prepend else times
+        steps = np.diff(all_times)
+        ids = np.flatnonzero((steps > 1.5 / self.srate) & (all_times[:-1] != 0))
+        lost = np.round(steps[ids] * self.srate).astype(int) - 1
+        gaps = [(all_times[i], all_times[i + 1], n) for i, n in zip(ids, lost)]
+        if len(ids) > 0:
+            self.n_gaps += len(ids)
+            self.n_lost += int(lost.sum())
+            self.max_gap = max(self.max_gap, int(lost.max()))
+            np.add.at(self.hist, np.searchsorted(GAP_EDGES, lost), 1)
+            fill = lost <= self.max_fill
+            if fill.any():
+                block, times = self._fill(block, times, ids[fill], lost[fill], prepend)
+        if len(times) > 0:
+            self.last_sample = block[-1].copy()
+            self.last_time = times[-1]
+        return block, times, gaps
+
+    def _fill(self, block, times, ids, lost, prepend):  # insert <lost> linearly interpolated samples after the steps <ids>
+        values = np.vstack((self.last_sample, block)) if prepend else block
+        all_times = np.concatenate(([self.last_time], times)) if prepend else times
+        added = np.zeros(len(all_times), dtype=int)
+        added[ids + 1] = lost
+        positions = np.arange(len(all_times)) + np.cumsum(added)  # of the received samples, in the filled block
+        grid = np.arange(positions[-1] + 1)
+        left = np.clip(np.searchsorted(positions, grid, side='right') - 1, 0, len(positions) - 2)
+        weights = (grid - positions[left]) / (positions[left + 1] - positions[left])
+        filled = values[left] + weights[:, np.newaxis] * (values[left + 1] - values[left])
+        filled_times = all_times[left] + weights * (all_times[left + 1] - all_times[left])
+        self.n_filled += int(lost.sum())
+        first = 1 if prepend else 0
+        return filled[first:].astype(block.dtype), filled_times[first:]
+
+    def check_epochs(self, times):  # tells which epochs of a (epochs x samples) stack of timestamps contain lost samples
+        affected = ((np.diff(times, axis=1) > 1.5 / self.srate) & (times[:, :-1] != 0)).any(axis=1)
+        self.n_affected += int(affected.sum())
+        return affected
+
+    def stats(self):  # statistics of the whole session, in the order of STATS_LABELS
+        return [self.n_gaps, self.n_lost, self.n_filled, self.n_affected, self.max_gap] + self.hist.tolist()
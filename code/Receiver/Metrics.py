@@ -0,0 +1,115 @@
+"""Lightweight instrumentation of the Receiver loop: latency of each stage and counters of the processed data"""
+import json
+import os
+import time
+from bisect import bisect_left
+
+# upper edges (s) of the latency buckets, logarithmically spaced (4 per decade) from 1 us to 1 s, plus one for slower ones
+BUCKET_EDGES = [10 ** (e / 4) for e in range(-24, 1)]
+
+
+class StageMetrics:
+    """
+    Fixed-bucket latency histograms (monotonic clock) of the stages of the loop, and counters (e.g. samples, events).
+    Recording a latency costs a clock read, a bisection over few edges and some list updates, so the instrumentation
+    can stay always on. Periodic reports refer to the interval since the previous one, the summary to the whole session.
+
+    Parameters:
+        stages (list): Names of the timed stages.
+        counters (list): Names of the counters.
+    """
+
+    def __init__(self, stages, counters):
+        self.stages = list(stages)
+        self.counters = {name: 0 for name in counters}
+        self.hist = {stage: [0] * (len(BUCKET_EDGES) + 1) for stage in self.stages}
+        self.n = {stage: 0 for stage in self.stages}
+        self.sum = {stage: 0.0 for stage in self.stages}
+        self.max = {stage: 0.0 for stage in self.stages}
+        self.start_time = time.perf_counter()
+        # state at previous report, to get the values of the last interval only
+        self.report_time = self.start_time
+        self.report_hist = {stage: list(self.hist[stage]) for stage in self.stages}
+        self.report_n = dict(self.n)
+        self.report_sum = dict(self.sum)
+        self.report_counters = dict(self.counters)
+        self.interval_max = dict(self.max)
+
+    def stage(self, stage, start):  # record the time elapsed since <start> (perf_counter) for the stage, returns current time
+        now = time.perf_counter()
+        elapsed = now - start
+        self.hist[stage][bisect_left(BUCKET_EDGES, elapsed)] += 1
+        self.n[stage] += 1
+        self.sum[stage] += elapsed
+        if elapsed > self.interval_max[stage]:
+            self.interval_max[stage] = elapsed
+            if elapsed > self.max[stage]:
+                self.max[stage] = elapsed
+        return now
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def report_due(self, interval):
+        return time.perf_counter() - self.report_time >= interval
+
+    @staticmethod
+    def percentile(hist, q):  # upper edge (s) of the bucket containing the q-th percentile (the last bucket has no edge)
+        total = sum(hist)
+        if total == 0:
+            return 0.0
+        cumulative = 0
+        for i, n in enumerate(hist):
+            cumulative += n
+            if cumulative >= q / 100 * total:
+                return BUCKET_EDGES[min(i, len(BUCKET_EDGES) - 1)]
+
+    def report(self, rate_counters):
+        """
+        Returns the values of the interval since the previous report: rate (per s) of the given counters, then for each
+        stage mean, 95th percentile and maximum latency (ms). Starts a new interval.
+        """
+        now = time.perf_counter()
+        duration = now - self.report_time
+        values = [(self.counters[name] - self.report_counters[name]) / duration for name in rate_counters]
+        for stage in self.stages:
+            n = self.n[stage] - self.report_n[stage]
+            hist = [a - b for a, b in zip(self.hist[stage], self.report_hist[stage])]
+            values += [(self.sum[stage] - self.report_sum[stage]) / n * 1000 if n > 0 else 0.0,
+                       self.percentile(hist, 95) * 1000, self.interval_max[stage] * 1000]
+            self.report_hist[stage] = list(self.hist[stage])
+            self.interval_max[stage] = 0.0
+        self.report_time = now
+        self.report_n = dict(self.n)
+        self.report_sum = dict(self.sum)
+        self.report_counters = dict(self.counters)
+        return values
+
+    def summary(self):  # statistics of the whole session
+        duration = time.perf_counter() - self.start_time
+        stages = {}
+        for stage in self.stages:
+            n = self.n[stage]
+            stages[stage] = {"count": n,
+                             "mean_ms": self.sum[stage] / n * 1000 if n > 0 else 0.0,
+                             "p50_ms": self.percentile(self.hist[stage], 50) * 1000,
+                             "p95_ms": self.percentile(self.hist[stage], 95) * 1000,
+                             "p99_ms": self.percentile(self.hist[stage], 99) * 1000,
+                             "max_ms": self.max[stage] * 1000,
+                             "total_s": self.sum[stage],
+                             "histogram": self.hist[stage]}
+        return {"duration_s": duration,
+                "counters": self.counters,
+                "rates_per_s": {name: value / duration for name, value in self.counters.items()},
+                "bucket_edges_ms": [edge * 1000 for edge in BUCKET_EDGES],
+                "stages": stages}
+
+    def dump(self, path, info=None):  # save the summary (and the given info, e.g. srate and n of channels) to a json file
+        folder = os.path.dirname(path)
+        if folder != '' and not os.path.exists(folder):
+            os.makedirs(folder)
+        content = self.summary()
+        if info is not None:
+            content["info"] = info
+        with open(path, 'w') as f:
+            json.dump(content, f, indent=2)
@@ -0,0 +1,82 @@
+"""State of each EEG stream handled by the Receiver in multi-stream mode (e.g. several headsets at once, hyperscanning)"""
+import numpy as np
+from pylsl import cf_double64
+
+
+class StreamState:
+    """
+    Everything the Receiver keeps for one EEG stream: its inlet and its processing core (ring of the last samples, scheduled
+    epochs, averages of each condition, see Core.py). The other objects (snapshots of the averages, recorder, outlets of the
+    averages and of the gap statistics, preallocated chunk of the averages, stopping criterion, archive of the epochs) are
+    attached by the Receiver, None if not used.
+
+    Parameters:
+        index (int): Position of the stream among the resolved ones.
+        inlet (StreamInlet): Inlet of the EEG stream.
+        labels_ids (list): Indexes of the recorded channels among the ones of the stream, None to record all of them.
+        core (ReceiverCore): Processing core of the stream.
+        max_samples (int): Maximum number of samples pulled at once.
+    """
+
+    def __init__(self, index, inlet, labels_ids, core, max_samples):
+        self.index = index
+        self.inlet = inlet
+        self.labels_ids = labels_ids
+        self.core = core
+        info = inlet.info()
+        # destination of the pulled chunks (all the channels of the stream)
+        self.buffer = np.zeros((max_samples, info.channel_count()),
+                               dtype=np.float64 if info.channel_format() == cf_double64 else np.float32)
+        self.checkpoints = None
+        self.recorder = None
+        self.avg_outlet = None
+        self.avg_chunk = None
+        self.gap_outlet = None
+        self.stopping = None
+        self.archive = None
+        self.carry = None           # part of last chunk following a control sample (with the markers following it), still to
+                                    # be processed
+        self.closed = False         # closing control sample received
+
+    def pull(self, timeout):
+        # next chunk to be processed (the rest of the previous one first), as (samples, timestamps, markers, their timestamps)
+        # OBS: the markers are the ones held back with the rest of the previous chunk, if any
+        if self.carry is not None:
+            carry = self.carry
+            self.carry = None
+            return carry
+        _, chunk_times = self.inlet.pull_chunk(timeout=timeout, max_samples=len(self.buffer), dest_obj=self.buffer)
+        return self.buffer[:len(chunk_times)], np.array(chunk_times), [], []
+
+    def reset(self):  # restart from scratch (stop + play msgs)
+        self.core.reset()
+        if self.checkpoints is not None:
+            self.checkpoints.reset()
+        if self.stopping is not None:
+            self.stopping.reset()
+        if self.archive is not None:
+            self.archive.reset()
+
+
+def filter_together(epoch_filter, stacks):
+    """
+    Filter the (epochs x samples x channels) stacks of segments of several streams (different numbers of epochs and channels)
+    with a single call of the filter, each channel of each epoch being a column of one (samples x columns) epoch.
+
+    Parameters:
+        epoch_filter (EpochFilter): Filter of the epochs, the same for all the streams.
+        stacks (list): Stacks of segments, one for each stream (None if the stream has no completed segments).
+
+    Returns:
+        list: Filtered stacks, in the same order (None where None was given).
+    """
+    shapes = [stack.shape for stack in stacks if stack is not None]
+    if len(shapes) == 0:
+        return stacks
+    length = shapes[0][1]
+    columns = np.concatenate([stack.transpose(1, 0, 2).reshape(length, -1) for stack in stacks if stack is not None], axis=1)
+    filtered = epoch_filter.process(columns)
+    bounds = np.cumsum([0] + [n_epochs * n_channels for n_epochs, _, n_channels in shapes])
+    parts = iter(filtered[:, start:stop].reshape(length, n_epochs, n_channels).transpose(1, 0, 2)
+                 for start, stop, (n_epochs, _, n_channels) in zip(bounds[:-1], bounds[1:], shapes))
+    return [next(parts) if stack is not None else None for stack in stacks]
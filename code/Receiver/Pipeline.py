@@ -0,0 +1,300 @@
+"""Multi-process pipeline of the Receiver: ingestion and recording run in their own processes, around a shared ring of samples.
+
+    ingestion process   pulls EEG chunks and markers from LSL, appends the samples (all the channels, control samples
+                        included) to the shared ring and announces each appended range and the markers on two queues
+    Receiver (DSP)      reads the announced ranges from the ring and does epoching, filtering, averaging and publishing
+    recording process   reads the same ranges from the ring and writes them (with markers and discarded intervals)
+
+The absolute index of each sample in the ring (number of samples appended before it) is its sequence number: messages
+carry ranges of sequence numbers instead of the data, and each reader detects if the samples it still has to read have
+already been overwritten (i.e. it fell behind by more than the capacity of the ring). The ingestion process never waits
+for the readers, so a slow disk or a busy DSP loop can only make its own reader lose samples, not stall the acquisition.
+"""
+import atexit
+import queue
+import signal
+import sys
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import pylsl.pylsl
+from pylsl import StreamInlet, resolve_byprop, resolve_stream
+
+from Recorder import RecordingWriter
+
+START_METHOD = 'spawn'  # OBS: not 'fork', since the threads of liblsl of the Receiver would not survive in the children
+RESTART_TIME = 0.00001  # timestamp of the control sample sent to restart (stop + play msgs), other control samples close
+POLL_INTERVAL = 0.1     # s, interval between the checks of the stop event by a waiting process
+STOP_TIMEOUT = 2.0      # s, time waited by the recording for the stop message, once the pipeline is stopping
+
+
+def is_restart(timestamp, restart_enabled):  # True if the control sample with the given timestamp restarts the session
+    return restart_enabled and timestamp == RESTART_TIME
+
+
+class SharedRing:
+    """
+    Ring of samples (all the channels) and timestamps in shared memory, written by the ingestion process only. A reader
+    knows from the messages which ranges of sequence numbers have been written, and gets a copy of them.
+
+    Parameters:
+        capacity (int): Number of samples kept in memory.
+        n_channels (int): Number of channels of each sample.
+        dtype (str): Data type of the EEG values.
+        margin (int): Maximum number of samples appended at once (samples possibly being overwritten during a read).
+        name (str): Name of the shared memory block to attach to, None to create a new one.
+    """
+
+    def __init__(self, capacity, n_channels, dtype, margin, name=None):
+        self.capacity = capacity
+        self.n_channels = n_channels
+        self.dtype = np.dtype(dtype)
+        self.margin = margin
+        size = 16 + 8 * capacity + self.dtype.itemsize * capacity * n_channels
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(create=True, size=size) if self.owner else shared_memory.SharedMemory(name=name)
+        # header: sequence number of the next sample to be written, and of the next one to be recorded
+        self.header = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        self.times = np.ndarray(capacity, dtype=np.float64, buffer=self.shm.buf, offset=16)
+        self.data = np.ndarray((capacity, n_channels), dtype=self.dtype, buffer=self.shm.buf, offset=16 + 8 * capacity)
+        if self.owner:
+            self.header[:] = 0
+
+    def spec(self):  # arguments to attach to the ring from another process
+        return self.capacity, self.n_channels, self.dtype.str, self.margin, self.shm.name
+
+    @property
+    def n_written(self):
+        return int(self.header[0])
+
+    def write(self, data, times):  # append (samples x channels) data (at most <margin> samples) with their timestamps
+        start = self.n_written % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.data[start:start + first] = data[:first]
+        self.times[start:start + first] = times[:first]
+        self.data[:len(data) - first] = data[first:]  # wrap around
+        self.times[:len(data) - first] = times[first:]
+        self.header[0] += len(data)  # OBS: only after the data, readers trust the announced ranges
+
+    def read(self, start, stop):  # copy of the samples and timestamps in [start, stop), None if overwritten meanwhile
+        ids = np.arange(start, stop) % self.capacity
+        data, times = self.data[ids], self.times[ids]
+        if stop > start and self.n_written + self.margin - self.capacity > start:  # the writer could have reached them
+            return None
+        return data, times
+
+    def close(self):
+        self.header = self.times = self.data = None  # OBS: views must be released before closing the block
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def ingestion_main(ring_spec, stream_uid, dsp_queue, rec_queue, ready_event, start_event, stop_event, max_samples, max_latency,
+                   restart_enabled):
+    # ingestion process: pull from LSL into the shared ring until the closing control sample, a stop or a lost stream
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # OBS: interruptions are handled by the Receiver, that stops the pipeline
+    dsp_queue.cancel_join_thread()  # the Receiver may stop reading before the last messages (e.g. interrupted)
+    ring = SharedRing(*ring_spec)
+    data_inlet = StreamInlet(resolve_byprop('uid', stream_uid)[0], recover=False)  # same EEG stream of the Receiver
+    marker_inlet = StreamInlet(resolve_stream('name', 'MarkerStream')[0], recover=False)
+    buffer = np.zeros((max_samples, ring.n_channels), dtype=ring.dtype)
+    ready_event.set()
+    while not start_event.wait(POLL_INTERVAL):
+        if stop_event.is_set():  # stopped before starting (e.g. interrupted while waiting for the Console)
+            data_inlet.close_stream()
+            marker_inlet.close_stream()
+            ring.close()
+            return
+    try:
+        while not stop_event.is_set():
+            _, times = data_inlet.pull_chunk(timeout=max_latency, max_samples=max_samples, dest_obj=buffer)
+            markers, marker_times = marker_inlet.pull_chunk(timeout=0.0)
+            if len(times) > 0:
+                start = ring.n_written
+                ring.write(buffer[:len(times)], times)
+                dsp_queue.put(('eeg', start, ring.n_written))
+                if rec_queue is not None:
+                    rec_queue.put(('eeg', start, ring.n_written))
+            if len(markers) > 0:
+                dsp_queue.put(('markers', markers, marker_times))
+                if rec_queue is not None:
+                    rec_queue.put(('evs', [[marker_time] + [marker] for marker, marker_time in zip(markers, marker_times)]))
+            control_rows = np.flatnonzero(~buffer[:len(times)].any(axis=1))
+            if any(not is_restart(times[i], restart_enabled) for i in control_rows):
+                break  # closing control sample, already forwarded
+    except (pylsl.pylsl.LostError, pylsl.pylsl.TimeoutError):
+        dsp_queue.put(('lost', ring.n_written))
+    data_inlet.close_stream()
+    marker_inlet.close_stream()
+    ring.close()
+
+
+def recording_main(ring_spec, rec_queue, stop_event, path, files, session_path, header, max_queue, flush_interval, fsync,
+                   labels_ids, restart_enabled):
+    # recording process: write the ranges announced by the ingestion process, the markers and the discarded intervals
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # OBS: interruptions are handled by the Receiver, that stops the pipeline
+    ring = SharedRing(*ring_spec)
+    session = None
+    if session_path is not None:
+        from Session import SessionWriter
+        session = SessionWriter(session_path, header)
+    recorder = RecordingWriter(path, files, max_queue, flush_interval, fsync, session)
+    first = True        # next sample is the first one of the session (or after a restart)
+    reopen_seq = 0      # sequence number of the last restart
+    lost = 0            # samples overwritten before being recorded
+    closing = False
+    while not closing:
+        stopping = stop_event.is_set()
+        try:
+            msg = rec_queue.get(timeout=STOP_TIMEOUT if stopping else POLL_INTERVAL)
+        except queue.Empty:
+            if stopping:
+                break  # OBS: the stop message would have arrived by now, the Receiver terminated without closing the pipeline
+            continue
+        if msg[0] == 'eeg':
+            start, stop = msg[1:]
+            read = ring.read(start, stop)
+            ring.header[1] = stop
+            if read is None:
+                lost += stop - start
+                continue
+            data, times = read
+            # the range is split at the control samples, handled as in the Receiver
+            begin = 0
+            for end in list(np.flatnonzero(~data.any(axis=1))) + [len(data)]:
+                if end > begin:
+                    if first:
+                        times[begin] = 0.0  # needed since lsl can't send timestamp == 0
+                        first = False
+                    block = data[begin:end] if labels_ids is None else data[begin:end, labels_ids]  # remove extra channels
+                    recorder.write('eeg', np.column_stack((times[begin:end], block)))
+                if end == len(data):
+                    break
+                if not is_restart(times[end], restart_enabled):
+                    closing = True
+                    break
+                recorder.reopen()  # recreate logs (after the rows already queued are written)
+                first = True
+                reopen_seq = start + end
+                begin = end + 1
+        elif msg[0] == 'evs':
+            recorder.write('evs', msg[1])
+        elif msg[0] == 'disc':
+            rows, seq = msg[1:]
+            if seq >= reopen_seq:  # otherwise referring to data recorded before a restart, already removed
+                recorder.write('disc', rows)
+        elif msg[0] == 'stop':
+            break
+    recorder.close()
+    stats = recorder.stats()
+    if stats["n_full"] > 0:
+        print("\033[1;31;48m" + "Recording queue was full " + str(stats["n_full"]) + " times!" + "\033[1;37;0m" +
+              " max rows kept in memory: " + str(stats["max_overflow_rows"]))
+    if lost > 0:
+        print("\033[1;31;48m" + "Recording fell behind, " + str(lost) + " samples not recorded!" + "\033[1;37;0m")
+    ring.close()
+
+
+class ReceiverPipeline:
+    """
+    Starts the ingestion process (and the recording one, if <recording> is given) around a new shared ring, and hands the
+    Receiver the samples and markers announced by the ingestion process, in chunks of at most <max_samples> samples.
+    The processes resolve their own LSL inlets; the ingestion starts pulling when start() is called. The pipeline is closed
+    at the exit of the Receiver anyway, so that the recording process never outlives it.
+
+    Parameters:
+        stream_uid (str): Unique identifier of the EEG stream (the one resolved by the Receiver).
+        n_channels (int): Number of channels of the EEG stream.
+        dtype (str): Data type of the EEG values.
+        capacity (int): Number of samples kept in the shared ring.
+        max_samples (int): Maximum number of samples pulled from LSL and handed to the Receiver at once.
+        max_latency (float): Maximum time (s) waited by the ingestion for a chunk to be filled.
+        restart_enabled (bool): True if control samples with the restart timestamp restart the session (console used).
+        recording (dict): Arguments of the recording process (path, files, session_path, header, max_queue,
+            flush_interval, fsync, labels_ids), None to not record.
+    """
+
+    def __init__(self, stream_uid, n_channels, dtype, capacity, max_samples, max_latency, restart_enabled, recording=None):
+        self.ring = SharedRing(capacity, n_channels, dtype, max_samples)
+        self.max_samples = max_samples
+        context = get_context(START_METHOD)
+        self.dsp_queue = context.Queue()
+        self.rec_queue = context.Queue() if recording is not None else None
+        self.ready_event, self.start_event, self.stop_event = context.Event(), context.Event(), context.Event()
+        self.ingestion = context.Process(target=ingestion_main, name="Ingestion", daemon=True,
+                                 args=(self.ring.spec(), stream_uid, self.dsp_queue, self.rec_queue, self.ready_event,
+                                       self.start_event, self.stop_event, max_samples, max_latency, restart_enabled))
+        self.recording = None
+        if recording is not None:
+            self.recording = context.Process(target=recording_main, name="Recording",
+                                     args=(self.ring.spec(), self.rec_queue, self.stop_event, recording["path"], recording["files"],
+                                           recording["session_path"], recording["header"], recording["max_queue"],
+                                           recording["flush_interval"], recording["fsync"], recording["labels_ids"],
+                                           restart_enabled))
+            self.recording.start()
+        self.ingestion.start()
+        self.closed = False
+        atexit.register(self.close)  # OBS: also on the exits (e.g. lost Console) that don't close the pipeline explicitly
+        while not self.ready_event.wait(0.5):  # wait for the LSL streams to be resolved
+            if not self.ingestion.is_alive():
+                raise RuntimeError("ingestion process terminated before resolving the streams")
+        self.cursor = 0         # sequence number of the next sample handed to the Receiver
+        self.available = 0      # sequence number following the last sample announced
+        self.lost_at = None     # sequence number at which the connection has been lost
+
+    def start(self):  # start pulling from LSL
+        self.start_event.set()
+
+    def get(self, timeout):
+        """
+        Returns the next chunk of samples with their timestamps (arrays) and all the pending markers with their
+        timestamps (lists), waiting at most <timeout> seconds if nothing is pending. Samples overwritten before being read
+        are skipped, and show up as missing samples in the timestamps. Raises LostError when the connection has been lost
+        and all the samples received before have been returned.
+        """
+        markers, marker_times = [], []
+        wait = self.cursor == self.available
+        while True:
+            try:
+                msg = self.dsp_queue.get(timeout=timeout) if wait else self.dsp_queue.get_nowait()
+            except queue.Empty:
+                break
+            wait = False
+            if msg[0] == 'eeg':
+                self.available = msg[2]
+            elif msg[0] == 'markers':
+                markers += msg[1]
+                marker_times += msg[2]
+            elif msg[0] == 'lost':
+                self.lost_at = msg[1]
+        if self.lost_at is not None and self.cursor >= self.lost_at:
+            raise pylsl.pylsl.LostError("lost connection with one or more streams")
+        stop = min(self.available, self.cursor + self.max_samples)
+        read = self.ring.read(self.cursor, stop)
+        while read is None:  # fell behind the ingestion, skip to the oldest samples still in the ring
+            self.cursor = min(max(self.cursor, self.ring.n_written + self.ring.margin - self.ring.capacity), self.available)
+            stop = min(self.available, self.cursor + self.max_samples)
+            read = self.ring.read(self.cursor, stop)
+        self.cursor = stop
+        return read[0], read[1], markers, marker_times
+
+    def record_discard(self, rows):  # write the discarded intervals, referred to the samples handed so far
+        if self.rec_queue is not None:
+            self.rec_queue.put(('disc', rows, self.cursor))
+
+    def recording_lag(self):  # number of samples announced but not recorded yet
+        return self.ring.n_written - int(self.ring.header[1]) if self.recording is not None else 0
+
+    def close(self):  # stop the ingestion, wait for everything announced to be recorded and release the ring
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.stop_event.set()
+        self.ingestion.join()
+        if self.recording is not None:
+            self.rec_queue.put(('stop',))
+            self.recording.join()
+            sys.stdout.flush()
+        self.ring.close()
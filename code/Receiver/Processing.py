@@ -0,0 +1,192 @@
+"""Processing of the EEG streams done by the Receiver: constants, flags and builders of its processing core (see Core.py).
+
+Kept apart from Receiver.py (LSL streams, console, recording), so that the processing can be run without them, e.g. by the
+benchmark (see Benchmark.py).
+"""
+import os
+
+import numpy as np
+
+from Core import ReceiverCore
+from DspPipeline import DspPipeline, FilterCache, load_pipeline
+from Filters import EpochFilter, StreamingFilter, group_delay_samples
+from Gaps import GapDetector
+from Projection import ChannelProjection
+from Rejection import EpochRejector
+from Stopping import StoppingCriterion
+
+# Constants -------------------------------------------------------------------------------------------------------------------------
+# values defining size of window used to calculate aligned averaged potentials
+PAUSE_PRE_EV = 0.0      # s, baseline duration
+EVENT_LENGTH = 0.5      # s, stimulus duration
+PAUSE_POST_EV = 0.3     # s, post-stimulus duration
+
+# conditions averaged separately, identified by the marker string (the Plotter shows the difference between the first two)
+CONDITIONS = ['R', 'F']
+CONDITION_NAMES = ['rare', 'frequent']
+
+# values defining the averaging of each condition (see Averaging.py), in the order of CONDITIONS
+AVERAGING_MODES = ['cumulative', 'cumulative']  # all the epochs ('cumulative'), the last AVERAGING_WINDOW ones ('window') or
+                                                # with weights halved every AVERAGING_HALF_LIFE epochs ('exponential')
+AVERAGING_WINDOW = 50       # number of the last epochs averaged ('window' mode)
+AVERAGING_HALF_LIFE = 20    # number of epochs after which the weight of an epoch is halved ('exponential' mode)
+
+# values defining the adaptive stopping (difference between the first two conditions significant, see Stopping.py)
+STOPPING_WINDOW = (0.25, 0.5)       # s after the event, window of the mean amplitude of each epoch (e.g. around the P300)
+STOPPING_CHANNELS = ['Cz', 'Pz']    # labels of the channels checked (all the averaged ones if None or none of them found)
+STOPPING_THRESHOLD = 5.0            # Welch's t-statistic (first - second condition) to be exceeded on any checked channel
+STOPPING_MIN_TRIALS = 20            # minimum number of averaged epochs of each condition
+
+# values defining the DSP pipeline (re-referencing, band-pass and notch filters, resampling of the averages, see DspPipeline.py)
+DSP_PIPELINES_PATH = os.path.join("..", "..", "data", "Pipelines")   # location of the descriptions of the pipelines
+DSP_PIPELINE = "default.json"   # description of the pipeline (json or yaml), in DSP_PIPELINES_PATH or as a path
+FILTER_CACHE_PATH = os.path.join("..", "..", "output", "FilterCache")  # folder of the filter designs, for each rate
+
+# values defining the handling of lost samples (see Gaps.py)
+GAP_POLICY = 'average'      # epochs containing lost samples: averaged anyway ('average'), counted as rejected ('invalid'),
+                            # ignored ('skip'), or with the gaps filled ('interpolate', longer gaps handled as 'invalid')
+MAX_INTERPOLATED_GAP = 0.05 # s, longest gap filled by linear interpolation
+
+# values defining chunked ingestion
+MAX_CHUNK_SAMPLES = 1024    # maximum number of samples pulled at once
+
+# values defining the rejection of epochs containing artifacts (thresholds in the unit of the data, None to disable a check)
+REJECT_PEAK_TO_PEAK = 150.0     # maximum peak-to-peak amplitude on any EEG channel
+REJECT_ABSOLUTE = 100.0         # maximum absolute value on any EEG channel
+REJECT_FLAT = 0.5               # minimum peak-to-peak amplitude on any EEG channel (flat line)
+EOG_CHANNELS = []               # labels of the EOG channels (if any), not checked against the thresholds above
+REJECT_EOG_CORRELATION = 0.8    # maximum absolute correlation between an EEG channel and an EOG one
+
+# Flags and variables for optional features -----------------------------------------------------------------------------------------
+SELECTED_CHANNELS = False   # flag to compute and plot the averaged potentials of a subset of channels
+selected_channels = ['Cz']
+
+STREAMING_FILTER = False    # flag to filter causally each incoming sample once (IIR with carried state), instead of each epoch
+GROUP_DELAY_COMPENSATION = True     # flag to shift epochs by the group delay of the streaming filter, to keep them aligned
+
+FILTER_CACHE = True         # flag to keep the filter designs on disk (FILTER_CACHE_PATH), instead of designing them at each start
+
+ARTIFACT_REJECTION = False  # flag to reject (i.e. not average) the epochs containing artifacts
+
+ADAPTIVE_STOPPING = False   # flag to check at each averaged epoch if the difference between the first two conditions is significant
+
+
+def load_dsp_pipeline(name):  # DSP pipeline described by a file (in DSP_PIPELINES_PATH, or given as a path)
+    path = name if os.path.isfile(name) else os.path.join(DSP_PIPELINES_PATH, name)
+    dsp_pipeline = DspPipeline(load_pipeline(path), FilterCache(FILTER_CACHE_PATH if FILTER_CACHE else None),
+                               os.path.basename(path))
+    print("DSP pipeline " + dsp_pipeline.name + ": " + dsp_pipeline.description)
+    return dsp_pipeline
+
+
+def channel_projection(labels, dsp_pipeline, selected=None):  # re-referencing and selection of the channels averaged
+    # OBS: <selected> labels override the ones of SELECTED_CHANNELS (e.g. config command), all the channels if empty
+    params = dsp_pipeline.params('reference') or {}
+    if selected is None:
+        selected = selected_channels if SELECTED_CHANNELS else []
+    return ChannelProjection(labels, dsp_pipeline.reference, params.get('neighbours'), params.get('pairs'),
+                             selected if len(selected) > 0 else None, EOG_CHANNELS)
+
+
+def gap_detector(srate):  # detector of the lost samples, filling the short gaps if required by GAP_POLICY
+    return GapDetector(srate, int(MAX_INTERPOLATED_GAP * srate) if GAP_POLICY == 'interpolate' else 0)
+
+
+def build_core(srate, labels, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline, selected=None):
+    """
+    Processing core of an EEG stream (see Core.py), as set by the DSP pipeline and by the constants and flags of this file.
+
+    Parameters:
+        srate (float): Sampling rate of the stream.
+        labels (list): Labels of the channels of the stream.
+        pause_pre_ev (float): Baseline duration (s).
+        event_length (float): Stimulus duration (s).
+        pause_post_ev (float): Post-stimulus duration (s).
+        dsp_pipeline (DspPipeline): Stages of the processing (re-referencing and filters, designed for <srate>).
+        selected (list): Labels of the channels averaged (all if empty), None for the ones of SELECTED_CHANNELS.
+
+    Returns:
+        ReceiverCore: Processing core of the stream.
+    """
+    # compute length of segments from values of srate, pause_pre_ev, pause_post_ev and event_length
+    samples_pre_ev = int(np.ceil(pause_pre_ev * srate))
+    samples_post_ev = int(np.ceil(pause_post_ev * srate))
+    event_samples = int(np.ceil(event_length * srate))
+    dequeues_len = samples_pre_ev + samples_post_ev + event_samples
+
+    # re-referencing and selection of the channels, a single matrix product for each incoming block
+    projection = channel_projection(labels, dsp_pipeline, selected)
+    n_channels = len(projection.labels)
+
+    # filters designed for the actual srate of the stream (band-pass and notch), taken from the cache if already designed
+    # zero-phase filter of whole epochs, for all channels at once (add 1s before and after segment, to avoid filter distortion)
+    epoch_filter = EpochFilter(dsp_pipeline.fir(srate), dsp_pipeline.notch_sos(srate), dequeues_len, int(srate))
+    stream_filter = None
+    delay_time = 0.0  # s, filtered samples are stored with the timestamp of the raw sample they mostly depend on
+    sos = dsp_pipeline.streaming_sos(srate) if STREAMING_FILTER else None
+    if sos is not None:
+        # the ring will contain already filtered data, so epochs are just sliced from it
+        stream_filter = StreamingFilter(sos, n_channels)
+        if GROUP_DELAY_COMPENSATION and dsp_pipeline.centre_freq() is not None:
+            # OBS: group delay evaluated at the centre (geometric mean) of the pass-band
+            delay_time = group_delay_samples(sos, dsp_pipeline.centre_freq(), srate) / srate
+
+    rejector = None
+    if ARTIFACT_REJECTION:
+        rejector = EpochRejector(n_channels, REJECT_PEAK_TO_PEAK, REJECT_ABSOLUTE, REJECT_FLAT,
+                                 [projection.labels.index(label) for label in EOG_CHANNELS if label in projection.labels],
+                                 REJECT_EOG_CORRELATION)
+
+    # detector of the lost samples (counters and histogram of the gaps, filling of the short ones)
+    return ReceiverCore(srate, CONDITIONS, samples_pre_ev, dequeues_len, MAX_CHUNK_SAMPLES, projection, epoch_filter,
+                        gap_detector(srate), GAP_POLICY, stream_filter, delay_time, rejector, AVERAGING_MODES, AVERAGING_WINDOW,
+                        AVERAGING_HALF_LIFE)
+
+
+def replay_history(core, history, markers):
+    """
+    Processes again, with a new processing core (e.g. new window or channels), the samples kept in <history> as received and
+    the markers received meanwhile, so that its averages include the epochs of the recent data. Epochs still incomplete
+    are left to the core, to be completed by the next samples.
+
+    Parameters:
+        core (ReceiverCore): New processing core.
+        history (EpochRing): Last samples of the stream, as received (all its channels).
+        markers (deque): (marker, timestamp) of the markers received meanwhile.
+
+    Returns:
+        int: Number of epochs averaged.
+    """
+    n = history.n_valid()
+    if n == 0:
+        return 0
+    data, times = history.latest(n)
+    for marker, marker_time in markers:
+        if marker_time >= times[0]:
+            core.schedule(marker, marker_time)
+    n_averaged = 0
+    for start in range(0, n, MAX_CHUNK_SAMPLES):  # in blocks, as if received again
+        block, block_times, _ = core.receive(data[start:start + MAX_CHUNK_SAMPLES], times[start:start + MAX_CHUNK_SAMPLES])
+        core.buffer(block, block_times)
+        completed, segments, gapped = core.pop_epochs()
+        if segments is None:
+            continue
+        segments = core.filter(segments)
+        rejected, skipped = core.reject(segments, gapped)
+        for i, (_, cond_id, _) in enumerate(completed):
+            if skipped[i]:
+                continue
+            if rejected[i]:
+                core.averages.reject(cond_id)
+            else:
+                core.averages.update(cond_id, segments[i])
+                n_averaged += 1
+    return n_averaged
+
+
+def stopping_criterion(core):  # significance of the difference between the first two conditions, on the checked channels
+    start = core.samples_pre_ev + int(round(STOPPING_WINDOW[0] * core.srate))
+    stop = min(core.samples_pre_ev + int(round(STOPPING_WINDOW[1] * core.srate)), core.length)
+    channels = [core.labels.index(label) for label in (STOPPING_CHANNELS or []) if label in core.labels]
+    return StoppingCriterion((0, 1), start, max(stop, start + 1), core.n_channels, channels or None, STOPPING_THRESHOLD,
+                             STOPPING_MIN_TRIALS)
@@ -0,0 +1,63 @@
+"""Spatial re-referencing and selection of the EEG channels, applied to each incoming block as a single matrix product"""
+import numpy as np
+
+REFERENCES = [None, 'car', 'laplacian', 'bipolar']
+
+
+class ChannelProjection:
+    """
+    (channels x outputs) projection matrix, built once from the labels of the stream, combining a re-referencing and the
+    selection of the output channels: common average of the EEG channels subtracted from each of them ('car'), average of
+    the listed neighbours subtracted from each channel ('laplacian', channels without neighbours left as they are) or
+    differences of pairs of channels ('bipolar', outputs labelled '<first>-<second>'). The excluded channels (e.g. EOG)
+    are neither re-referenced nor used as reference. A block is projected as block @ matrix, or returned as it is if the
+    projection is the identity.
+
+    Parameters:
+        labels (list): Labels of the channels of the stream.
+        reference (str): Re-referencing, one of REFERENCES (None to keep the channels as received).
+        neighbours (dict): Labels of the neighbours of each channel, for the 'laplacian' reference (missing ones ignored).
+        pairs (list): (first, second) pairs of labels, for the 'bipolar' reference.
+        selected (list): Labels of the outputs kept (in the order of the outputs), None to keep all of them.
+        excluded (list): Labels of the channels left as they are.
+    """
+
+    def __init__(self, labels, reference=None, neighbours=None, pairs=None, selected=None, excluded=()):
+        if reference not in REFERENCES:
+            raise ValueError("unknown reference '" + str(reference) + "', expected one of " + str(REFERENCES))
+        ids = {label: i for i, label in enumerate(labels)}
+        eeg_ids = [i for i, label in enumerate(labels) if label not in excluded]
+        if reference == 'bipolar':
+            missing = [label for pair in pairs for label in pair if label not in ids]
+            if len(missing) > 0:
+                raise ValueError("bipolar pairs with channels not in the stream: " + str(missing))
+            out_ids = [i for i, label in enumerate(labels) if label in excluded]  # kept as they are, after the pairs
+            matrix = np.zeros((len(labels), len(pairs) + len(out_ids)))
+            for j, (first, second) in enumerate(pairs):
+                matrix[ids[first], j] = 1
+                matrix[ids[second], j] = -1
+            matrix[out_ids, len(pairs) + np.arange(len(out_ids))] = 1
+            out_labels = [first + '-' + second for first, second in pairs] + [labels[i] for i in out_ids]
+        else:
+            matrix = np.eye(len(labels))
+            out_labels = list(labels)
+            if reference == 'car' and len(eeg_ids) > 0:
+                matrix[np.ix_(eeg_ids, eeg_ids)] -= 1 / len(eeg_ids)
+            elif reference == 'laplacian':
+                for label, channel_neighbours in neighbours.items():
+                    if label in ids and label not in excluded:
+                        neighbour_ids = [ids[n] for n in channel_neighbours if n in ids and n not in excluded]
+                        if len(neighbour_ids) > 0:
+                            matrix[neighbour_ids, ids[label]] -= 1 / len(neighbour_ids)
+        if selected is not None:
+            keep = [j for j, label in enumerate(out_labels) if label in selected]
+            matrix = matrix[:, keep]
+            out_labels = [out_labels[j] for j in keep]
+        self.matrix = matrix
+        self.labels = out_labels
+        self.identity = matrix.shape[0] == matrix.shape[1] and np.array_equal(matrix, np.eye(len(labels)))
+
+    def process(self, block):  # project a (samples x channels) block
+        if self.identity:
+            return block
+        return block @ self.matrix
@@ -1,5 +1,4 @@
-"""Read a multi-channel time series with proper meta-data from LSL in single samples and compute averaged potential"""
-import csv
+"""Read a multi-channel time series with proper meta-data from LSL in chunks (or single samples) and compute averaged potential"""
 import getopt
 import os
 import signal
@@ -10,8 +9,26 @@ from time import sleep
 
 import numpy as np
 import pylsl.pylsl
-from pylsl import StreamInlet, resolve_stream, StreamInfo, StreamOutlet
-from scipy import signal as dsp
+from pylsl import StreamInlet, resolve_stream, resolve_bypred, StreamInfo, StreamOutlet, cf_double64
+
+from Averaging import CheckpointRing
+from Classifier import P300Classifier
+from EpochRing import EpochRing
+from Rejection import REASONS
+from Gaps import STATS_LABELS
+from Filters import OutputDecimator
+from Metrics import StageMetrics
+from MultiStream import StreamState, filter_together
+from Recorder import RecordingWriter
+# processing of the streams, with its constants and flags (see Processing.py)
+from Processing import PAUSE_PRE_EV, EVENT_LENGTH, PAUSE_POST_EV, CONDITIONS, CONDITION_NAMES, DSP_PIPELINE, MAX_CHUNK_SAMPLES, \
+    SELECTED_CHANNELS, selected_channels, STREAMING_FILTER, ARTIFACT_REJECTION, ADAPTIVE_STOPPING, build_core, \
+    channel_projection, load_dsp_pipeline, replay_history, stopping_criterion
+
+SESSION_PATH = os.path.join("..", "Session")
+sys.path.insert(0, SESSION_PATH)
+from Session import SessionWriter
+from EpochArchive import EpochArchiveWriter
 
 # Constants -------------------------------------------------------------------------------------------------------------------------
 DATE_STR = time.strftime("%Y_%b_%d_%H%M")
@@ -19,27 +36,79 @@ OUTPUT_PATH = os.path.join("..", "..", "output", "Recordings", "rec_session_" +
 OUTPUT_FILE_EEG = 'eeg_session_' + DATE_STR + '.csv'    # EEG dataset
 OUTPUT_FILE_EVS = 'evs_session_' + DATE_STR + '.csv'    # events dataset
 OUTPUT_FILE_DISC = 'disc_session_' + DATE_STR + '.csv'  # discard dataset
+OUTPUT_DIR_SESSION = 'bin_session_' + DATE_STR         # binary session (EEG, events and discard datasets)
+OUTPUT_FILE_METRICS = 'metrics_session_' + DATE_STR + '.json'  # latency and throughput of the processing
+OUTPUT_DIR_EPOCHS = 'epochs_session_' + DATE_STR       # archive of the single epochs (see EpochArchive.py)
 
-# filter values (band-pass)
-FRI_NUMTAPS = 1000
-LOWER_COF = 1   # lower cutoff frequency
-UPPER_COF = 24  # upper cutoff frequency
+# values defining the background writing of the datasets
+RECORDING_QUEUE_SIZE = 256      # maximum number of blocks waiting to be written
+RECORDING_FLUSH_INTERVAL = 1.0  # s, time between consecutive flushes of the files
+RECORDING_FSYNC = 'close'       # when to force the files to disk: 'never', 'flush' (at each flush) or 'close'
 
-# filter values (notch filter)
-SAMP_FREQ = 1000  # sample frequency (Hz)
-NOTCH_FREQ = 50.0  # frequency to be removed from signal (Hz)
-QUALITY_FACTOR = 30.0  # quality factor
+# values defining the archive of the single epochs
+ARCHIVE_GROWTH = 256            # number of trials the file of a condition is extended by, when full
+ARCHIVE_COMMIT_INTERVAL = 1.0   # s, time between consecutive commits of the archived trials
 
-# values defining size of window used to calculate aligned averaged potentials
-PAUSE_PRE_EV = 0.0      # s, baseline duration
-EVENT_LENGTH = 0.5      # s, stimulus duration
-PAUSE_POST_EV = 0.3     # s, post-stimulus duration
+# values defining the reports on the lost samples
+GAP_STATS_INTERVAL = 5.0    # s, time between consecutive reports on the gap stream
 
-# Flags and variables for optional features -----------------------------------------------------------------------------------------
-SELECTED_CHANNELS = False   # flag to compute and plot the averaged potentials of a subset of channels
-selected_channels = ['Cz']
+# values defining chunked ingestion
+MAX_CHUNK_LATENCY = 0.05    # s, maximum time waited for a chunk to be filled
+
+# values defining the multi-process pipeline
+PIPELINE_RING_SECONDS = 10  # s, samples kept in the ring shared by ingestion, processing and recording
+
+# values defining the multi-stream mode (one Receiver for several EEG streams, e.g. hyperscanning)
+N_EEG_STREAMS = 2                       # number of EEG streams to be resolved (ordered by name)
+EEG_STREAM_PREDICATE = "type='EEG'"     # XPath predicate selecting the EEG streams
+
+# values defining the single-trial classifier (epochs of the target condition vs the ones of the other conditions)
+CLASSIFIER_TARGET = 'R'     # marker of the target condition
+CALIBRATION_TRIALS = 200    # number of epochs used to train the classifier, before publishing scores
+XDAWN_FILTERS = 4           # number of spatial filters
+FEATURES_RATE = 20          # Hz, rate of the decimated epochs used as features
+LDA_SHRINKAGE = 0.1         # shrinkage of the covariance of the features (between 0 and 1)
+
+# values defining the rollback of the averages (discard command)
+CHECKPOINT_INTERVAL = 0.5   # s, time between consecutive snapshots of the averages
+ROLLBACK_WINDOW = 60        # s, maximum time that can be discarded
+DISCARD_SECONDS = 10        # s, time discarded if not specified by the console command
+
+# values defining the reconfiguration of the epoch window and of the channels averaged (config command)
+RECONFIGURE_HISTORY = 30    # s, raw samples (and markers) kept to compute the averages again with the new window and channels
+PLOTTER_WAIT = 5.0          # s, maximum time the previous stream of the averages is kept for the Plotter to leave it
 
+# values defining the instrumentation of the processing loop
+STAGES = ['ingest', 'recording', 'gap_check', 'buffer', 'markers', 'epoch_filter', 'rejection', 'averaging', 'classifier',
+          'publish', 'console']
+METRICS_INTERVAL = 1.0      # s, time between consecutive reports on the metrics stream
+
+# Flags and variables for optional features -----------------------------------------------------------------------------------------
 RECORDING = True            # flag to save datasets of the experiments
+RECORDING_FORMAT = 'both'   # format of the saved datasets: 'csv', 'binary' (see Session.py) or 'both'
+
+REEPOCH_HISTORY = True      # flag to compute again the averages of the last RECONFIGURE_HISTORY s when reconfigured, instead
+                            # of restarting them from scratch (a copy of each incoming chunk is kept)
+
+EPOCH_ARCHIVE = False       # flag to save each filtered epoch (also the rejected ones) in a memory-mapped archive, for offline
+                            # single-trial analyses (in OUTPUT_PATH, independently of RECORDING)
+
+SHARED_MEMORY = False       # flag to send the averages to a Plotter on the same host through shared memory, instead of LSL
+
+CHUNKED_INGESTION = True    # flag to pull EEG data in chunks (instead of one sample at a time)
+
+MULTI_STREAM = False        # flag to receive several EEG streams at once, each with its own averages (see N_EEG_STREAMS)
+                            # OBS: CLASSIFIER, PIPELINE and SHARED_MEMORY flags not supported in this mode
+
+PIPELINE = False            # flag to pull from LSL and to record in separate processes (chunked ingestion, shared ring)
+
+CLASSIFIER = False          # flag to classify each epoch (target vs non-target) and publish its score
+
+CRITERION_MESSAGE = True    # flag to send "CRITERION" to the Console once reached, so that Stims and Sender can end the block
+
+METRICS = True              # flag to publish latency and throughput of the processing on LSL, and to save them at the end
+
+GAP_STATS = True            # flag to publish the statistics of the lost samples (counters and histogram of gaps) on LSL
 
 USING_CONSOLE = True        # flag to enable the console control
 
@@ -50,22 +119,90 @@ if USING_CONSOLE:
     sys.path.insert(0, CONSOLE_PATH)
     from Console import DEBUG_PRINT  # overwrite the value of DEBUG_PRINT flag with the one inside Console file
 
+if PIPELINE:
+    from Pipeline import ReceiverPipeline  # OBS: requires Python >= 3.8
 
-def avg(data_segment, segment_avg, n_event):  # computes cumulative moving average
-    segment_avg = (data_segment + (n_event * segment_avg)) / (n_event + 1)
-    n_event += 1
-    return segment_avg, n_event
+if SHARED_MEMORY:
+    SHARED_AVG_PATH = os.path.join("..", "SharedAvg")
+    sys.path.insert(0, SHARED_AVG_PATH)
+    from SharedAvg import SharedAvgWriter  # OBS: requires Python >= 3.8
 
 
-def main(argv):
+def publish_avg(avg_outlet, avg_chunk, averages, cond_id, timestamp, decimator, shared_avg=None):
+    # send averaged potentials of a condition
+    # OBS: the last three channels of the chunk carry the id of the condition, the number of averaged and of rejected trials
+    avg_chunk[:, :-3] = decimator.process(averages.mean[cond_id])  # resampled at the output rate
+    if shared_avg is not None:  # same host: the whole state is published in shared memory instead
+        shared_avg.update(cond_id, avg_chunk[:, :-3])
+        shared_avg.publish(averages.count, averages.rejected, timestamp)
+        return
+    avg_chunk[:, -3] = cond_id
+    avg_chunk[:, -2] = averages.count[cond_id]
+    avg_chunk[:, -1] = averages.rejected[cond_id]
+    avg_outlet.push_chunk(avg_chunk, timestamp)
+
+
+def publish_reset(avg_outlet, avg_chunk, averages, timestamp, decimator, shared_avg=None):
+    # send averaged potentials of all the conditions after a restart or a discard, with the time of the reset
+    last_id = len(averages.count) - 1
+    if shared_avg is not None:  # a single publication of the whole state
+        for cond_id in range(last_id + 1):
+            shared_avg.update(cond_id, decimator.process(averages.mean[cond_id]))
+        shared_avg.publish(averages.count, averages.rejected, timestamp, reset=True)
+        return
+    # one chunk for each condition, the last one with the time of the reset
+    for cond_id in range(last_id + 1):
+        publish_avg(avg_outlet, avg_chunk, averages, cond_id, timestamp if cond_id == last_id else 0.00001, decimator)
+
+
+def split_markers(markers, marker_times, split_time):
+    # markers (with their timestamps) up to the given time and the ones following it (all of them if the time is None)
+    before, after = ([], []), ([], [])
+    for marker, marker_time in zip(markers, marker_times):
+        part = after if split_time is None or marker_time > split_time else before
+        part[0].append(marker)
+        part[1].append(marker_time)
+    return before, after
+
+
+def close_recording(recorder):  # write the rows still queued and close the csv files, reporting any backpressure
+    print("Closing csv file...", end=" ")
+    recorder.close()
+    print("done!")
+    stats = recorder.stats()
+    if stats["n_full"] > 0:
+        print("\033[1;31;48m" + "Recording queue was full " + str(stats["n_full"]) + " times!" + "\033[1;37;0m" +
+              " max rows kept in memory: " + str(stats["max_overflow_rows"]))
+
+
+def close_archive(archive, name=""):  # commit the archived epochs and truncate the files to them
+    archive.close()
+    print("Archived epochs" + name + ": " + ", ".join(cond_name + " " + str(epochs.n)
+                                                     for cond_name, epochs in zip(CONDITION_NAMES, archive.epochs)))
+
+
+def close_pipeline(pipeline):  # stop the ingestion and wait for the recording of everything received
+    print("Stopping pipeline...", end=" ")
+    pipeline.close()
+    print("done!")
+
+
+def dump_metrics(metrics, srate, n_channels):  # save the latency and throughput of the whole session
+    print("Saving metrics...", end=" ")
+    metrics.dump(os.path.join(OUTPUT_PATH, OUTPUT_FILE_METRICS), {"srate": srate, "n_channels": n_channels})
+    print("done!")
+
+
+def parse_args(argv):  # values defining the window of the epochs and DSP pipeline, from arguments of main if these are given
     pause_pre_ev = PAUSE_PRE_EV
     event_length = EVENT_LENGTH
     pause_post_ev = PAUSE_POST_EV
+    dsp_pipeline = DSP_PIPELINE
 
-    # get values from arguments of main if these are given
-    help_string = 'Receiver.py -b <pause_pre_ev> -e <event_length> -p <pause_post_ev>'
+    help_string = 'Receiver.py -b <pause_pre_ev> -e <event_length> -p <pause_post_ev> -f <dsp_pipeline>'
     try:
-        opts, args = getopt.getopt(argv, "hb:e:p:", longopts=["pause_pre_ev=", "event_length=", "pause_post_ev"])
+        opts, args = getopt.getopt(argv, "hb:e:p:f:", longopts=["pause_pre_ev=", "event_length=", "pause_post_ev",
+                                                                "dsp_pipeline="])
     except getopt.GetoptError:
         print(help_string)
         sys.exit(2)
@@ -79,6 +216,204 @@ def main(argv):
             event_length = float(arg)
         elif opt in ("-p", "--pause_post_ev"):
             pause_post_ev = float(arg)
+        elif opt in ("-f", "--dsp_pipeline"):
+            dsp_pipeline = arg
+    return pause_pre_ev, event_length, pause_post_ev, load_dsp_pipeline(dsp_pipeline)
+
+
+def stream_labels(info, reference):  # labels of the channels of an EEG stream, and indexes of the recorded ones (None for all)
+    ch = info.desc().child("channels").child("channel")
+    labels = []
+    for i in range(info.channel_count()):
+        labels.append(ch.child_value("label"))
+        ch = ch.next_sibling()
+    # OBS: all the channels are recorded when re-referencing, so that the reference can be computed again offline
+    labels_ids = None
+    if SELECTED_CHANNELS and reference is None:
+        labels_ids = [i for i, label in enumerate(labels) if label in selected_channels]
+    return labels, labels_ids
+
+
+def session_header(srate, labels, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline):  # metadata of a binary session
+    band = dsp_pipeline.params('bandpass') or {}
+    notch = dsp_pipeline.params('notch') or {}
+    return {"srate": srate, "labels": labels, "conditions": CONDITIONS, "condition_names": CONDITION_NAMES,
+            "pause_pre_ev": pause_pre_ev, "event_length": event_length, "pause_post_ev": pause_post_ev,
+            "filter": {"streaming": STREAMING_FILTER, "lower_cof": band.get('lower_cof'), "upper_cof": band.get('upper_cof'),
+                       "fir_numtaps": band.get('fir_numtaps'), "iir_order": band.get('iir_order'),
+                       "notch_freq": notch.get('notch_freq'), "quality_factor": notch.get('quality_factor')},
+            "dsp_pipeline": dsp_pipeline.to_dict()}
+
+
+def epoch_archive(path, core, srate, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline):  # archive of the single epochs
+    header = dict(session_header(srate, core.labels, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline),
+                  samples_pre_ev=core.samples_pre_ev)
+    return EpochArchiveWriter(path, header, core.length, ARCHIVE_GROWTH)
+
+
+def report_gaps(gaps, metrics):  # warn about the samples lost (or invalid) between consecutive timestamps
+    for prev_time, next_time, n_lost in gaps:
+        metrics.count('dropped_samples', int(n_lost))
+        # OBS: actual time > previous time + 1.5 time steps (=1/srate), i.e. at least one sample missing
+        if not DEBUG_PRINT:
+            sys.stdout.write("\n")
+        print("\033[1;31;48m" + "Lost or invalid sample! Check the terminal of the Sender to see if an 'invalid"
+              " sample' print is present; if not, the sample has been lost" + "\033[1;37;0m" +  # code to have red print
+              " previous timestamp: {}, current one: {}".format(prev_time, next_time))
+        if DEBUG_PRINT:
+            print("")
+
+
+def gap_stream(source_id='myuid2428'):  # outlet of the statistics of the lost samples in the whole session (low rate)
+    gap_info = StreamInfo('gapStream', 'gaps', len(STATS_LABELS), 0, 'float32', source_id)
+    chns = gap_info.desc().append_child("channels")
+    for label in STATS_LABELS:
+        ch = chns.append_child("channel")
+        ch.append_child_value("label", label)
+    return StreamOutlet(gap_info)
+
+
+def print_gaps(gaps, name=""):  # summary of the lost samples of the session
+    n_gaps, n_lost, n_filled, n_affected = gaps.stats()[:4]
+    print("Lost samples" + name + ": " + str(n_lost) + " in " + str(n_gaps) + " gaps (" + str(n_filled) + " filled), " +
+          str(n_affected) + " epochs affected")
+
+
+def metrics_stream():  # outlet of the metrics of the last interval (rates, depth of recording queue, latency of each stage)
+    metrics_labels = ['samples_per_s', 'events_per_s', 'dropped_samples', 'queue_depth']
+    for stage in STAGES:
+        metrics_labels += [stage + '_mean_ms', stage + '_p95_ms', stage + '_max_ms']
+    metrics_info = StreamInfo('metricsStream', 'metrics', len(metrics_labels), 0, 'float32', 'myuid2426')
+    chns = metrics_info.desc().append_child("channels")
+    for label in metrics_labels:
+        ch = chns.append_child("channel")
+        ch.append_child_value("label", label)
+    return StreamOutlet(metrics_info)
+
+
+def avg_stream_info(labels, avg_len, srate, output_srate, pause_pre_ev, event_length, pause_post_ev, averaging,
+                    source_id='myuid2425', subject=None):  # info of the stream of the averaged potentials sent to the plotter, with its meta-data
+    # OBS: three more channels, carrying the id of the condition, the number of trials averaged and of trials rejected
+    avg_info = StreamInfo('avgStream', 'avg', len(labels) + 3, 0, 'float32', source_id)
+
+    # append some meta-data
+    chunk_info = avg_info.desc().append_child("chunk")
+    chunk_info.append_child_value("size", str(avg_len))
+
+    chns = avg_info.desc().append_child("channels")
+    for label in labels:
+        ch = chns.append_child("channel")
+        ch.append_child_value("label", label)
+    for label in ["condition", "n_trials", "n_rejected"]:
+        ch = chns.append_child("channel")
+        ch.append_child_value("label", label)
+        ch.append_child_value("type", "meta")
+
+    conds = avg_info.desc().append_child("conditions")
+    for cond_id, (marker, name) in enumerate(zip(CONDITIONS, CONDITION_NAMES)):
+        cond = conds.append_child("condition")
+        cond.append_child_value("id", str(cond_id))
+        cond.append_child_value("marker", marker)
+        cond.append_child_value("name", name)
+        cond.append_child_value("averaging", averaging[cond_id])  # mode (and its parameter) of the averages
+
+    x_info = avg_info.desc().append_child("x_info")
+    x_info.append_child_value("pause_pre_ev", str(pause_pre_ev))
+    x_info.append_child_value("event_length", str(event_length))
+    x_info.append_child_value("pause_post_ev", str(pause_post_ev))
+    x_info.append_child_value("EEG_srate", str(srate))
+    x_info.append_child_value("output_srate", str(output_srate))  # rate of the samples of the averages
+    if subject is not None:  # multi-stream mode, name of the EEG stream the averages come from
+        x_info.append_child_value("subject", subject)
+    return avg_info
+
+
+def parse_config(words, labels):
+    """
+    Epoch window and channels requested by a config console command: 'CONFIG <pause_pre_ev> <event_length> <pause_post_ev>'
+    followed by the labels of the channels averaged separated by commas (case insensitive), or by ALL for all of them.
+
+    Parameters:
+        words (list): Arguments of the command.
+        labels (list): Labels of the channels that can be averaged (after re-referencing).
+
+    Returns:
+        tuple: (pause_pre_ev, event_length, pause_post_ev) and labels of the channels averaged (None to keep the current ones,
+            empty for all), None if the command is not valid.
+    """
+    try:
+        window = tuple(float(word) for word in words[:3])
+    except ValueError:
+        window = ()
+    if len(window) < 3 or min(window) < 0 or sum(window) <= 0:
+        print("\nConfig command ignored, expected: CONFIG <pause_pre_ev> <event_length> <pause_post_ev> [<channels> | ALL]")
+        return None
+    selected = None
+    if len(words) > 3:
+        by_name = {label.upper(): label for label in labels}
+        selected = [] if words[3].upper() == 'ALL' else [by_name[word.upper()] for word in words[3].split(',')
+                                                          if word.upper() in by_name]
+        if words[3].upper() != 'ALL' and len(selected) == 0:
+            print("\nConfig command ignored, none of the channels " + words[3] + " found in " + str(labels))
+            return None
+    return window, selected
+
+
+def parse_discard(words):
+    """
+    Time discarded by a discard console command: 'DISCARD', or 'DISCARD <seconds>' (at most ROLLBACK_WINDOW).
+
+    Parameters:
+        words (list): Arguments of the command.
+
+    Returns:
+        float: Seconds discarded (DISCARD_SECONDS if not given), None if the command is not valid.
+    """
+    try:
+        seconds = float(words[0]) if len(words) > 0 else DISCARD_SECONDS
+    except ValueError:
+        seconds = 0.0
+    if not seconds > 0:  # OBS: nan too
+        print("\nDiscard command ignored, expected: DISCARD [<seconds>] with seconds > 0")
+        return None
+    return min(seconds, ROLLBACK_WINDOW)
+
+
+def print_criterion(stopping, labels, name=""):  # message of the criterion reached
+    if not DEBUG_PRINT:
+        sys.stdout.write("\n")
+    best = stopping.best_channel()
+    print("\033[1;32;48m" + "Criterion reached" + name + "!" + "\033[1;37;0m" + " t = " + "{:.2f}".format(stopping.t[best]) +
+          " on " + labels[best] + " after " + " and ".join(str(n) + " " + CONDITION_NAMES[c]
+                                                           for c, n in enumerate(stopping.count)) + " epochs")  # green print
+
+
+def wait_console():  # inlet of the Console and outlet towards it, once all the interested processes are ready
+    ''' Continuously sends to the Console a key message ("OK"), to 
+    confirm that this process is ready to begin the acquisition
+    and wait for a key message ("NEXT") from the Console that will
+    arrive when all the interested processes are ready '''
+    info_console = pylsl.StreamInfo('Receiver', 'Text', 1, 0, 'string')
+    outlet_console = pylsl.StreamOutlet(info_console)
+
+    console_streams = resolve_stream('name', 'Console')
+    console_inlet = StreamInlet(console_streams[0], recover=False)
+
+    print("Ready to receive data!")
+
+    while True:
+        try:
+            outlet_console.push_sample(['OK'])
+            msg, timestamp = console_inlet.pull_sample(timeout=0)
+            if msg is not None and msg[0] == 'NEXT':
+                return console_inlet, outlet_console
+        except (pylsl.pylsl.LostError, pylsl.pylsl.TimeoutError):
+            sys.stdout.write("\n")
+            sys.exit()
+
+
+def main(argv):
+    pause_pre_ev, event_length, pause_post_ev, dsp_pipeline = parse_args(argv)
 
     # EEG data ----------------------------------------------------------------------------------------------------------------------
     # first resolve an EEG stream on the lsl network
@@ -91,96 +426,123 @@ def main(argv):
     # get stream info
     info = data_inlet.info()
     srate = info.nominal_srate()  # Hz
-    n_channels = info.channel_count()
-    ch = info.desc().child("channels").child("channel")
-    labels = []
-    labels_ids = []
-    for i in range(n_channels):
-        if not SELECTED_CHANNELS:
-            labels.append(ch.child_value("label"))
-        else:
-            if ch.child_value("label") in selected_channels:
-                labels.append(ch.child_value("label"))
-                labels_ids.append(i)
-        ch = ch.next_sibling()
-    n_channels = len(labels)
-
-    # compute length of segments from values of srate, pause_pre_ev, pause_post_ev and event_length
-    samples_pre_ev = int(np.ceil(pause_pre_ev * srate))
-    samples_post_ev = int(np.ceil(pause_post_ev * srate))
-    event_samples = int(np.ceil(event_length * srate))
-    dequeues_len = samples_pre_ev + samples_post_ev + event_samples
-
-    # create dequeues fot EEG data and timestamps
-    data_segment = deque([0 for _ in range(dequeues_len)])
-    time_segment = deque([0 for _ in range(dequeues_len)])
-
-    # initialization for avg
-    f_events = []       # list containing timestamp of frequent events occurred but yet not considered
-    r_events = []       # list containing timestamp of rare events occurred but yet not considered
-    n_freq_event = 0
-    n_rare_event = 0
-    f_segment_avg = np.zeros((dequeues_len, n_channels))
-    r_segment_avg = np.zeros((dequeues_len, n_channels))
+    stream_channels, labels_ids = stream_labels(info, dsp_pipeline.reference)
+    if PIPELINE:
+        # OBS: the EEG data are pulled by the ingestion process, so the inlet is closed to not queue the whole stream here
+        data_inlet.close_stream()
+
+    # processing of the stream (re-referencing, gap check, ring of the last samples, scheduled epochs, filters, rejection)
+    core = build_core(srate, stream_channels, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline)
+    averages = core.averages
+    labels = core.labels  # labels of the channels averaged
+    n_channels = core.n_channels
+    dequeues_len = core.length
+
+    # preallocated destination buffer for the chunks pulled from LSL (all the channels of the stream)
+    chunk_buffer = np.zeros((MAX_CHUNK_SAMPLES, info.channel_count()),
+                            dtype=np.float64 if info.channel_format() == cf_double64 else np.float32)
+
+    output_labels = channel_projection(stream_channels, dsp_pipeline, []).labels  # channels that can be averaged
+    n_configs = 0  # number of reconfigurations (config command)
+    old_avg_outlet = None  # previous stream of the averages, kept until the plotter has connected to the new one
+    plotter_deadline = 0.0  # time the previous stream is kept until
+    if REEPOCH_HISTORY:
+        # last samples as received and markers, to compute the averages again when the window or the channels change
+        history = EpochRing(int(RECONFIGURE_HISTORY * srate), info.channel_count(), chunk_buffer.dtype)
+        history_markers = deque()
+
     if USING_CONSOLE:
-        f_segment_avg_10s = np.zeros((dequeues_len, n_channels))
-        r_segment_avg_10s = np.zeros((dequeues_len, n_channels))
-        # dict containing averages computed in last 10 s, together with the number of frequent and rare events averaged at that time
-        dict_avg_10s = {-1: [f_segment_avg_10s, r_segment_avg_10s, n_freq_event, n_rare_event],
-                        0: [f_segment_avg_10s, r_segment_avg_10s, n_freq_event, n_rare_event]}
+        # snapshots of the averages (mean, M2 and number of events of each condition) computed in last ROLLBACK_WINDOW s
+        checkpoints = CheckpointRing(averages, CHECKPOINT_INTERVAL, ROLLBACK_WINDOW)
+
+    if CLASSIFIER:
+        # epochs decimated by averaging blocks of samples, to get features at about FEATURES_RATE Hz
+        classifier = P300Classifier(dequeues_len, n_channels, max(int(srate // FEATURES_RATE), 1), XDAWN_FILTERS, LDA_SHRINKAGE)
+        target_id = averages.ids[CLASSIFIER_TARGET]
 
-    # needed computations for filters
-    avg_padded = np.zeros(((2 * int(srate)) + dequeues_len))  # add 1s before and after segment, to avoid filter distortion
-    fir = dsp.firwin(FRI_NUMTAPS, [LOWER_COF, UPPER_COF], pass_zero=False, fs=srate)    # for band-pass filter
-    b_notch, a_notch = dsp.iirnotch(NOTCH_FREQ, QUALITY_FACTOR, SAMP_FREQ)              # for notch filter
+    if ADAPTIVE_STOPPING:
+        stopping = stopping_criterion(core)
 
+    if EPOCH_ARCHIVE:
+        archive = epoch_archive(os.path.join(OUTPUT_PATH, OUTPUT_DIR_EPOCHS), core, srate, pause_pre_ev, event_length,
+                                pause_post_ev, dsp_pipeline)
+        archive_commit_time = time.perf_counter()
+
+    pipeline = None  # multi-process pipeline, started once the other streams have been resolved
     if RECORDING:
-        # initialize csv file
-        if not os.path.exists(OUTPUT_PATH):
-            os.makedirs(OUTPUT_PATH)
-        log_eeg = open(os.path.join(OUTPUT_PATH, OUTPUT_FILE_EEG), 'w', newline='')
-        log_evs = open(os.path.join(OUTPUT_PATH, OUTPUT_FILE_EVS), 'w', newline='')
-        log_disc = open(os.path.join(OUTPUT_PATH, OUTPUT_FILE_DISC), 'w', newline='')
-        # create the csv writers
-        eeg_writer = csv.writer(log_eeg)
-        evs_writer = csv.writer(log_evs)
-        disc_writer = csv.writer(log_disc)
+        # initialize csv files and/or binary session, written by a background thread (the acquisition never waits for the disk)
+        # or, with the pipeline, by the recording process
+        files = {}
+        if RECORDING_FORMAT in ('csv', 'both'):
+            files = {'eeg': OUTPUT_FILE_EEG, 'evs': OUTPUT_FILE_EVS, 'disc': OUTPUT_FILE_DISC}
+        session_path = None
+        header = None
+        if RECORDING_FORMAT in ('binary', 'both'):
+            session_path = os.path.join(OUTPUT_PATH, OUTPUT_DIR_SESSION)
+            header = session_header(srate, stream_channels if labels_ids is None else [stream_channels[i] for i in labels_ids],
+                                    pause_pre_ev, event_length, pause_post_ev, dsp_pipeline)
+        if not PIPELINE:
+            session = SessionWriter(session_path, header) if session_path is not None else None
+            recorder = RecordingWriter(OUTPUT_PATH, files, RECORDING_QUEUE_SIZE, RECORDING_FLUSH_INTERVAL, RECORDING_FSYNC,
+                                       session)
 
     # Plot data ---------------------------------------------------------------------------------------------------------------------
     # first create a new stream info. The last value would be a more or less locally
     # unique identifier for the stream as far as available (you could also omit
     # it but interrupted connections wouldn't auto-recover).
     # info = StreamInfo(name, type, n_channels, srate, channels_format, id)
-    avg_info = StreamInfo('avgStream', 'avg', n_channels, 0, 'float32', 'myuid2425')
+    decimator = OutputDecimator(srate, dsp_pipeline.output_rate)
+    avg_len = decimator.output_length(dequeues_len)  # number of samples of the averages sent
+    avg_info = avg_stream_info(labels, avg_len, srate, decimator.rate, pause_pre_ev, event_length, pause_post_ev,
+                               [averages.describe(c) for c in range(len(CONDITIONS))])
 
-    # append some meta-data
-    chunk_info = avg_info.desc().append_child("chunk")
-    chunk_info.append_child_value("size", str(dequeues_len))
-
-    chns = avg_info.desc().append_child("channels")
-    for label in labels:
-        ch = chns.append_child("channel")
-        ch.append_child_value("label", label)
+    avg_chunk = np.zeros((avg_len, n_channels + 3), dtype=np.float32)  # preallocated chunk sent to the plotter
+    avg_outlet = None
+    shared_avg = None
+    if SHARED_MEMORY:
+        # same metadata of the stream, kept in the shared memory block together with the newest averages
+        shared_avg = SharedAvgWriter({"labels": labels, "conditions": CONDITIONS, "condition_names": CONDITION_NAMES,
+                                      "pause_pre_ev": pause_pre_ev, "event_length": event_length,
+                                      "pause_post_ev": pause_post_ev, "EEG_srate": srate, "output_srate": decimator.rate,
+                                      "averaging": [averages.describe(c) for c in range(len(CONDITIONS))]},
+                                     avg_len)
+    else:
+        # next make an outlet, with chunk size = avg_len
+        avg_outlet = StreamOutlet(avg_info, avg_len)
 
-    x_info = avg_info.desc().append_child("x_info")
-    x_info.append_child_value("pause_pre_ev", str(pause_pre_ev))
-    x_info.append_child_value("event_length", str(event_length))
-    x_info.append_child_value("pause_post_ev", str(pause_post_ev))
-    x_info.append_child_value("EEG_srate", str(srate))
+    if CLASSIFIER:
+        # stream of the score of each epoch (positive for targets), with the id of its condition and if it has been
+        # computed (i.e. calibration completed), timestamp of the event
+        score_info = StreamInfo('scoreStream', 'scores', 3, 0, 'float32', 'myuid2427')
+        chns = score_info.desc().append_child("channels")
+        for label in ["score", "condition", "calibrated"]:
+            ch = chns.append_child("channel")
+            ch.append_child_value("label", label)
+        score_outlet = StreamOutlet(score_info)
 
-    # next make an outlet, with chunk size = dequeues_len
-    avg_outlet = StreamOutlet(avg_info, dequeues_len)
+    # Metrics -----------------------------------------------------------------------------------------------------------------------
+    # latency of each stage of the loop (always measured, the overhead is negligible) and counters of processed data
+    metrics = StageMetrics(STAGES, ['samples', 'events', 'dropped_samples'])
+    if METRICS:
+        metrics_outlet = metrics_stream()  # low-rate stream
+    if GAP_STATS:
+        gap_outlet = gap_stream()  # low-rate stream
+        gap_report_time = time.perf_counter()
 
     # define handler for whenever the application is interrupted (e.g. with ctrl+c)
-    def sigint_handler():
+    def sigint_handler(signum, frame):
         sys.stdout.write("\n")
         print('Application interrupted!')
-        if RECORDING:
-            print("Closing csv file...", end=" ")
-            log_eeg.close()
-            log_evs.close()
-            log_disc.close()
-            print("done!")
+        if PIPELINE and pipeline is not None:
+            close_pipeline(pipeline)
+        elif RECORDING and not PIPELINE:
+            close_recording(recorder)
+        if EPOCH_ARCHIVE:
+            close_archive(archive)
+        if METRICS:
+            dump_metrics(metrics, srate, n_channels)
+        if SHARED_MEMORY:
+            shared_avg.close()
         sys.exit()
 
     signal.signal(signal.SIGINT, sigint_handler)  # register the signal handler
@@ -188,278 +550,370 @@ def main(argv):
     sleep(0.1)  # OBS: added to avoid mixing of prints
     # Marker data -------------------------------------------------------------------------------------------------------------------
     print("Looking for markers' stream...", end=" ")
-    marker_streams = resolve_stream('name', 'MarkerStream')
-    # create a new inlet to read from the stream
-    marker_inlet = StreamInlet(marker_streams[0], recover=False)
+    if PIPELINE:
+        # the ingestion process resolves its own inlets of the EEG stream (by its uid, the one resolved above) and markers stream
+        recording = None
+        if RECORDING:
+            recording = {"path": OUTPUT_PATH, "files": files, "session_path": session_path, "header": header,
+                         "max_queue": RECORDING_QUEUE_SIZE, "flush_interval": RECORDING_FLUSH_INTERVAL,
+                         "fsync": RECORDING_FSYNC, "labels_ids": labels_ids}
+        pipeline = ReceiverPipeline(info.uid(), info.channel_count(), chunk_buffer.dtype.str, int(PIPELINE_RING_SECONDS * srate),
+                                    MAX_CHUNK_SAMPLES, MAX_CHUNK_LATENCY, USING_CONSOLE, recording)
+    else:
+        marker_streams = resolve_stream('name', 'MarkerStream')
+        # create a new inlet to read from the stream
+        marker_inlet = StreamInlet(marker_streams[0], recover=False)
     print("done!")
 
     # Setup console -----------------------------------------------------------------------------------------------------------------
     if USING_CONSOLE:
-        ''' Continuously sends to the Console a key message ("OK"), to 
-        confirm that this process is ready to begin the acquisition
-        and wait for a key message ("NEXT") from the Console that will
-        arrive when all the interested processes are ready '''
-        info_console = pylsl.StreamInfo('Receiver', 'Text', 1, 0, 'string')
-        outlet_console = pylsl.StreamOutlet(info_console)
-
-        console_streams = resolve_stream('name', 'Console')
-        console_inlet = StreamInlet(console_streams[0], recover=False)
-
-        print("Ready to receive data!")
-
-        while True:
-            try:
-                outlet_console.push_sample(['OK'])
-                msg, timestamp = console_inlet.pull_sample(timeout=0)
-                if msg is not None and msg[0] == 'NEXT':
-                    break
-            except (pylsl.pylsl.LostError, pylsl.pylsl.TimeoutError):
-                sys.stdout.write("\n")
-                sys.exit()
-
+        console_inlet, console_outlet = wait_console()
     else:
         print("Ready to receive data!")
 
     # Read data ---------------------------------------------------------------------------------------------------------------------
+    if PIPELINE:
+        pipeline.start()  # start pulling from LSL
+    carry = None  # part of last chunk following a control sample (with the markers following it), still to be processed
+    first_block = True  # first block of the session (or after a restart)
     while True:
         try:
-            # get new EEG and marker sample
-            sample, data_time = data_inlet.pull_sample()  # blocking call
-            marker, marker_time = marker_inlet.pull_sample(timeout=0)
-            if USING_CONSOLE and data_time == 0.00001:  # restart (stop + play msgs) case
-                if not DEBUG_PRINT:
-                    print("")
-                print("Resetting to start from scratch...", end="")
-                # reinitialized everything
-                # variables initialization
-                data_segment = deque([0 for _ in range(dequeues_len)])
-                time_segment = deque([0 for _ in range(dequeues_len)])
-                f_events = []
-                r_events = []
-                n_freq_event = 0
-                n_rare_event = 0
-                f_segment_avg = np.zeros((dequeues_len, n_channels))
-                r_segment_avg = np.zeros((dequeues_len, n_channels))
-                f_segment_avg_10s = np.zeros((dequeues_len, n_channels))
-                r_segment_avg_10s = np.zeros((dequeues_len, n_channels))
-                dict_avg_10s = {-1: [f_segment_avg_10s, r_segment_avg_10s, n_freq_event, n_rare_event],
-                                0: [f_segment_avg_10s, r_segment_avg_10s, n_freq_event, n_rare_event]}
-                # sent msg for plotter (to make it reset everything too)
-                avg_outlet.push_chunk(r_segment_avg.tolist(), 0.00001)
-                avg_outlet.push_chunk(f_segment_avg.tolist(), 0.00001)
-                if RECORDING:
-                    # recreate logs
-                    log_eeg.close()
-                    log_evs.close()
-                    log_disc.close()
-                    log_eeg = open(os.path.join(OUTPUT_PATH, OUTPUT_FILE_EEG), 'w', newline='')
-                    log_evs = open(os.path.join(OUTPUT_PATH, OUTPUT_FILE_EVS), 'w', newline='')
-                    log_disc = open(os.path.join(OUTPUT_PATH, OUTPUT_FILE_DISC), 'w', newline='')
-                    # recreate the csv writers
-                    eeg_writer = csv.writer(log_eeg)
-                    evs_writer = csv.writer(log_evs)
-                    disc_writer = csv.writer(log_disc)
-                print("done!")
-                continue  # goes to next iteration
-            if sample.count(0) == len(sample):  # all elements are 0 ==> closing condition
-                break  # exit the while cycle
-            if data_segment[-1] == 0:  # i.e. first time printed something in this cycle (or after restart)
-                print("Receiving data...")
-            if SELECTED_CHANNELS:
-                sample = [sample[i] for i in labels_ids]  # remove extra channels
-            if DEBUG_PRINT:
-                if data_segment[-1] == 0:
-                    print("")
-                print("EEG data: ")
-                print("\ttimestamp: " + str(data_time))
-                print("\tsample: " + str(sample))
-                print("----------------------------------------")
-                print("Marker data: ")
-                print("\ttimestamp: " + str(marker_time))
-                print("\tevent: " + str(marker))
-                print("===========================================================")
+            t = time.perf_counter()  # start of the current stage (see metrics)
+            # get new EEG chunk (or single sample) and all pending markers
+            markers, marker_times = [], []
+            if carry is not None:
+                chunk, chunk_times, markers, marker_times = carry
+                carry = None
+            elif PIPELINE:
+                # samples read from the shared ring, as announced by the ingestion process, and all pending markers
+                chunk, chunk_times, markers, marker_times = pipeline.get(MAX_CHUNK_LATENCY)
+            elif CHUNKED_INGESTION:
+                # returns as soon as MAX_CHUNK_SAMPLES samples are available or MAX_CHUNK_LATENCY seconds have passed
+                _, chunk_times = data_inlet.pull_chunk(timeout=MAX_CHUNK_LATENCY, max_samples=MAX_CHUNK_SAMPLES,
+                                                       dest_obj=chunk_buffer)
+                chunk = chunk_buffer[:len(chunk_times)]
+                chunk_times = np.array(chunk_times)
+            else:
+                sample, data_time = data_inlet.pull_sample()  # blocking call
+                chunk_buffer[0] = sample
+                chunk = chunk_buffer[:1]
+                chunk_times = np.array([data_time])
+            if not PIPELINE:
+                new_markers, new_marker_times = marker_inlet.pull_chunk(timeout=0.0)  # drain all pending markers
+                markers, marker_times = markers + new_markers, marker_times + new_marker_times
+            t = metrics.stage('ingest', t)  # OBS: includes the time waited for the chunk to be filled
 
-            if RECORDING:
-                # EEG csv
-                if data_segment[-1] == 0:  # i.e. first sample
-                    data_time = 0.0  # needed since lsl can't send timestamp == 0
-                row = [data_time] + sample
-                eeg_writer.writerow(row)
-                # evs csv
-                if marker is not None:
-                    row = [marker_time] + [marker]
-                    evs_writer.writerow(row)
-
-            # updates EEG timestamp and data in dequeues
-            data_segment.append(sample)
-            time_segment.append(data_time)
-            data_segment.popleft()
-            time_segment.popleft()
-
-            # Check if current segment is the right one to update the rare or frequent averaged potentials---------------------------
-
-            # first check (first two rows in if): sample related to first event to be processed is in right position (i.e. event aligned)
-            # second check (last row in if): not having old dirty values belonging to discarded data
-            # OBS: need check we got a least new <dequeues_len> samples but, since we perform avg only if sample related to stimulus
-            # is in position <samples_pre_ev> (i.e. elements from position <samples_pre_ev> to end have been rewritten), to align all
-            # events and having desired interval of pause_pre_ev, event_length and pause_post_ev, then we just have to check that
-            # first <samples_pre_ev> samples have been rewritten (i.e. != 0) to perform avg:
-
-            # rare case
-            if (len(r_events) > 0 and
-                (r_events[0] - (1 / srate) + 0.001 < time_segment[samples_pre_ev] < r_events[0] + (1 / srate) - 0.001)) \
-                    and ((not USING_CONSOLE) or ((np.array(time_segment)[:samples_pre_ev] == 0).sum() == 0)):
-                # valid segment --> used in avg --> need to filter it!
-                data_array = np.array(data_segment)
-                for i in range(n_channels):
-                    avg_padded[int(srate):dequeues_len + int(srate)] = data_array[:, i]  # fill padded segment for filter
-                    avg_padded = dsp.convolve(avg_padded, fir, mode="same")  # applying band-pass filter
-                    avg_padded = dsp.filtfilt(b_notch, a_notch, avg_padded)  # applying notch filter
-                    data_array[:, i] = avg_padded[int(srate):dequeues_len + int(srate)]  # recover filtered data
-                # call avg function on current segment
-                r_segment_avg, n_rare_event = avg(data_array, r_segment_avg, n_rare_event)
+            # look for control samples (all elements are 0), sent to restart (stop + play msgs) or to close the session
+            control_rows = np.flatnonzero(~chunk.any(axis=1))
+            if len(control_rows) > 0 and control_rows[0] > 0:
+                # first process the samples (and markers) preceding the control one, the rest of the chunk at next iteration
+                (markers, marker_times), following = split_markers(markers, marker_times, chunk_times[control_rows[0] - 1])
+                carry = (chunk[control_rows[0]:].copy(), chunk_times[control_rows[0]:]) + following
+                chunk, chunk_times = chunk[:control_rows[0]], chunk_times[:control_rows[0]]
+            elif len(control_rows) > 0:
+                if USING_CONSOLE and chunk_times[0] == 0.00001:  # restart (stop + play msgs) case
+                    if not DEBUG_PRINT:
+                        print("")
+                    print("Resetting to start from scratch...", end="")
+                    # reinitialized everything
+                    core.reset()
+                    checkpoints.reset()
+                    if CLASSIFIER:
+                        classifier.reset()
+                    if ADAPTIVE_STOPPING:
+                        stopping.reset()
+                    if EPOCH_ARCHIVE:
+                        archive.reset()
+                    if REEPOCH_HISTORY:
+                        history.reset()
+                        history_markers.clear()
+                    first_block = True
+                    # sent msg for plotter (to make it reset everything too)
+                    publish_reset(avg_outlet, avg_chunk, averages, 0.00001, decimator, shared_avg)
+                    if RECORDING and not PIPELINE:  # otherwise done by the recording process, at the same control sample
+                        recorder.reopen()  # recreate logs (after the rows already queued are written)
+                    print("done!")
+                    # the rest of the chunk and the markers following the restart, scheduled from scratch at next iteration
+                    _, following = split_markers(markers, marker_times, core.last_data_time)
+                    if len(chunk) > 1 or len(following[0]) > 0:
+                        carry = (chunk[1:].copy(), chunk_times[1:]) + following
+                    continue  # goes to next iteration
+                break  # closing condition, exit the while cycle
+
+            if len(chunk) > 0:
+                if first_block:  # i.e. first time printed something in this cycle (or after restart)
+                    print("Receiving data...")
+                data_times = chunk_times
                 if DEBUG_PRINT:
-                    print("Avg updated with rare event n° " + str(n_rare_event) + ", occurred at " + str(r_events[0]) + "s")
-                    print("avg: " + str(r_segment_avg))
-                    print("time: " + str(r_events[0]))
-                    print("===========================================================")
-                else:
-                    sys.stdout.write(
-                        "\rAvg updated with rare event n° {}, occurred at {}s".format(n_rare_event, r_events[0]))
-                    sys.stdout.flush()
-                if USING_CONSOLE:
-                    # update the dictionary
-                    dict_avg_10s[data_time] = [f_segment_avg, r_segment_avg, n_freq_event, n_rare_event]
-                    keys = list(dict_avg_10s.keys())
-                    discardable = [i for i in keys if data_time - i > 10]
-                    for key in discardable[0:-1]:
-                        dict_avg_10s.pop(key)  # remove entry if too old
-                    if DEBUG_PRINT:
-                        count = 0
-                        for k in list(dict_avg_10s.keys()):
-                            print(str(count) + "\tkey: " + str(k) + "\t" + str(dict_avg_10s.get(k)[0][0][0]))
-                            count += 1
-                        print("===========================================================")
-                # send msg to plot avg for all channels
-                avg_outlet.push_chunk(r_segment_avg.tolist(), -r_events[0])
-                r_events.pop(0)  # remove this event from list
-
-            # frequent case
-            elif (len(f_events) > 0 and
-                  (f_events[0] - (1 / srate) + 0.001 < time_segment[samples_pre_ev] < f_events[0] + (1 / srate) - 0.001)) \
-                    and ((not USING_CONSOLE) or ((np.array(time_segment)[:samples_pre_ev] == 0).sum() == 0)):
-                # valid segment --> used in avg --> need to filter it!
-                data_array = np.array(data_segment)
-                for i in range(n_channels):
-                    avg_padded[int(srate):dequeues_len + int(srate)] = data_array[:, i]  # fill padded segment for filter
-                    avg_padded = dsp.convolve(avg_padded, fir, mode="same")  # applying band-pass filter
-                    avg_padded = dsp.filtfilt(b_notch, a_notch, avg_padded)  # applying notch filter
-                    data_array[:, i] = avg_padded[int(srate):dequeues_len + int(srate)]  # recover filtered data
-                # call avg function on current segment
-                f_segment_avg, n_freq_event = avg(data_array, f_segment_avg, n_freq_event)
+                    if first_block:
+                        print("")
+                    print("EEG data: ")
+                    print("\ttimestamps: " + str(data_times[0]) + " - " + str(data_times[-1]))
+                    print("\tsamples: " + str(len(chunk)))
+                    print("----------------------------------------")
+
+                if RECORDING and not PIPELINE:  # otherwise recorded by the recording process, from the shared ring
+                    # EEG csv
+                    if first_block:  # i.e. first sample
+                        data_times[0] = 0.0  # needed since lsl can't send timestamp == 0
+                    # OBS: a copy, chunk may be overwritten; channels recorded as received
+                    recorder.write('eeg', np.column_stack((data_times, chunk if labels_ids is None else chunk[:, labels_ids])))
+                    t = metrics.stage('recording', t)
+
+                # Check if lost some samples (over the whole block, and since the previous one) ----------------------------------
+                metrics.count('samples', len(chunk))
+                # re-referenced, without extra channels, short gaps filled (if required)
+                block, data_times, block_gaps = core.receive(chunk, data_times)
+                report_gaps(block_gaps, metrics)
+                t = metrics.stage('gap_check', t)
+
+                # updates EEG timestamps and data in ring buffer (filtered first in streaming mode)
+                core.buffer(block, data_times)
+                if REEPOCH_HISTORY:
+                    history.extend(chunk, chunk_times)  # as received, for a reconfiguration
+                first_block = False
+                t = metrics.stage('buffer', t)
+
+            # Check if current markers represent events -------------------------------------------------------------------------
+            for marker, marker_time in zip(markers, marker_times):
                 if DEBUG_PRINT:
-                    print("Avg updated with frequent event n° " + str(n_freq_event) + ", occurred at " + str(f_events[0]) + "s")
-                    print("avg: " + str(f_segment_avg))
-                    print("time: " + str(f_events[0]))
+                    print("Marker data: ")
+                    print("\ttimestamp: " + str(marker_time))
+                    print("\tevent: " + str(marker))
                     print("===========================================================")
-                else:
-                    sys.stdout.write("\rAvg updated with frequent event n° {}, occurred at {}s".format(n_freq_event, f_events[0]))
-                    sys.stdout.flush()
-                if USING_CONSOLE:
-                    # update the dictionary
-                    dict_avg_10s[data_time] = [f_segment_avg, r_segment_avg, n_freq_event, n_rare_event]
-                    keys = list(dict_avg_10s.keys())
-                    discardable = [i for i in keys if data_time - i > 10]
-                    for key in discardable[0:-1]:
-                        dict_avg_10s.pop(key)  # remove entry if too old
-                    if DEBUG_PRINT:
-                        count = 0
-                        for k in list(dict_avg_10s.keys()):
-                            print(str(count) + "\tkey: " + str(k) + "\t" + str(dict_avg_10s.get(k)[0][0][0]))
-                            count += 1
-                        print("===========================================================")
-                # send msg to plot avg for all channels
-                avg_outlet.push_chunk(f_segment_avg.tolist(), f_events[0])
-                f_events.pop(0)  # remove this event from list
-
-            # Check if current marker represents an event ---------------------------------------------------------------------------
-            if marker is not None:
-                if marker[0] == 'R':  # rare stimulus
-                    r_events.append(marker_time)
-                else:  # frequent stimulus
-                    f_events.append(marker_time)
-            # OBS: with this code, if a new rare event takes place before obtaining right segment for previous one,
-            # then we'll continue looking for the right segment for the first one to occur, then we'll do the same
-            # for second one and so on (i.e. possible to overlap two segments)
-
-            # Check if lost some samples --------------------------------------------------------------------------------------------
-            if time_segment[-1] > round(time_segment[-2] + (1 / srate) + 0.0001, 5 - len(str(int(time_segment[-2])))) and \
-                    time_segment[-2] != 0:
-                # OBS: actual time > previous time + time step (=1/srate) +  offset, where latter rounded according to its value
-                if not DEBUG_PRINT:
-                    sys.stdout.write("\n")
-                print("\033[1;31;48m" + "Lost or invalid sample! Check the terminal of the Sender to see if an 'invalid"
-                      " sample' print is present; if not, the sample has been lost" + "\033[1;37;0m" +  # code to have red print
-                      " previous timestamp: {}, current one: {}".format(time_segment[-2], time_segment[-1]))
-                if DEBUG_PRINT:
-                    print("")
+                if RECORDING and not PIPELINE:
+                    # evs csv
+                    row = [marker_time] + [marker]
+                    recorder.write('evs', [row])
+                if not core.schedule(marker[0], marker_time) and DEBUG_PRINT:
+                    print("Marker '" + marker[0] + "' not related to any condition, ignored")
+                if REEPOCH_HISTORY:
+                    history_markers.append((marker[0], marker_time))
+            if len(markers) > 0:
+                while REEPOCH_HISTORY and history_markers and history_markers[0][1] < core.last_data_time - RECONFIGURE_HISTORY:
+                    history_markers.popleft()  # older than the samples kept
+                t = metrics.stage('markers', t)
+
+            # Get all the events whose segment has been completed, to update the averaged potentials of their condition ---------
+            # For each event, the segment starts <samples_pre_ev> samples before the one related to the stimulus (i.e. event
+            # aligned) and must not contain old dirty values belonging to discarded data
+            # (event timestamp, condition id, absolute index of first sample of the segment), segments, if containing lost samples
+            completed, segments, gapped = core.pop_epochs()
+            # OBS: segments of close events overlap; all the segments completed by the current block are filtered together,
+            # then averaged in order of occurrence
+
+            if len(completed) > 0:
+                segments = core.filter(segments)  # (already filtered in streaming mode)
+                t = metrics.stage('epoch_filter', t)
+                rejected, skipped = core.reject(segments, gapped)  # artifacts (or lost samples, according to GAP_POLICY)
+                t = metrics.stage('rejection', t)
+                if CLASSIFIER:
+                    # all the segments scored at once (scores are 0 until the calibration is completed)
+                    # OBS: flag of the scores kept, the calibration could be completed by one of these segments
+                    calibrated = classifier.trained
+                    scores = classifier.score(segments) if calibrated else np.zeros(len(segments))
+                    t = metrics.stage('classifier', t)
+                for i, ((ev_time, cond_id, seg_start), data_array) in enumerate(zip(completed, segments)):
+                    ev_name = CONDITION_NAMES[cond_id]
+                    metrics.count('events')
+                    if skipped[i]:  # segment containing lost samples, ignored
+                        continue
+                    if EPOCH_ARCHIVE:
+                        archive.append(cond_id, ev_time, data_array, rejected[i])  # copied into the mapped file
+                    if rejected[i]:  # segment containing artifacts (or lost samples), only counted
+                        averages.reject(cond_id)
+                        if not DEBUG_PRINT:
+                            sys.stdout.write("\n")
+                        print("\033[1;31;48m" + "Rejected " + ev_name + " event n° " + str(averages.rejected[cond_id]) +
+                              ("! (lost samples)" if gapped[i] else "!") + "\033[1;37;0m" + " occurred at " + str(ev_time) +
+                              "s")  # code to have red print
+                    else:
+                        # update (in place) the averages of the condition with current segment
+                        averages.update(cond_id, data_array)
+                        n_event = averages.count[cond_id]
+                        if ADAPTIVE_STOPPING and stopping.update(cond_id, data_array):
+                            print_criterion(stopping, labels)
+                            if USING_CONSOLE and CRITERION_MESSAGE:
+                                console_outlet.push_sample(['CRITERION'])  # relayed by the Console to Stims and Sender
+                        if DEBUG_PRINT:
+                            print("Avg updated with " + ev_name + " event n° " + str(n_event) + ", occurred at " + str(ev_time) +
+                                  "s")
+                            print("avg: " + str(averages.mean[cond_id]))
+                            print("time: " + str(ev_time))
+                            print("===========================================================")
+                        else:
+                            sys.stdout.write("\rAvg updated with {} event n° {}, occurred at {}s".format(ev_name, n_event,
+                                                                                                       ev_time))
+                            sys.stdout.flush()
+                    t = metrics.stage('averaging', t)
+                    if CLASSIFIER:
+                        score_outlet.push_sample([scores[i], cond_id, float(calibrated)], ev_time)
+                        if not classifier.trained and not rejected[i]:
+                            classifier.update(data_array, cond_id == target_id)  # rank-one update of the statistics
+                            if classifier.count.sum() >= CALIBRATION_TRIALS and classifier.train():
+                                sys.stdout.write("\n")
+                                print("Classifier calibrated with " + str(classifier.count[1]) + " target and " +
+                                      str(classifier.count[0]) + " non-target epochs!")
+                        t = metrics.stage('classifier', t)
+                    # send msg to plot avg for all channels (also if rejected, to update the counters)
+                    publish_avg(avg_outlet, avg_chunk, averages, cond_id, ev_time, decimator, shared_avg)
+                    t = metrics.stage('publish', t)
+                if EPOCH_ARCHIVE and time.perf_counter() - archive_commit_time >= ARCHIVE_COMMIT_INTERVAL:
+                    archive.commit()
+                    archive_commit_time = time.perf_counter()
+
+            if USING_CONSOLE and core.ring.n_written > 0:
+                checkpoints.update(averages, core.last_data_time)  # take snapshots of the averages, if due
 
             # Discard msg case ------------------------------------------------------------------------------------------------------
             if USING_CONSOLE:
                 msg, timestamp = console_inlet.pull_sample(timeout=0)
-                if msg is not None and msg[0] == 'DISCARD':
-                    # reset averaged potentials and n of events back to the ones characterizing first entry of dict (i.e. oldest one)
-                    first_key = list(dict_avg_10s.keys())[0]
-                    f_segment_avg, r_segment_avg, n_freq_event, n_rare_event = dict_avg_10s.get(first_key)
-                    # reset list of event to be processed, since seconds have been discarded
-                    f_events = []
-                    r_events = []
-                    # reset time dequeue, used to check if got rid of dirty values, belonging to discarded data, before computing avg
-                    time_segment = deque([0 for _ in range(dequeues_len)])
-                    # send msg to plot reset avg for all channels
+                if msg is not None and msg[0].split()[:1] == ['DISCARD']:  # 'DISCARD' or 'DISCARD <seconds>'
+                    discard_seconds = parse_discard(msg[0].split()[1:])
+                if msg is not None and msg[0].split()[:1] == ['DISCARD'] and discard_seconds is not None:
+                    # roll back averaged potentials and n of events to the ones characterizing the start of discarded interval
+                    first_key = checkpoints.rollback(averages, core.last_data_time, discard_seconds)
+                    if first_key is None:  # nothing received yet
+                        first_key = core.last_data_time
+                    # reset events to be processed, since seconds have been discarded
+                    core.scheduler.clear()
+                    # mark buffered samples as dirty, to get rid of values belonging to discarded data before computing avg
+                    core.ring.invalidate()
+                    if REEPOCH_HISTORY:
+                        history.invalidate()  # discarded data never processed again
+                    if ADAPTIVE_STOPPING:
+                        stopping.reset()  # OBS: the statistics can't be rolled back, the criterion restarts from scratch
+                    if EPOCH_ARCHIVE:
+                        archive.discard(averages.count, averages.rejected)  # trials rolled back marked as discarded
+                    # send msg to plot reset avg for all channels, with the time of reset
                     timestamp = first_key-(pause_post_ev+event_length) if first_key-(pause_post_ev+event_length) > 0 else 0.00001
-                    avg_outlet.push_chunk(r_segment_avg.tolist(), 0.00001)
-                    avg_outlet.push_chunk(f_segment_avg.tolist(), timestamp)
+                    publish_reset(avg_outlet, avg_chunk, averages, timestamp, decimator, shared_avg)
                     if DEBUG_PRINT:
-                        print("Segments after DISCARD: " + str(first_key))
-                        print("f_segment: " + str(f_segment_avg[0][0]))
-                        print("r_segment: " + str(r_segment_avg[0][0]))
+                        print("Segments after DISCARD of " + str(discard_seconds) + "s: " + str(first_key))
+                        for cond_id, name in enumerate(CONDITION_NAMES):
+                            print(name + " segment: " + str(averages.mean[cond_id][0][0]))
                     if RECORDING:
-                        row = [first_key + (1/srate)] + [data_time]  # both extremes has to be included in removal
-                        disc_writer.writerow(row)
+                        row = [first_key + (1/srate)] + [core.last_data_time]  # both extremes has to be included in removal
+                        if PIPELINE:
+                            pipeline.record_discard([row])
+                        else:
+                            recorder.write('disc', [row])
+                # Config msg case -----------------------------------------------------------------------------------------------
+                elif msg is not None and msg[0].split()[:1] == ['CONFIG'] and SHARED_MEMORY:
+                    sys.stdout.write("\n")
+                    print("Config command ignored, not supported with the shared memory")
+                elif msg is not None and msg[0].split()[:1] == ['CONFIG']:  # new window of the epochs and/or channels
+                    config = parse_config(msg[0].split()[1:], output_labels)
+                    if config is not None:
+                        (pause_pre_ev, event_length, pause_post_ev), selected = config
+                        if selected is None:  # same channels
+                            selected = labels
+                        # processing reallocated once (ring, scheduler, filters and averages), the recording is not affected
+                        new_core = build_core(srate, stream_channels, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline,
+                                              selected)
+                        n_replayed = replay_history(new_core, history, history_markers) if REEPOCH_HISTORY else 0
+                        new_core.gaps.carry_stats(core.gaps)  # OBS: statistics of the whole session
+                        core = new_core
+                        averages = core.averages
+                        labels = core.labels
+                        n_channels = core.n_channels
+                        dequeues_len = core.length
+                        checkpoints = CheckpointRing(averages, CHECKPOINT_INTERVAL, ROLLBACK_WINDOW)
+                        if CLASSIFIER:  # calibrated again, on the new epochs
+                            classifier = P300Classifier(dequeues_len, n_channels, max(int(srate // FEATURES_RATE), 1),
+                                                        XDAWN_FILTERS, LDA_SHRINKAGE)
+                        if ADAPTIVE_STOPPING:
+                            stopping = stopping_criterion(core)
+                        if EPOCH_ARCHIVE:  # a new archive for the epochs of the new window (and channels)
+                            close_archive(archive)
+                            archive = epoch_archive(os.path.join(OUTPUT_PATH, OUTPUT_DIR_EPOCHS + "_" + str(n_configs + 1)),
+                                                    core, srate, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline)
+                        n_configs += 1
+                        # send msg for plotter (to resolve the new avg stream, with the new metadata, and re-layout its plots)
+                        avg_chunk[:] = 0
+                        avg_outlet.push_chunk(avg_chunk, 0.00002)
+                        avg_len = decimator.output_length(dequeues_len)
+                        avg_info = avg_stream_info(labels, avg_len, srate, decimator.rate, pause_pre_ev, event_length,
+                                                   pause_post_ev, [averages.describe(c) for c in range(len(CONDITIONS))])
+                        avg_chunk = np.zeros((avg_len, n_channels + 3), dtype=np.float32)
+                        if old_avg_outlet is None or avg_outlet.have_consumers():  # the stream the plotter is reading
+                            old_avg_outlet = avg_outlet  # OBS: kept until the plotter has left it, without waiting here
+                        plotter_deadline = time.perf_counter() + PLOTTER_WAIT
+                        avg_outlet = StreamOutlet(avg_info, avg_len)
+                        # averages of the history (if any), as after a reset
+                        publish_reset(avg_outlet, avg_chunk, averages, core.last_data_time or 0.00001, decimator)
+                        sys.stdout.write("\n")
+                        print("Reconfigured! Epochs of " + str(pause_pre_ev) + " + " + str(event_length) + " + " +
+                              str(pause_post_ev) + " s, channels " + ", ".join(labels) + " (" + str(n_replayed) +
+                              " epochs averaged again)")
+                if old_avg_outlet is not None and (avg_outlet.have_consumers() or time.perf_counter() > plotter_deadline):
+                    # the plotter has resolved the new stream (or is not coming): averages sent again, previous stream closed
+                    publish_reset(avg_outlet, avg_chunk, averages, core.last_data_time or 0.00001, decimator)
+                    old_avg_outlet = None
+                t = metrics.stage('console', t)
+
+            if METRICS and metrics.report_due(METRICS_INTERVAL):
+                queue_depth = 0
+                if PIPELINE:
+                    queue_depth = pipeline.recording_lag()  # samples still to be recorded
+                elif RECORDING:
+                    stats = recorder.stats()
+                    queue_depth = stats["queue_depth"] + stats["overflow_blocks"]
+                values = metrics.report(['samples', 'events'])  # rates, then latency of each stage
+                metrics_outlet.push_sample(values[:2] + [metrics.counters['dropped_samples'], queue_depth] + values[2:])
+            if GAP_STATS and time.perf_counter() - gap_report_time >= GAP_STATS_INTERVAL:
+                gap_outlet.push_sample(core.gaps.stats())
+                gap_report_time = time.perf_counter()
 
         except (pylsl.pylsl.LostError, pylsl.pylsl.TimeoutError):  # i.e. if connection lost
             sys.stdout.write("\n")
             print("Connection lost with one or more streams!")
             print("Closing streams...", end=" ")
-            data_inlet.close_stream()
-            marker_inlet.close_stream()
+            if not PIPELINE:  # otherwise closed by the ingestion process (and the EEG inlet just after reading its info)
+                data_inlet.close_stream()
+                marker_inlet.close_stream()
             if USING_CONSOLE:
                 console_inlet.close_stream()
             print("done!")
-            if RECORDING:
-                print("Closing csv file...", end=" ")
-                log_eeg.close()
-                log_evs.close()
-                log_disc.close()
-                print("done!")
+            if PIPELINE:
+                close_pipeline(pipeline)
+            elif RECORDING:
+                close_recording(recorder)
+            if EPOCH_ARCHIVE:
+                close_archive(archive)
+            if METRICS:
+                dump_metrics(metrics, srate, n_channels)
+            if SHARED_MEMORY:
+                shared_avg.close()
             sys.exit()
 
     sys.stdout.write("\n")
     print("Session ended!")
+    print_gaps(core.gaps)
+    if GAP_STATS:
+        gap_outlet.push_sample(core.gaps.stats())
+    if ARTIFACT_REJECTION:
+        print("Rejected epochs: " + ", ".join(name + " " + str(averages.rejected[c]) for c, name in enumerate(CONDITION_NAMES)) +
+              " (" + ", ".join(reason + " " + str(n) for reason, n in zip(REASONS, core.rejector.reason_counts)) + ")")
     print("Closing streams...", end=" ")
-    data_inlet.close_stream()
-    marker_inlet.close_stream()
+    if not PIPELINE:  # otherwise closed by the ingestion process (and the EEG inlet just after reading its info)
+        data_inlet.close_stream()
+        marker_inlet.close_stream()
     print("done!")
-    if RECORDING:
-        print("Closing csv file...", end=" ")
-        log_eeg.close()
-        log_evs.close()
-        log_disc.close()
-        print("done!")
+    if PIPELINE:
+        close_pipeline(pipeline)
+    elif RECORDING:
+        close_recording(recorder)
+    if EPOCH_ARCHIVE:
+        close_archive(archive)
+    if METRICS:
+        dump_metrics(metrics, srate, n_channels)
     # send final msg to plotter
-    zero_chunk = np.zeros((dequeues_len, n_channels))
-    avg_outlet.push_chunk(zero_chunk.tolist(), 0.0)
+    if SHARED_MEMORY:
+        shared_avg.close()
+    else:
+        avg_chunk[:] = 0
+        avg_outlet.push_chunk(avg_chunk, 0.00003)  # OBS: not 0.0, that lsl replaces with the current time
     # wait for console ack or closing input
     if USING_CONSOLE:
         while True:
@@ -470,5 +924,305 @@ def main(argv):
         input("Press enter to terminate the program when the plotter has finished!")
 
 
+def main_multi(argv):  # one Receiver for several EEG streams (e.g. hyperscanning), sharing the markers' stream
+    pause_pre_ev, event_length, pause_post_ev, dsp_pipeline = parse_args(argv)
+    if CLASSIFIER or PIPELINE or SHARED_MEMORY or not CHUNKED_INGESTION:
+        print("Multi-stream mode: CLASSIFIER, PIPELINE and SHARED_MEMORY flags ignored, chunked ingestion always used")
+
+    # EEG data ----------------------------------------------------------------------------------------------------------------------
+    print("Looking for " + str(N_EEG_STREAMS) + " EEG streams...", end=" ")
+    data_streams = sorted(resolve_bypred(EEG_STREAM_PREDICATE, N_EEG_STREAMS), key=lambda s: s.name())[:N_EEG_STREAMS]
+    data_inlets = [StreamInlet(stream, recover=False) for stream in data_streams]
+    print("done!")
+    infos = [inlet.info() for inlet in data_inlets]
+    srate = infos[0].nominal_srate()  # Hz
+    if any(info.nominal_srate() != srate for info in infos):
+        print("\033[1;31;48m" + "EEG streams with different sampling rates!" + "\033[1;37;0m" + " " +
+              ", ".join(info.name() + " " + str(info.nominal_srate()) + "Hz" for info in infos))
+        sys.exit(2)
+
+    # state of each stream: processing core (same epoch window and filters for all the streams), plus its own recording and
+    # outlet of the averages (distinct id)
+    states = []
+    for k, (inlet, info) in enumerate(zip(data_inlets, infos)):
+        stream_channels, labels_ids = stream_labels(info, dsp_pipeline.reference)
+        core = build_core(srate, stream_channels, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline)
+        state = StreamState(k, inlet, labels_ids, core, MAX_CHUNK_SAMPLES)
+        if USING_CONSOLE:
+            state.checkpoints = CheckpointRing(core.averages, CHECKPOINT_INTERVAL, ROLLBACK_WINDOW)
+        if ADAPTIVE_STOPPING:
+            state.stopping = stopping_criterion(core)
+        if EPOCH_ARCHIVE:
+            state.archive = epoch_archive(os.path.join(OUTPUT_PATH, "stream_" + str(k), OUTPUT_DIR_EPOCHS), core, srate,
+                                          pause_pre_ev, event_length, pause_post_ev, dsp_pipeline)
+        if RECORDING:
+            # datasets of each stream in its own subfolder (events and discards repeated in each one)
+            stream_path = os.path.join(OUTPUT_PATH, "stream_" + str(k))
+            files = {}
+            if RECORDING_FORMAT in ('csv', 'both'):
+                files = {'eeg': OUTPUT_FILE_EEG, 'evs': OUTPUT_FILE_EVS, 'disc': OUTPUT_FILE_DISC}
+            session = None
+            if RECORDING_FORMAT in ('binary', 'both'):
+                rec_labels = stream_channels if labels_ids is None else [stream_channels[i] for i in labels_ids]
+                header = dict(session_header(srate, rec_labels, pause_pre_ev, event_length, pause_post_ev, dsp_pipeline),
+                              stream=info.name())
+                session = SessionWriter(os.path.join(stream_path, OUTPUT_DIR_SESSION), header)
+            state.recorder = RecordingWriter(stream_path, files, RECORDING_QUEUE_SIZE, RECORDING_FLUSH_INTERVAL,
+                                             RECORDING_FSYNC, session)
+        states.append(state)
+        print("Stream " + str(k) + ": " + info.name() + ", " + str(core.n_channels) + " channels")
+    n_channels = sum(state.core.n_channels for state in states)
+    dequeues_len = states[0].core.length
+    epoch_filter = states[0].core.epoch_filter  # OBS: the same for all the streams, the epochs of all of them filtered at once
+
+    decimator = OutputDecimator(srate, dsp_pipeline.output_rate)
+    avg_len = decimator.output_length(dequeues_len)  # number of samples of the averages sent
+    for k, (state, info) in enumerate(zip(states, infos)):
+        avg_info = avg_stream_info(state.core.labels, avg_len, srate, decimator.rate, pause_pre_ev, event_length,
+                                   pause_post_ev, [state.core.averages.describe(c) for c in range(len(CONDITIONS))],
+                                   'myuid2425_' + str(k), info.name() + " #" + str(k + 1))
+        state.avg_outlet = StreamOutlet(avg_info, avg_len)
+        state.avg_chunk = np.zeros((avg_len, state.core.n_channels + 3), dtype=np.float32)
+        if GAP_STATS:
+            state.gap_outlet = gap_stream('myuid2428_' + str(k))
+
+    metrics = StageMetrics(STAGES, ['samples', 'events', 'dropped_samples'])
+    if METRICS:
+        metrics_outlet = metrics_stream()
+    gap_report_time = time.perf_counter()
+    archive_commit_time = time.perf_counter()
+
+    def close_all():  # close the recordings (and archives) and save the metrics
+        for state in states:
+            if RECORDING:
+                close_recording(state.recorder)
+            if EPOCH_ARCHIVE:
+                close_archive(state.archive, " of stream " + str(state.index))
+        if METRICS:
+            dump_metrics(metrics, srate, n_channels)
+
+    def sigint_handler(signum, frame):
+        sys.stdout.write("\n")
+        print('Application interrupted!')
+        close_all()
+        sys.exit()
+
+    signal.signal(signal.SIGINT, sigint_handler)  # register the signal handler
+
+    sleep(0.1)  # OBS: added to avoid mixing of prints
+    # Marker data (shared by all the streams) ---------------------------------------------------------------------------------------
+    print("Looking for markers' stream...", end=" ")
+    marker_streams = resolve_stream('name', 'MarkerStream')
+    marker_inlet = StreamInlet(marker_streams[0], recover=False)
+    print("done!")
+
+    if USING_CONSOLE:
+        console_inlet, console_outlet = wait_console()
+    else:
+        print("Ready to receive data!")
+
+    # Read data ---------------------------------------------------------------------------------------------------------------------
+    while not all(state.closed for state in states):
+        try:
+            t = time.perf_counter()
+            # get new EEG chunks (only the first open stream waits for its chunk, the others are drained) and pending markers
+            open_states = [state for state in states if not state.closed]
+            pulled = [state.pull(MAX_CHUNK_LATENCY if state is open_states[0] else 0.0) for state in open_states]
+            markers, marker_times = marker_inlet.pull_chunk(timeout=0.0)
+            t = metrics.stage('ingest', t)
+
+            # markers to be scheduled in each stream (the same events for all the subjects, split at the control samples)
+            stream_markers = {state: (markers, marker_times) for state in states}
+            for state, (chunk, chunk_times, held_markers, held_marker_times) in zip(open_states, pulled):
+                stream_markers[state] = (held_markers + markers, held_marker_times + marker_times)
+                # control samples of each stream (restart or close), as in single-stream mode
+                control_rows = np.flatnonzero(~chunk.any(axis=1))
+                if len(control_rows) > 0 and control_rows[0] > 0:
+                    stream_markers[state], following = split_markers(*stream_markers[state], chunk_times[control_rows[0] - 1])
+                    state.carry = (chunk[control_rows[0]:].copy(), chunk_times[control_rows[0]:]) + following
+                    chunk, chunk_times = chunk[:control_rows[0]], chunk_times[:control_rows[0]]
+                elif len(control_rows) > 0:
+                    if USING_CONSOLE and chunk_times[0] == 0.00001:  # restart (stop + play msgs) case
+                        if not DEBUG_PRINT:
+                            print("")
+                        print("Resetting stream " + str(state.index) + " to start from scratch...", end="")
+                        state.reset()
+                        publish_reset(state.avg_outlet, state.avg_chunk, state.core.averages, 0.00001, decimator)
+                        if RECORDING:
+                            state.recorder.reopen()
+                        print("done!")
+                        _, stream_markers[state] = split_markers(*stream_markers[state], state.core.last_data_time)  # new ones
+                        if len(chunk) > 1:
+                            state.carry = (chunk[1:].copy(), chunk_times[1:], [], [])
+                    else:  # closing condition of the stream, final msg to its plotter
+                        state.closed = True
+                        state.avg_chunk[:] = 0
+                        state.avg_outlet.push_chunk(state.avg_chunk, 0.00003)
+                    continue
+                if len(chunk) == 0:
+                    continue
+
+                if state.core.ring.n_written == 0:
+                    print("Receiving data from stream " + str(state.index) + "...")
+                data_times = chunk_times
+                if RECORDING:
+                    if state.core.ring.n_written == 0:  # i.e. first sample
+                        data_times[0] = 0.0  # needed since lsl can't send timestamp == 0
+                    state.recorder.write('eeg', np.column_stack((data_times, chunk if state.labels_ids is None else
+                                                                 chunk[:, state.labels_ids])))
+                    t = metrics.stage('recording', t)
+
+                metrics.count('samples', len(chunk))
+                block, data_times, block_gaps = state.core.receive(chunk, data_times)
+                report_gaps(block_gaps, metrics)
+                t = metrics.stage('gap_check', t)
+
+                state.core.buffer(block, data_times)
+                t = metrics.stage('buffer', t)
+
+            # markers scheduled in every stream (the same events for all the subjects) ---------------------------------------------
+            for state in states:
+                for marker, marker_time in zip(*stream_markers[state]):
+                    if RECORDING:
+                        state.recorder.write('evs', [[marker_time] + [marker]])
+                    state.core.schedule(marker[0], marker_time)
+            if len(markers) > 0:
+                t = metrics.stage('markers', t)
+
+            # completed segments of all the streams filtered together, then checked and averaged stream by stream --------------
+            completed, stacks, gapped = zip(*[state.core.pop_epochs() for state in states])
+            if any(stack is not None for stack in stacks):
+                if states[0].core.stream_filter is None:  # otherwise already filtered
+                    stacks = filter_together(epoch_filter, stacks)
+                t = metrics.stage('epoch_filter', t)
+            for state, events, segments, stream_gapped in zip(states, completed, stacks, gapped):
+                if segments is None:
+                    continue
+                averages = state.core.averages
+                rejected, skipped = state.core.reject(segments, stream_gapped)
+                t = metrics.stage('rejection', t)
+                for i, ((ev_time, cond_id, seg_start), data_array) in enumerate(zip(events, segments)):
+                    ev_name = CONDITION_NAMES[cond_id]
+                    metrics.count('events')
+                    if skipped[i]:
+                        continue
+                    if EPOCH_ARCHIVE:
+                        state.archive.append(cond_id, ev_time, data_array, rejected[i])
+                    if rejected[i]:
+                        averages.reject(cond_id)
+                        if not DEBUG_PRINT:
+                            sys.stdout.write("\n")
+                        print("\033[1;31;48m" + "Rejected " + ev_name + " event n° " + str(averages.rejected[cond_id]) +
+                              " of stream " + str(state.index) + ("! (lost samples)" if stream_gapped[i] else "!") +
+                              "\033[1;37;0m" + " occurred at " + str(ev_time) + "s")
+                    else:
+                        averages.update(cond_id, data_array)
+                        # OBS: the message is sent once the criterion has been reached in all the streams
+                        if ADAPTIVE_STOPPING and state.stopping.update(cond_id, data_array):
+                            print_criterion(state.stopping, state.core.labels, " for stream " + str(state.index))
+                            if USING_CONSOLE and CRITERION_MESSAGE and all(other.stopping.reached for other in states):
+                                console_outlet.push_sample(['CRITERION'])
+                        if DEBUG_PRINT:
+                            print("Avg of stream " + str(state.index) + " updated with " + ev_name + " event n° " +
+                                  str(averages.count[cond_id]) + ", occurred at " + str(ev_time) + "s")
+                        else:
+                            sys.stdout.write("\rAvg of stream {} updated with {} event n° {}, occurred at {}s".format(
+                                state.index, ev_name, averages.count[cond_id], ev_time))
+                            sys.stdout.flush()
+                    t = metrics.stage('averaging', t)
+                    publish_avg(state.avg_outlet, state.avg_chunk, averages, cond_id, ev_time, decimator)
+                    t = metrics.stage('publish', t)
+            if EPOCH_ARCHIVE and time.perf_counter() - archive_commit_time >= ARCHIVE_COMMIT_INTERVAL:
+                for state in states:
+                    state.archive.commit()
+                archive_commit_time = time.perf_counter()
+
+            if USING_CONSOLE:
+                for state in states:
+                    if state.core.ring.n_written > 0:
+                        state.checkpoints.update(state.core.averages, state.core.last_data_time)
+
+                # Discard msg case (the same interval discarded in every stream) ----------------------------------------------------
+                msg, timestamp = console_inlet.pull_sample(timeout=0)
+                if msg is not None and msg[0].split()[:1] == ['DISCARD']:  # 'DISCARD' or 'DISCARD <seconds>'
+                    discard_seconds = parse_discard(msg[0].split()[1:])
+                if msg is not None and msg[0].split()[:1] == ['DISCARD'] and discard_seconds is not None:
+                    for state in states:
+                        core = state.core
+                        first_key = state.checkpoints.rollback(core.averages, core.last_data_time, discard_seconds)
+                        if first_key is None:  # nothing received yet
+                            first_key = core.last_data_time
+                        core.scheduler.clear()
+                        core.ring.invalidate()
+                        if ADAPTIVE_STOPPING:
+                            state.stopping.reset()
+                        if EPOCH_ARCHIVE:
+                            state.archive.discard(core.averages.count, core.averages.rejected)
+                        reset_time = first_key - (pause_post_ev + event_length)
+                        publish_reset(state.avg_outlet, state.avg_chunk, core.averages,
+                                      reset_time if reset_time > 0 else 0.00001, decimator)
+                        if RECORDING:
+                            state.recorder.write('disc', [[first_key + (1 / srate)] + [core.last_data_time]])
+                elif msg is not None and msg[0].split()[:1] == ['CONFIG']:
+                    sys.stdout.write("\n")
+                    print("Config command ignored, not supported in multi-stream mode")
+                t = metrics.stage('console', t)
+
+            if METRICS and metrics.report_due(METRICS_INTERVAL):
+                queue_depth = 0
+                if RECORDING:
+                    for state in states:
+                        stats = state.recorder.stats()
+                        queue_depth += stats["queue_depth"] + stats["overflow_blocks"]
+                values = metrics.report(['samples', 'events'])
+                metrics_outlet.push_sample(values[:2] + [metrics.counters['dropped_samples'], queue_depth] + values[2:])
+            if GAP_STATS and time.perf_counter() - gap_report_time >= GAP_STATS_INTERVAL:
+                for state in states:
+                    state.gap_outlet.push_sample(state.core.gaps.stats())
+                gap_report_time = time.perf_counter()
+
+        except (pylsl.pylsl.LostError, pylsl.pylsl.TimeoutError):  # i.e. if connection lost
+            sys.stdout.write("\n")
+            print("Connection lost with one or more streams!")
+            print("Closing streams...", end=" ")
+            for inlet in data_inlets:
+                inlet.close_stream()
+            marker_inlet.close_stream()
+            if USING_CONSOLE:
+                console_inlet.close_stream()
+            print("done!")
+            close_all()
+            sys.exit()
+
+    sys.stdout.write("\n")
+    print("Session ended!")
+    for state in states:
+        print_gaps(state.core.gaps, " of stream " + str(state.index))
+        if GAP_STATS:
+            state.gap_outlet.push_sample(state.core.gaps.stats())
+    if ARTIFACT_REJECTION:
+        for state in states:
+            print("Rejected epochs of stream " + str(state.index) + ": " +
+                  ", ".join(name + " " + str(state.core.averages.rejected[c]) for c, name in enumerate(CONDITION_NAMES)) +
+                  " (" + ", ".join(reason + " " + str(n) for reason, n in zip(REASONS, state.core.rejector.reason_counts)) + ")")
+    print("Closing streams...", end=" ")
+    for inlet in data_inlets:
+        inlet.close_stream()
+    marker_inlet.close_stream()
+    print("done!")
+    close_all()
+    # wait for console ack or closing input
+    if USING_CONSOLE:
+        while True:
+            msg, timestamp = console_inlet.pull_sample()  # blocking call
+            if msg is not None and msg[0] == 'CLOSE_ALL':
+                break
+    else:
+        input("Press enter to terminate the program when the plotters have finished!")
+
+
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    if MULTI_STREAM:
+        main_multi(sys.argv[1:])
+    else:
+        main(sys.argv[1:])
@@ -0,0 +1,139 @@
+"""Background writer of the datasets recorded by the Receiver, so that the acquisition never waits for the disk"""
+import csv
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+
+class RecordingWriter:
+    """
+    Writes the recorded rows to csv files (and/or to a binary session) from a background thread. The acquisition loop hands
+    whole blocks of rows over a bounded queue and never blocks: if the queue is full, blocks are kept aside and handed over
+    as soon as there is room, while the backpressure is reported (number of times the queue was found full, maximum depth,
+    rows kept aside).
+    The writer thread converts the rows to text and writes them in batches, flushing the files every <flush_interval>
+    seconds; with <fsync> 'flush' the files are also forced to disk at each flush, with 'close' only when closed.
+
+    Parameters:
+        path (str): Folder where the files are saved.
+        files (dict): Name of the file for each kind of rows (e.g. {'eeg': 'eeg_session.csv'}).
+        max_queue (int): Maximum number of blocks waiting to be written.
+        flush_interval (float): Time (s) between consecutive flushes of the files.
+        fsync (str): When to force the files to disk: 'never', 'flush' or 'close'.
+        session (SessionWriter): Binary session where the rows are also written (committed at each flush), or None.
+    """
+
+    def __init__(self, path, files, max_queue=256, flush_interval=1.0, fsync='close', session=None):
+        self.path = path
+        self.files = files
+        self.session = session
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.queue = queue.Queue(max_queue)
+        self.overflow = deque()  # blocks waiting for room in the queue (producer side)
+        self.overflow_rows = 0
+        # backpressure metrics
+        self.n_full = 0
+        self.max_depth = 0
+        self.max_overflow_rows = 0
+        self.logs = {}
+        self.writers = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._open()
+        self.thread = threading.Thread(target=self._run, name="RecordingWriter", daemon=True)
+        self.thread.start()
+
+    # Producer side (acquisition loop) ------------------------------------------------------------------------------------------
+    def write(self, kind, rows):  # hand a list of rows (or a 2-D array) to be written in the file of the given kind
+        self._put((kind, rows))
+
+    def reopen(self):  # recreate the files from scratch (e.g. restart)
+        self._put(('reopen', None))
+
+    def close(self):  # write everything still queued, close the files and stop the writer thread
+        while len(self.overflow) > 0:  # OBS: here it is fine to wait
+            self.queue.put(self.overflow.popleft())
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {"queue_depth": self.queue.qsize(), "max_depth": self.max_depth, "n_full": self.n_full,
+                "overflow_blocks": len(self.overflow), "max_overflow_rows": self.max_overflow_rows}
+
+    def _put(self, item):
+        self.overflow.append(item)
+        self.overflow_rows += len(item[1]) if item[1] is not None else 0
+        while len(self.overflow) > 0:
+            try:
+                self.queue.put_nowait(self.overflow[0])
+            except queue.Full:
+                if len(self.overflow) == 1:  # i.e. queue just found full
+                    self.n_full += 1
+                    if self.n_full == 1 or self.n_full % 100 == 0:
+                        sys.stdout.write("\n")
+                        print("\033[1;31;48m" + "Recording queue full!" + "\033[1;37;0m" +  # code to have red print
+                              " the disk is not keeping up, data kept in memory ({} times so far)".format(self.n_full))
+                self.max_overflow_rows = max(self.max_overflow_rows, self.overflow_rows)
+                break
+            kind, rows = self.overflow.popleft()
+            self.overflow_rows -= len(rows) if rows is not None else 0
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    # Consumer side (writer thread) ---------------------------------------------------------------------------------------------
+    def _open(self):
+        for kind, name in self.files.items():
+            self.logs[kind] = open(os.path.join(self.path, name), 'w', newline='')
+            self.writers[kind] = csv.writer(self.logs[kind])
+
+    def _flush(self, force_sync):
+        for log in self.logs.values():
+            log.flush()
+            if force_sync:
+                os.fsync(log.fileno())
+        if self.session is not None:
+            self.session.commit(force_sync)
+
+    def _close_files(self):
+        self._flush(self.fsync in ('flush', 'close'))
+        for log in self.logs.values():
+            log.close()
+        if self.session is not None:
+            self.session.close(self.fsync in ('flush', 'close'))
+
+    def _run(self):
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            while True:  # take everything already queued, to write it in one go
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:  # closing
+                    running = False
+                    break
+                kind, rows = item
+                if kind == 'reopen':
+                    for log in self.logs.values():
+                        log.close()
+                    self._open()
+                    if self.session is not None:
+                        self.session.reset()
+                    continue
+                if kind in self.writers:
+                    self.writers[kind].writerows(rows.tolist() if hasattr(rows, 'tolist') else rows)
+                if self.session is not None:
+                    self.session.write(kind, rows)
+            if running and time.monotonic() - last_flush >= self.flush_interval:
+                self._flush(self.fsync == 'flush')
+                last_flush = time.monotonic()
+        self._close_files()
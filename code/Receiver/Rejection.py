@@ -0,0 +1,60 @@
+"""Rejection of the epochs containing artifacts (e.g. blinks, motion), before averaging"""
+import numpy as np
+
+REASONS = ['peak_to_peak', 'absolute', 'flat', 'eog']
+
+
+class EpochRejector:
+    """
+    Checks a whole stack of epochs in one vectorized pass. An epoch is rejected if, on any EEG channel, the peak-to-peak
+    amplitude exceeds <peak_to_peak>, the absolute value exceeds <absolute>, the peak-to-peak amplitude is below <flat>
+    (flat line, e.g. detached electrode), or if the correlation with an EOG channel exceeds <eog_correlation> in absolute
+    value. A threshold set to None disables the related check. The number of epochs rejected for each reason is kept.
+
+    Parameters:
+        n_channels (int): Number of channels of each epoch.
+        peak_to_peak (float): Maximum peak-to-peak amplitude (same unit of the data).
+        absolute (float): Maximum absolute value.
+        flat (float): Minimum peak-to-peak amplitude.
+        eog_ids (list): Indexes of the EOG channels (not checked against the thresholds above).
+        eog_correlation (float): Maximum absolute correlation between an EEG channel and an EOG one.
+    """
+
+    def __init__(self, n_channels, peak_to_peak=None, absolute=None, flat=None, eog_ids=(), eog_correlation=None):
+        self.peak_to_peak = peak_to_peak
+        self.absolute = absolute
+        self.flat = flat
+        self.eog_ids = list(eog_ids)
+        self.eeg_ids = [i for i in range(n_channels) if i not in self.eog_ids]
+        self.eog_correlation = eog_correlation if len(self.eog_ids) > 0 else None
+        self.reason_counts = np.zeros(len(REASONS), dtype=int)
+
+    def reset(self):
+        self.reason_counts[:] = 0
+
+    def process(self, epochs):
+        """
+        Checks a (epochs x samples x channels) stack. Returns a boolean array telling which epochs are rejected and a
+        (epochs x reasons) boolean array telling why (see REASONS).
+        """
+        reasons = np.zeros((len(epochs), len(REASONS)), dtype=bool)
+        eeg = epochs[:, :, self.eeg_ids] if len(self.eog_ids) > 0 else epochs
+        maxs, mins = eeg.max(axis=1), eeg.min(axis=1)  # (epochs x channels)
+        ptp = maxs - mins
+        if self.peak_to_peak is not None:
+            reasons[:, 0] = (ptp > self.peak_to_peak).any(axis=1)
+        if self.absolute is not None:
+            reasons[:, 1] = (np.maximum(maxs, -mins) > self.absolute).any(axis=1)
+        if self.flat is not None:
+            reasons[:, 2] = (ptp < self.flat).any(axis=1)
+        if self.eog_correlation is not None:
+            eeg = eeg - eeg.mean(axis=1, keepdims=True)
+            eog = epochs[:, :, self.eog_ids]
+            eog = eog - eog.mean(axis=1, keepdims=True)
+            cov = np.einsum('nlc,nle->nce', eeg, eog)
+            norms = np.sqrt((eeg ** 2).sum(axis=1))[:, :, np.newaxis] * np.sqrt((eog ** 2).sum(axis=1))[:, np.newaxis, :]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                corr = np.where(norms > 0, cov / norms, 0)
+            reasons[:, 3] = (np.abs(corr) > self.eog_correlation).any(axis=(1, 2))
+        self.reason_counts += reasons.sum(axis=0)
+        return reasons.any(axis=1), reasons
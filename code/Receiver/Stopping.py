@@ -0,0 +1,69 @@
+"""Adaptive stopping of the blocks: online significance of the difference between the first two conditions (rare - frequent)"""
+import numpy as np
+
+
+class StoppingCriterion:
+    """
+    Welch's t-statistic of the difference between two conditions (e.g. rare - frequent), for each channel, computed on the mean
+    amplitude of each epoch in a window (e.g. around the P300 peak). The mean amplitudes of the epochs of each condition are
+    accumulated with Welford's algorithm (running mean and M2), so that each epoch costs O(samples x channels) and the
+    statistic O(channels). The criterion is reached when the statistic (one-sided, first condition higher) of at least one of
+    the checked channels exceeds <threshold>, once each condition has at least <min_trials> epochs.
+
+    Parameters:
+        cond_ids (tuple): Ids of the two conditions compared (first - second).
+        start (int): First sample of the window in the epochs.
+        stop (int): Sample following the last one of the window.
+        n_channels (int): Number of channels of the epochs.
+        channels (list): Indexes of the channels checked, None for all of them.
+        threshold (float): Value of the statistic to be exceeded.
+        min_trials (int): Minimum number of epochs of each condition.
+    """
+
+    def __init__(self, cond_ids, start, stop, n_channels, channels=None, threshold=5.0, min_trials=10):
+        self.cond_ids = tuple(cond_ids)
+        self.start = start
+        self.stop = stop
+        self.channels = list(range(n_channels)) if channels is None else list(channels)
+        self.threshold = threshold
+        self.min_trials = max(min_trials, 2)  # OBS: at least 2 epochs of each condition for their variances
+        self.count = np.zeros(2, dtype=int)
+        self.mean = np.zeros((2, n_channels))  # running mean of the amplitudes of each condition
+        self.m2 = np.zeros((2, n_channels))    # sum of squared deviations from the running mean
+        self.t = np.zeros(n_channels)          # last statistic computed
+        self.reached = False
+        self._amplitude = np.zeros(n_channels)
+        self._delta = np.zeros(n_channels)
+
+    def reset(self):  # restart from scratch (stop + play msgs, or discard)
+        self.count[:] = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+        self.t[:] = 0
+        self.reached = False
+
+    def update(self, cond_id, epoch):  # add a (samples x channels) averaged epoch; True when the criterion is first reached
+        if cond_id not in self.cond_ids:
+            return False
+        k = self.cond_ids.index(cond_id)
+        np.mean(epoch[self.start:self.stop], axis=0, out=self._amplitude)
+        self.count[k] += 1
+        np.subtract(self._amplitude, self.mean[k], out=self._delta)
+        self.mean[k] += self._delta / self.count[k]
+        self.m2[k] += self._delta * (self._amplitude - self.mean[k])
+        if self.reached or self.count.min() < self.min_trials:
+            return False
+        self.t = self.statistic()
+        self.reached = bool(self.t[self.channels].max() >= self.threshold)
+        return self.reached
+
+    def statistic(self):  # Welch's t-statistic of each channel (0 where the variances are both null)
+        if self.count.min() < 2:
+            return np.zeros_like(self._amplitude)
+        variance = self.m2 / (self.count[:, np.newaxis] - 1)
+        std_error = np.sqrt(variance[0] / self.count[0] + variance[1] / self.count[1])
+        difference = self.mean[0] - self.mean[1]
+        return np.divide(difference, std_error, out=np.zeros_like(difference), where=std_error > 0)
+
+    def best_channel(self):  # index of the checked channel with the highest statistic
+        return self.channels[int(np.argmax(self.t[self.channels]))]
@@ -0,0 +1,86 @@
+"""
+Check of the zero-phase epoch filter (see Filters.py) against the per-channel filtering it replaced.
+Run with pytest, or as a script: $ python test_filters.py
+"""
+import numpy as np
+from scipy import signal as dsp
+
+from Filters import EpochFilter
+
+# Constants -------------------------------------------------------------------------------------------------------------------------
+SRATES = [128, 250, 1000]   # Hz, sampling rates checked
+N_CHANNELS = 32
+EPOCH_DURATION = 1.2        # s, length of the epochs (as the default window of the Receiver)
+LOWER_COF = 1.0             # Hz, band-pass filter as in the default DSP pipeline
+UPPER_COF = 24.0
+FIR_NUMTAPS = 1000
+NOTCH_FREQ = 50.0           # Hz, notch filter as in the default DSP pipeline
+QUALITY_FACTOR = 30.0
+MAX_RELATIVE_ERROR = 1e-10
+
+
+# Functions -------------------------------------------------------------------------------------------------------------------------
+def per_channel_filter(epoch, fir, b_notch, a_notch, pad):
+    """
+    Previous filtering of an epoch: each channel padded with zeros, band-pass filtered by a "same" mode convolution, notch
+    filtered forward and backward, and trimmed.
+
+    Parameters:
+        epoch (ndarray): Epoch to be filtered (samples x channels).
+        fir (ndarray): Coefficients of the FIR band-pass filter.
+        b_notch, a_notch (ndarray): Numerator and denominator of the notch filter.
+        pad (int): Number of zeros added before and after the epoch.
+
+    Returns:
+        filtered (ndarray): Filtered epoch (samples x channels).
+    """
+    length = epoch.shape[0]
+    filtered = np.empty(epoch.shape)
+    for i in range(epoch.shape[1]):
+        padded = np.zeros(length + 2 * pad)
+        padded[pad:pad + length] = epoch[:, i]
+        padded = dsp.convolve(padded, fir, mode="same")  # applying band-pass filter
+        padded = dsp.filtfilt(b_notch, a_notch, padded)  # applying notch filter
+        filtered[:, i] = padded[pad:pad + length]
+    return filtered
+
+
+def relative_error(result, expected):
+    return np.abs(result - expected).max() / np.abs(expected).max()
+
+
+def filters(srate):  # FIR band-pass and notch filters, designed for <srate>
+    fir = dsp.firwin(FIR_NUMTAPS, [LOWER_COF, UPPER_COF], pass_zero=False, fs=srate)
+    b_notch, a_notch = dsp.iirnotch(NOTCH_FREQ, QUALITY_FACTOR, srate)
+    return fir, b_notch, a_notch
+
+
+# Tests -----------------------------------------------------------------------------------------------------------------------------
+def test_epoch_filter_matches_per_channel_filter():
+    rng = np.random.default_rng(0)
+    for srate in SRATES:
+        fir, b_notch, a_notch = filters(srate)
+        length, pad = int(EPOCH_DURATION * srate), srate  # 1s before and after the epoch, as in the Receiver
+        epoch = rng.standard_normal((length, N_CHANNELS)) * 20 + 100  # with an offset, as the raw EEG
+        expected = per_channel_filter(epoch, fir, b_notch, a_notch, pad)
+        result = EpochFilter(fir, dsp.tf2sos(b_notch, a_notch), length, pad).process(epoch)
+        assert result.shape == epoch.shape
+        assert relative_error(result, expected) < MAX_RELATIVE_ERROR, srate
+
+
+def test_epoch_filter_of_stacked_epochs():
+    rng = np.random.default_rng(1)
+    srate = 250
+    fir, b_notch, a_notch = filters(srate)
+    length, pad = int(EPOCH_DURATION * srate), srate
+    epochs = rng.standard_normal((5, length, N_CHANNELS))
+    epoch_filter = EpochFilter(fir, dsp.tf2sos(b_notch, a_notch), length, pad)
+    result = epoch_filter.process(epochs)
+    for epoch, filtered in zip(epochs, result):
+        assert relative_error(filtered, per_channel_filter(epoch, fir, b_notch, a_notch, pad)) < MAX_RELATIVE_ERROR
+
+
+if __name__ == '__main__':
+    test_epoch_filter_matches_per_channel_filter()
+    test_epoch_filter_of_stacked_epochs()
+    print("ok")
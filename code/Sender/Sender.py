@@ -1,4 +1,4 @@
-"""Send a multi-channel time-series with proper meta-data to LSL in single samples, from unicorn device or csv file.
+"""Send a multi-channel time-series with proper meta-data to LSL, from unicorn device (single samples) or csv file (blocks).
 
 Note on online.csv: The first column of the csv file represents the timestamp of each observation.
 The entries of column 19 (Flash) are filled with zeros, except at the timestamp corresponding to
@@ -10,6 +10,7 @@ import getopt
 import os
 import signal
 import sys
+from time import sleep
 
 import numpy as np
 import pandas
@@ -20,19 +21,31 @@ UNICORN_PATH = os.path.join("..", "Unicorn")
 sys.path.insert(0, UNICORN_PATH)
 import UnicornPy
 
+SESSION_PATH = os.path.join("..", "Session")
+sys.path.insert(0, SESSION_PATH)
+from Session import SessionReader, is_session
+
 # Constants ----------------------------------------------------------------------------------------------------------------------
-DATA_PATH = os.path.join("..", "..", "data", "Datasets")  # csv folder location
+DATA_PATH = os.path.join("..", "..", "data", "Datasets")  # csv (or binary session folder) location
+
+# values defining the replay of a file (all the samples due at each tick are sent in a single chunk)
+REPLAY_TICK = 0.005             # s, time between consecutive blocks of samples
+MAX_BLOCK_SAMPLES = 1024        # maximum number of samples of each chunk (e.g. after a late tick)
+CONSOLE_POLL_INTERVAL = 0.05    # s, time between consecutive checks of the messages from the console
+PROGRESS_INTERVAL = 0.5         # s, time between consecutive updates of the progress print
 
 # Flags and variables for optional features --------------------------------------------------------------------------------------
 REMOVE_REFERENCE = True    # flag to remove reference channel
 REFERENCE_COL_N = 4  # column of reference channel in csv - 1
 
 USE_DEVICE = False      # flag to know if used Unicorn or csv file
-CSV_FILE = "online.csv"  # dataset file
+CSV_FILE = "online.csv"  # dataset file (or folder of a binary session, see Session.py)
 SRATE_FILE = 128  # Hz
 CHANNEL_NAMES_FILE = ["F7", "F3", "F4", "Fz", "F8", "T7", "C3", "Cz", "C4", "T8", "P7", "P3", "Pz", "P4", "P8", "O1", "O2"]
 
 USING_CONSOLE = True    # flag to enable the console control
+STOP_ON_CRITERION = True    # flag to end the replay of the file once the Receiver reaches the stopping criterion
+                            # OBS: acquisition from the device not affected, ended as usual from the Console
 
 DEBUG_PRINT = False      # flag to enable verbose prints
 
@@ -153,6 +166,11 @@ def main(argv):
                 srate = float(arg)
             elif opt in ("-c", "--channel_names"):
                 channel_names = arg.split(',')
+        session = None
+        if is_session(os.path.join(DATA_PATH, csv_file)):  # binary session, values for EEG taken from its header
+            session = SessionReader(os.path.join(DATA_PATH, csv_file))
+            srate = session.srate
+            channel_names = session.labels
     n_channels = len(channel_names)
 
     # first create a new stream info. The last value would be the serial
@@ -206,15 +224,29 @@ def main(argv):
         if not os.path.exists(csv_path):
             raise FileNotFoundError("chosen file '" + csv_file + "' not found in expected path (" + DATA_PATH + ")")
         else:
-            if REMOVE_REFERENCE: # needed only if file containing reference channel
-                sig_data = pandas.read_csv(csv_path, header=None, usecols=[i for i in range(REFERENCE_COL_N)] +
-                                                                          [k for k in range(REFERENCE_COL_N + 1, n_channels + 4)])
+            # OBS: stims is 0 for no stimulus, 1 for a frequent stimulus and 2 for a rare one
+            if session is not None:  # samples memory-mapped, stimuli placed at the sample nearest to each event
+                timestamps = session.times
+                samples = session.data
+                stims = np.zeros(len(session), dtype=np.int8)
+                if len(session) > 1 and len(session.events) > 0:
+                    idx = np.clip(np.searchsorted(timestamps, session.events['time']), 1, len(session) - 1)
+                    idx -= session.events['time'] - timestamps[idx - 1] < timestamps[idx] - session.events['time']
+                    stims[idx] = np.where(np.array(session.event_labels()) == 'R', 2, 1)
             else:
-                sig_data = pandas.read_csv(csv_path, header=None)
-            sig_array = sig_data.to_numpy()
-            sig_array = sig_array.tolist()
-            csv_row_n = len(sig_array)  # total number of rows
+                if REMOVE_REFERENCE: # needed only if file containing reference channel
+                    sig_data = pandas.read_csv(csv_path, header=None, usecols=[i for i in range(REFERENCE_COL_N)] +
+                                                                              [k for k in range(REFERENCE_COL_N + 1, n_channels + 4)])
+                else:
+                    sig_data = pandas.read_csv(csv_path, header=None)
+                sig_array = sig_data.to_numpy()
+                timestamps = sig_array[:, 0]
+                samples = sig_array[:, 1:n_channels + 1]  # take only channels value
+                stims = np.where(sig_array[:, n_channels + 1] == 1, np.where(sig_array[:, n_channels + 2] == 0, 1, 2), 0)
+            csv_row_n = len(timestamps)  # total number of rows
             data_idx = 0
+            # preallocated chunk sent to the receiver (OBS: samples copied block by block, also from a memory-mapped session)
+            block_buffer = np.zeros((MAX_BLOCK_SAMPLES, n_channels), dtype=np.float32)
 
             if not USING_CONSOLE:
                 input("Press enter after everything is ready!")
@@ -242,115 +274,125 @@ def main(argv):
             paused_time = 0  # how much time stayed in pause state
             start_pause = 0  # last time it entered in pause state
             reset_required_sample = False
+            criterion_reached = False  # stopping criterion reached by the Receiver (relayed by the Console)
             start_time = local_clock()
+            next_poll = start_time  # time of the next check of the messages from the console
+            next_progress = start_time  # time of the next update of the progress print
             while data_idx != csv_row_n and play:
                 if reset_required_sample:  # i.e. if a pause has occurred, in order not to have required_samples depending on pause time
                     reset_required_sample = False
                     paused_time += local_clock() - start_pause
-                elapsed_time = local_clock() - start_time - paused_time  # OBS: elapsed_time in play state
-                required_samples = int(srate * elapsed_time) - sent_samples  # OBS: in this way simulated chosen srate
-                if required_samples > 0:
-                    for samp_ix in range(required_samples):
-                        row = sig_array[data_idx]
-                        if row[n_channels + 1] == 1:  # i.e. a stimulus has occurred
-                            if row[n_channels + 2] == 0:
-                                outlet_marker.push_sample("F", row[0])  # frequent stimulus
-                            else:
-                                outlet_marker.push_sample("R", row[0])  # rare stimulus
-                        sample = row[1:n_channels + 1]  # take only channels value
-
-                        # now send it
-                        outlet_sender.push_sample(sample, row[0])
-                        sent_samples += 1
-                        if DEBUG_PRINT:
-                            print("timestamp: " + str(row[0]))
-                            print("sample: " + str(sample))
-                            print("======================")
-                        else:
-                            sys.stdout.write("\rSent {} samples out of {} ({}%)".format(sent_samples, csv_row_n,
-                                                                                        int(sent_samples / csv_row_n * 100)))
-                            sys.stdout.flush()
-                        data_idx += 1
-                        if data_idx == csv_row_n:  # reached end of file
-                            break
-                        if USING_CONSOLE:  # look for messages from console
-                            try:
-                                msg, timestamp = console_inlet.pull_sample(timeout=0)
-                                if msg is not None:
-                                    with switch.Switch(msg[0]) as case:
-                                        if DEBUG_PRINT:
-                                            print(msg[0])
-                                        if case("PAUSE"):
-                                            start_pause = local_clock()
-                                            pause = True
-                                            play = False
-                                        elif case("QUIT"):
-                                            play = False
-                            except ():
-                                sys.stdout.write("\n")
-                                sys.exit()
-
-                            # PAUSE condition
-                            # wait until PLAY, STOP or QUIT are pressed
-                            while pause:
-                                try:
-                                    msg, timestamp = console_inlet.pull_sample(timeout=0)
-                                    if msg is not None:
-                                        with switch.Switch(msg[0]) as case:
-                                            if DEBUG_PRINT:
-                                                print(msg[0])
-                                            if case("PLAY"):
-                                                pause = False
-                                                play = True
-                                                reset_required_sample = True
-                                            elif case("STOP"):
-                                                pause = False
-                                                stop = True
-                                            elif case("QUIT"):
-                                                pause = False
-                                                play = False
-                                except ():
-                                    sys.stdout.write("\n")
-                                    sys.exit()
-
-                            # STOP condition
-                            # wait until PLAY or QUIT are pressed
-                            while stop:
-                                try:
-                                    msg, timestamp = console_inlet.pull_sample(timeout=0)
-                                    if msg is not None:
-                                        with switch.Switch(msg[0]) as case:
-                                            if DEBUG_PRINT:
-                                                print(msg[0])
-                                            if case("PLAY"):
-                                                stop = False
-                                                play = True
-                                                # reinitialized everything
-                                                if not DEBUG_PRINT:
-                                                    print("")
-                                                print("Resetting to start from scratch...", end="")
-                                                # sent msg for receiver
-                                                outlet_sender.push_sample([0 for _ in range(n_channels)], 0.00001)
-                                                # variables initialization
-                                                data_idx = 0
-                                                sent_samples = 0
-                                                paused_time = 0
-                                                start_pause = 0
-                                                reset_required_sample = False
-                                                print("done!")
-                                                start_time = local_clock()
-                                            elif case("QUIT"):
-                                                stop = False
-                                                play = False
-                                except ():
-                                    sys.stdout.write("\n")
-                                    sys.exit()
+                tick_time = local_clock()
+                elapsed_time = tick_time - start_time - paused_time  # OBS: elapsed_time in play state
+                required_samples = min(int(srate * elapsed_time) - sent_samples, csv_row_n - data_idx)  # simulated srate
+                while required_samples > 0:  # all the samples due, in chunks of at most MAX_BLOCK_SAMPLES
+                    n_block = min(required_samples, MAX_BLOCK_SAMPLES)
+                    block_times = timestamps[data_idx:data_idx + n_block]
+                    for i in np.flatnonzero(stims[data_idx:data_idx + n_block]):  # i.e. a stimulus has occurred
+                        # rare or frequent stimulus, with the timestamp of its sample
+                        outlet_marker.push_sample("R" if stims[data_idx + i] == 2 else "F", float(block_times[i]))
+                    block_buffer[:n_block] = samples[data_idx:data_idx + n_block]
+
+                    # now send them, each sample with its own timestamp
+                    outlet_sender.push_chunk(block_buffer[:n_block], block_times.tolist())
+                    sent_samples += n_block
+                    required_samples -= n_block
+                    data_idx += n_block
+                    if DEBUG_PRINT:
+                        print("timestamps: " + str(block_times[0]) + " - " + str(block_times[-1]))
+                        print("samples: " + str(n_block))
+                        print("======================")
+                if not DEBUG_PRINT and (tick_time >= next_progress or data_idx == csv_row_n):
+                    sys.stdout.write("\rSent {} samples out of {} ({}%)".format(sent_samples, csv_row_n,
+                                                                                int(sent_samples / csv_row_n * 100)))
+                    sys.stdout.flush()
+                    next_progress = tick_time + PROGRESS_INTERVAL
+                if data_idx == csv_row_n:  # reached end of file
+                    break
+                if USING_CONSOLE and tick_time >= next_poll:  # look for messages from console
+                    next_poll = tick_time + CONSOLE_POLL_INTERVAL
+                    try:
+                        msg, timestamp = console_inlet.pull_sample(timeout=0)
+                        if msg is not None:
+                            with switch.Switch(msg[0]) as case:
+                                if DEBUG_PRINT:
+                                    print(msg[0])
+                                if case("PAUSE"):
+                                    start_pause = local_clock()
+                                    pause = True
+                                    play = False
+                                elif case("QUIT"):
+                                    play = False
+                                elif case("CRITERION") and STOP_ON_CRITERION:
+                                    criterion_reached = True  # block ended early, as if the end of file was reached
+                                    play = False
+                    except ():
+                        sys.stdout.write("\n")
+                        sys.exit()
+
+                    # PAUSE condition
+                    # wait until PLAY, STOP or QUIT are pressed
+                    while pause:
+                        try:
+                            msg, timestamp = console_inlet.pull_sample(timeout=CONSOLE_POLL_INTERVAL)
+                            if msg is not None:
+                                with switch.Switch(msg[0]) as case:
+                                    if DEBUG_PRINT:
+                                        print(msg[0])
+                                    if case("PLAY"):
+                                        pause = False
+                                        play = True
+                                        reset_required_sample = True
+                                    elif case("STOP"):
+                                        pause = False
+                                        stop = True
+                                    elif case("QUIT"):
+                                        pause = False
+                                        play = False
+                        except ():
+                            sys.stdout.write("\n")
+                            sys.exit()
+
+                    # STOP condition
+                    # wait until PLAY or QUIT are pressed
+                    while stop:
+                        try:
+                            msg, timestamp = console_inlet.pull_sample(timeout=CONSOLE_POLL_INTERVAL)
+                            if msg is not None:
+                                with switch.Switch(msg[0]) as case:
+                                    if DEBUG_PRINT:
+                                        print(msg[0])
+                                    if case("PLAY"):
+                                        stop = False
+                                        play = True
+                                        # reinitialized everything
+                                        if not DEBUG_PRINT:
+                                            print("")
+                                        print("Resetting to start from scratch...", end="")
+                                        # sent msg for receiver
+                                        outlet_sender.push_sample([0 for _ in range(n_channels)], 0.00001)
+                                        # variables initialization
+                                        data_idx = 0
+                                        sent_samples = 0
+                                        paused_time = 0
+                                        start_pause = 0
+                                        reset_required_sample = False
+                                        print("done!")
+                                        start_time = local_clock()
+                                    elif case("QUIT"):
+                                        stop = False
+                                        play = False
+                        except ():
+                            sys.stdout.write("\n")
+                            sys.exit()
+                # wait for the next tick (OBS: the samples due are computed from the clock, late ticks are caught up)
+                sleep(max(tick_time + REPLAY_TICK - local_clock(), 0))
 
             sys.stdout.write("\n")
             # send final msg to receiver
             outlet_sender.push_sample([0 for _ in range(n_channels)], 0.0)
-            if data_idx == csv_row_n:
-                print("End of file reached!")
+            if data_idx == csv_row_n or criterion_reached:
+                print("Criterion reached, block ended early!" if criterion_reached else "End of file reached!")
                 # wait for console ack or closing input
                 if USING_CONSOLE:
                     while True:
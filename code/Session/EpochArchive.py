@@ -0,0 +1,178 @@
+"""Binary archive of the single epochs processed by the Receiver (filtered, before averaging), one array for each condition.
+
+An archive is a folder containing:
+    header.json         metadata of the epochs (sample rate, channel labels, conditions, epoch window, DSP pipeline, ...)
+    epochs_<marker>.f32 epochs of each condition, float32 (trials x samples x channels), memory-mapped and grown in blocks
+    trials.bin          trials table, records of TRIAL_DTYPE in order of completion
+    commit.json         number of valid records of each file
+
+The epochs are copied by the Receiver straight into the mapped pages of their file, which is extended by a block of trials
+(and mapped again) when full. As in a binary session (see Session.py), readers trust only the committed records; at the end
+the files are truncated to the committed records, so that they can also be read with np.fromfile.
+"""
+import json
+import os
+
+import numpy as np
+
+from Session import COMMIT_FILE, HEADER_FILE, write_json_atomic
+
+FORMAT_VERSION = 1
+# trial of the archive: time of the event, row of the epoch in the array of its condition, id of the condition, if rejected
+# (artifacts or lost samples, i.e. not averaged) and if discarded afterwards (console command)
+TRIAL_DTYPE = np.dtype([('time', '<f8'), ('index', '<i4'), ('condition', '<i2'), ('rejected', 'u1'), ('discarded', 'u1')])
+
+TRIALS_FILE = 'trials.bin'
+
+
+def epochs_file(condition):  # file of the epochs of a condition
+    return 'epochs_' + condition + '.f32'
+
+
+class GrowableArray:
+    """
+    Array memory-mapped on a file, with records appended along its first axis; when full, the file is extended by <growth>
+    records and mapped again, so that each record is written in place into the mapped pages.
+
+    Parameters:
+        path (str): Location of the file (an existing one is overwritten).
+        dtype (np.dtype): Type of the elements.
+        shape (tuple): Shape of each record.
+        growth (int): Number of records the file is extended by.
+    """
+
+    def __init__(self, path, dtype, shape, growth):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.growth = growth
+        self.record_size = self.dtype.itemsize * int(np.prod(self.shape, dtype=int))
+        self.file = open(path, 'w+b')
+        self.array = None
+        self.n = 0  # number of records appended
+        self._resize(growth)
+
+    def _resize(self, capacity):
+        self.array = None  # OBS: unmapped before resizing the file (required on Windows)
+        self.file.truncate(capacity * self.record_size)
+        self.array = np.memmap(self.file, dtype=self.dtype, mode='r+', shape=(capacity,) + self.shape)
+
+    def append(self, record):  # copy a record (cast to the type of the array) in the next row
+        if self.n == len(self.array):
+            self.array.flush()
+            self._resize(self.n + self.growth)
+        self.array[self.n] = record
+        self.n += 1
+        return self.n - 1
+
+    def records(self):  # view of the records appended
+        return self.array[:self.n]
+
+    def reset(self):  # drop all the records (e.g. restart)
+        self.n = 0
+        self._resize(self.growth)
+
+    def flush(self):
+        self.array.flush()
+
+    def close(self):  # flush and truncate the file to the records appended
+        self.array.flush()
+        self.array = None
+        self.file.truncate(self.n * self.record_size)
+        self.file.close()
+
+
+class EpochArchiveWriter:
+    """
+    Appends the epochs processed by the Receiver to a new archive (an existing one is overwritten), together with the trials
+    table.
+
+    Parameters:
+        path (str): Folder of the archive.
+        header (dict): Metadata of the epochs, must contain at least 'srate', 'labels' and 'conditions' (marker strings).
+        length (int): Number of samples of each epoch.
+        growth (int): Number of trials each file is extended by, when full.
+    """
+
+    def __init__(self, path, header, length, growth=256):
+        self.path = path
+        self.header = dict(header, version=FORMAT_VERSION, n_channels=len(header['labels']), length=length)
+        self.conditions = list(header['conditions'])
+        if not os.path.exists(path):
+            os.makedirs(path)
+        write_json_atomic(os.path.join(path, HEADER_FILE), self.header)
+        self.epochs = [GrowableArray(os.path.join(path, epochs_file(condition)), '<f4', (length, len(header['labels'])),
+                                     growth) for condition in self.conditions]
+        self.trials = GrowableArray(os.path.join(path, TRIALS_FILE), TRIAL_DTYPE, (), growth)
+        self.commit()
+
+    def append(self, cond_id, time, epoch, rejected=False):  # add a (samples x channels) epoch of the given condition
+        index = self.epochs[cond_id].append(epoch)
+        self.trials.append((time, index, cond_id, rejected, False))
+
+    def discard(self, counts, rejected):
+        """
+        Marks as discarded the trials following the (rolled back) numbers of averaged and rejected epochs of each condition,
+        i.e. the ones removed from the averages by a discard.
+        """
+        table = self.trials.records()
+        for cond_id in range(len(self.conditions)):
+            for flag, kept in ((0, counts[cond_id]), (1, rejected[cond_id])):
+                rows = np.flatnonzero((table['condition'] == cond_id) & (table['rejected'] == flag) & (table['discarded'] == 0))
+                table['discarded'][rows[kept:]] = 1
+
+    def reset(self):  # drop everything archived so far (e.g. restart)
+        for array in self.epochs + [self.trials]:
+            array.reset()
+        self.commit()
+
+    def commit(self, force_sync=False):  # make the trials appended so far visible to readers
+        if force_sync:
+            for array in self.epochs + [self.trials]:
+                array.flush()
+        counts = {condition: array.n for condition, array in zip(self.conditions, self.epochs)}
+        write_json_atomic(os.path.join(self.path, COMMIT_FILE), dict(counts, trials=self.trials.n))
+
+    def close(self):
+        self.commit(force_sync=True)
+        for array in self.epochs + [self.trials]:
+            array.close()
+
+
+class EpochArchiveReader:
+    """
+    Reads an archive of epochs. The epochs of each condition are memory-mapped, so single trials can be accessed without
+    loading the whole file; the trials table is loaded.
+
+    Parameters:
+        path (str): Folder of the archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        with open(os.path.join(path, COMMIT_FILE)) as f:
+            counts = json.load(f)
+        self.srate = self.header['srate']
+        self.labels = self.header['labels']
+        self.conditions = self.header['conditions']
+        self.length = self.header['length']
+        self.n_channels = self.header['n_channels']
+        self.trials = np.fromfile(os.path.join(path, TRIALS_FILE), dtype=TRIAL_DTYPE, count=counts['trials'])
+        self.epochs = {}  # (trials x samples x channels) epochs of each condition, memory-mapped
+        for condition in self.conditions:
+            shape = (counts[condition], self.length, self.n_channels)
+            if shape[0] == 0:  # OBS: empty files can't be memory-mapped
+                self.epochs[condition] = np.zeros(shape, dtype='<f4')
+            else:
+                self.epochs[condition] = np.memmap(os.path.join(path, epochs_file(condition)), dtype='<f4', mode='r',
+                                                   shape=shape)
+
+    def __len__(self):
+        return len(self.trials)
+
+    def accepted(self, condition):  # epochs of a condition that have been averaged (neither rejected nor discarded)
+        cond_id = self.conditions.index(condition)
+        rows = self.trials[(self.trials['condition'] == cond_id) & (self.trials['rejected'] == 0) &
+                           (self.trials['discarded'] == 0)]
+        return self.epochs[condition][rows['index']]
@@ -0,0 +1,167 @@
+"""Binary storage of a recorded session (EEG samples, events and discarded intervals), alternative to the csv files.
+
+A session is a folder containing:
+    header.json     metadata of the recording (sample rate, channel labels, epoch window, filter settings, ...)
+    eeg.f32         samples, float32 (samples x channels), appended in chunks
+    times.f64       timestamps of the samples, float64
+    evs.bin         events table, records of (time float64, label 16 bytes)
+    disc.f64        discarded intervals table, pairs of (first time, last time) float64
+    commit.json     number of valid records of each table
+
+Crash-safe append: the records are appended to the data files, that are flushed (and optionally forced to disk) before
+commit.json is atomically replaced with the new counts. Readers trust only the committed records, so whatever has been
+written after the last commit (e.g. a torn chunk after a crash) is ignored.
+"""
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+EVENT_DTYPE = np.dtype([('time', '<f8'), ('label', 'S16')])
+
+HEADER_FILE = 'header.json'
+COMMIT_FILE = 'commit.json'
+EEG_FILE = 'eeg.f32'
+TIMES_FILE = 'times.f64'
+EVS_FILE = 'evs.bin'
+DISC_FILE = 'disc.f64'
+
+
+def write_json_atomic(path, content):  # write a json file so that it is never found half written
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def is_session(path):  # True if the folder contains a binary session
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+class SessionWriter:
+    """
+    Appends chunks of samples, events and discarded intervals to a new binary session (an existing one is overwritten).
+
+    Parameters:
+        path (str): Folder of the session.
+        header (dict): Metadata of the recording, must contain at least 'srate' and 'labels' (list of channel labels).
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = dict(header, version=FORMAT_VERSION, n_channels=len(header['labels']))
+        self.n_channels = self.header['n_channels']
+        if not os.path.exists(path):
+            os.makedirs(path)
+        write_json_atomic(os.path.join(path, HEADER_FILE), self.header)
+        self.files = {}
+        self._open()
+
+    def _open(self):
+        for name in (EEG_FILE, TIMES_FILE, EVS_FILE, DISC_FILE):
+            self.files[name] = open(os.path.join(self.path, name), 'wb')
+        self.counts = {'eeg': 0, 'evs': 0, 'disc': 0}
+        self.commit()
+
+    def reset(self):  # drop everything recorded so far (e.g. restart)
+        for f in self.files.values():
+            f.close()
+        self._open()
+
+    def append_eeg(self, times, samples):  # append (samples x channels) data with the related timestamps
+        samples = np.asarray(samples, dtype='<f4').reshape(-1, self.n_channels)
+        samples.tofile(self.files[EEG_FILE])
+        np.asarray(times, dtype='<f8').tofile(self.files[TIMES_FILE])
+        self.counts['eeg'] += len(samples)
+
+    def append_events(self, times, labels):
+        events = np.zeros(len(times), dtype=EVENT_DTYPE)
+        events['time'] = times
+        events['label'] = [label.encode() for label in labels]
+        events.tofile(self.files[EVS_FILE])
+        self.counts['evs'] += len(events)
+
+    def append_discards(self, intervals):  # append (first time, last time) discarded intervals
+        intervals = np.asarray(intervals, dtype='<f8').reshape(-1, 2)
+        intervals.tofile(self.files[DISC_FILE])
+        self.counts['disc'] += len(intervals)
+
+    def write(self, kind, rows):
+        """
+        Appends rows laid out as in the csv files of the Receiver: for 'eeg' a (samples x (1 + channels)) array with the
+        timestamps in the first column, for 'evs' rows of [time, marker] (marker as pulled from LSL, i.e. a list with the
+        label), for 'disc' rows of [first time, last time].
+        """
+        if kind == 'eeg':
+            rows = np.asarray(rows)
+            self.append_eeg(rows[:, 0], rows[:, 1:])
+        elif kind == 'evs':
+            self.append_events([row[0] for row in rows],
+                               [row[1][0] if isinstance(row[1], (list, tuple)) else str(row[1]) for row in rows])
+        elif kind == 'disc':
+            self.append_discards(rows)
+        else:
+            raise ValueError("unknown kind of rows '" + str(kind) + "'")
+
+    def commit(self, force_sync=False):  # make the records appended so far visible to readers
+        for f in self.files.values():
+            f.flush()
+            if force_sync:
+                os.fsync(f.fileno())
+        write_json_atomic(os.path.join(self.path, COMMIT_FILE), self.counts)
+
+    def close(self, force_sync=True):
+        self.commit(force_sync)
+        for f in self.files.values():
+            f.close()
+
+
+class SessionReader:
+    """
+    Reads a binary session. Samples and timestamps are memory-mapped, so any time range can be accessed without loading
+    the whole file; events and discarded intervals (small tables) are loaded.
+
+    Parameters:
+        path (str): Folder of the session.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        with open(os.path.join(path, COMMIT_FILE)) as f:
+            counts = json.load(f)
+        self.srate = self.header['srate']
+        self.labels = self.header['labels']
+        self.n_channels = self.header['n_channels']
+        # OBS: only committed records are considered (never more than what is actually in the files)
+        n_samples = min(counts['eeg'], self._n_records(TIMES_FILE, 8),
+                        self._n_records(EEG_FILE, 4 * self.n_channels))
+        self.data = self._memmap(EEG_FILE, np.dtype('<f4'), (n_samples, self.n_channels))
+        self.times = self._memmap(TIMES_FILE, np.dtype('<f8'), (n_samples,))
+        self.events = np.fromfile(os.path.join(path, EVS_FILE), dtype=EVENT_DTYPE,
+                                  count=min(counts['evs'], self._n_records(EVS_FILE, EVENT_DTYPE.itemsize)))
+        self.discards = np.fromfile(os.path.join(path, DISC_FILE), dtype='<f8',
+                                    count=2 * min(counts['disc'], self._n_records(DISC_FILE, 16))).reshape(-1, 2)
+
+    def _n_records(self, name, record_size):
+        return os.path.getsize(os.path.join(self.path, name)) // record_size
+
+    def _memmap(self, name, dtype, shape):
+        if shape[0] == 0:  # OBS: empty files can't be memory-mapped
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.times)
+
+    def event_labels(self):
+        return [label.decode() for label in self.events['label']]
+
+    def time_range(self, start, stop):  # timestamps and samples (memory-mapped views) with start <= time <= stop
+        first = np.searchsorted(self.times, start, side='left')
+        last = np.searchsorted(self.times, stop, side='right')
+        return self.times[first:last], self.data[first:last]
@@ -0,0 +1,225 @@
+"""Same-host transport of the averaged potentials from the Receiver to the Plotter, alternative to the avgStream LSL stream.
+
+The Receiver keeps the newest state of all the conditions (averages, number of averaged and rejected trials, time of the
+last event and of the last reset) in a shared memory block, laid out as:
+    header      int64 x 8: magic, version, sequence number of the last publication, n of conditions, length of the
+                averages, n of channels, length of the metadata, closed flag
+    metadata    json (channel labels, condition names, epoch window, sampling rates)
+    2 slots     int64 x 4 (begin sequence number, end sequence number, n of resets, unused), float64 x 2 (event time,
+                reset time), n_trials int64 (conditions), n_rejected int64 (conditions), averages float32
+                (conditions x samples x channels)
+
+Double buffer: the publication n is written in slot n % 2, between the begin and the end sequence numbers, and then the
+sequence number in the header is updated, so the Receiver never waits for the Plotter. The Plotter reads the slot of the
+newest publication with a single copy, valid only if both the sequence numbers of the slot still match (otherwise the slot
+has been overwritten meanwhile, and the read is repeated). After each publication a small UDP datagram is sent to the
+Plotter on localhost, to wake it up; publications occurred while it was busy are coalesced in the newest one.
+"""
+import json
+import os
+import socket
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = 0x50333030415647  # 'P300AVG'
+FORMAT_VERSION = 1
+DEFAULT_NAME = 'p300_avg'   # name of the shared memory block
+DEFAULT_PORT = 16573        # localhost UDP port of the notifications
+MAX_RETRIES = 100           # maximum number of reads of a slot overwritten while being copied
+
+HEADER_INTS = 8
+SLOT_INTS = 4
+SLOT_TIMES = 2
+
+
+def _aligned(n_bytes, alignment=64):
+    return (n_bytes + alignment - 1) // alignment * alignment
+
+
+def _slot_size(n_conditions, length, n_channels):
+    return _aligned(8 * (SLOT_INTS + SLOT_TIMES + 2 * n_conditions) + 4 * n_conditions * length * n_channels)
+
+
+def _slot_views(buf, offset, n_conditions, length, n_channels):  # (ints, times, n_trials, n_rejected, averages) of a slot
+    ints = np.ndarray(SLOT_INTS, dtype=np.int64, buffer=buf, offset=offset)
+    offset += ints.nbytes
+    times = np.ndarray(SLOT_TIMES, dtype=np.float64, buffer=buf, offset=offset)
+    offset += times.nbytes
+    n_trials = np.ndarray(n_conditions, dtype=np.int64, buffer=buf, offset=offset)
+    offset += n_trials.nbytes
+    n_rejected = np.ndarray(n_conditions, dtype=np.int64, buffer=buf, offset=offset)
+    offset += n_rejected.nbytes
+    averages = np.ndarray((n_conditions, length, n_channels), dtype=np.float32, buffer=buf, offset=offset)
+    return ints, times, n_trials, n_rejected, averages
+
+
+def _attach(name):  # open an existing block, without letting this process unlink it at exit
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':  # OBS: otherwise the resource tracker would unlink the block when the Plotter exits
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedAvgWriter:
+    """
+    Creates the shared memory block (an existing one with the same name, e.g. left by a crashed session, is replaced) and
+    publishes the state of the averages.
+
+    Parameters:
+        meta (dict): Metadata read by the Plotter, must contain at least 'labels' and 'condition_names'.
+        length (int): Number of samples of the averages.
+        name (str): Name of the shared memory block.
+        port (int): Localhost UDP port of the notifications.
+    """
+
+    def __init__(self, meta, length, name=DEFAULT_NAME, port=DEFAULT_PORT):
+        self.n_conditions = len(meta['condition_names'])
+        self.n_channels = len(meta['labels'])
+        self.length = length
+        meta_bytes = json.dumps(dict(meta, length=length)).encode()
+        self.slots_offset = _aligned(8 * HEADER_INTS + len(meta_bytes))
+        self.slot_size = _slot_size(self.n_conditions, length, self.n_channels)
+        size = self.slots_offset + 2 * self.slot_size
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.shm.buf[8 * HEADER_INTS:8 * HEADER_INTS + len(meta_bytes)] = meta_bytes
+        self.slots = [_slot_views(self.shm.buf, self.slots_offset + k * self.slot_size, self.n_conditions, length,
+                                  self.n_channels) for k in range(2)]
+        self.header = np.ndarray(HEADER_INTS, dtype=np.int64, buffer=self.shm.buf)
+        self.header[1:] = [FORMAT_VERSION, 0, self.n_conditions, length, self.n_channels, len(meta_bytes), 0]
+        self.header[0] = MAGIC  # OBS: written last, the Plotter waits for it before reading the rest
+        self.averages = np.zeros((self.n_conditions, length, self.n_channels), dtype=np.float32)  # state to be published
+        self.seq = 0
+        self.resets = 0
+        self.reset_time = 0.0
+        self.address = ('127.0.0.1', port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def update(self, cond_id, average):  # set the average of a condition, published at the next call of publish
+        self.averages[cond_id] = average
+
+    def publish(self, n_trials, n_rejected, event_time, reset=False):  # publish the current state (<reset> after a reset)
+        if reset:
+            self.resets += 1
+            self.reset_time = event_time
+        seq = self.seq + 1
+        ints, times, slot_trials, slot_rejected, slot_averages = self.slots[seq % 2]
+        ints[0] = seq
+        times[:] = event_time, self.reset_time
+        slot_trials[:] = n_trials
+        slot_rejected[:] = n_rejected
+        slot_averages[:] = self.averages
+        ints[2] = self.resets
+        ints[1] = seq
+        self.header[2] = seq
+        self.seq = seq
+        self._notify()
+
+    def _notify(self):
+        try:
+            self.sock.sendto(self.seq.to_bytes(8, 'little'), self.address)
+        except OSError:  # e.g. Plotter not running, it will find the newest state when attached
+            pass
+
+    def close(self):  # mark the session as ended (closing condition for the Plotter) and release the block
+        self.header[7] = 1
+        self._notify()
+        self.sock.close()
+        self.header = None
+        self.slots = None  # OBS: views must be released before closing the block
+        self.shm.close()
+        try:
+            self.shm.unlink()  # the Plotter can still read the block while attached
+        except FileNotFoundError:
+            pass
+
+
+class SharedAvgReader:
+    """
+    Attaches to the shared memory block (waiting for the Receiver to create it) and reads the newest state of the
+    averages into private arrays: averages, n_trials, n_rejected, event_time, reset_time and resets (n of resets).
+
+    Parameters:
+        name (str): Name of the shared memory block.
+        port (int): Localhost UDP port of the notifications.
+    """
+
+    def __init__(self, name=DEFAULT_NAME, port=DEFAULT_PORT):
+        # notifications socket bound before attaching, so that no publication following the first read is missed
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        while True:
+            try:
+                self.shm = _attach(name)
+                self.header = np.ndarray(HEADER_INTS, dtype=np.int64, buffer=self.shm.buf)
+                if self.header[0] == MAGIC:
+                    break
+                self.header = None
+                self.shm.close()
+            except (FileNotFoundError, ValueError):  # not created yet, or still empty
+                pass
+            time.sleep(0.1)
+        if self.header[1] != FORMAT_VERSION:
+            raise ValueError("shared averages of version " + str(self.header[1]) + ", expected " + str(FORMAT_VERSION))
+        self.n_conditions, self.length, self.n_channels, meta_len = (int(v) for v in self.header[3:7])
+        self.meta = json.loads(bytes(self.shm.buf[8 * HEADER_INTS:8 * HEADER_INTS + meta_len]).decode())
+        slots_offset = _aligned(8 * HEADER_INTS + meta_len)
+        slot_size = _slot_size(self.n_conditions, self.length, self.n_channels)
+        self.slots = [_slot_views(self.shm.buf, slots_offset + k * slot_size, self.n_conditions, self.length, self.n_channels)
+                      for k in range(2)]
+        self.averages = np.zeros((self.n_conditions, self.length, self.n_channels), dtype=np.float32)
+        self.n_trials = np.zeros(self.n_conditions, dtype=int)
+        self.n_rejected = np.zeros(self.n_conditions, dtype=int)
+        self.event_time = 0.0
+        self.reset_time = 0.0
+        self.resets = 0
+        self.seq = 0
+
+    @property
+    def closed(self):  # True when the Receiver has ended the session
+        return bool(self.header[7])
+
+    def read(self):  # copy the newest state, if not read yet; True if updated
+        for _ in range(MAX_RETRIES):
+            seq = int(self.header[2])
+            if seq == self.seq:
+                return False
+            ints, times, n_trials, n_rejected, averages = self.slots[seq % 2]
+            if ints[1] != seq:  # slot already being overwritten by a newer publication
+                continue
+            np.copyto(self.averages, averages)
+            event_time, reset_time = times
+            trials, rejected, resets = n_trials.copy(), n_rejected.copy(), int(ints[2])
+            if ints[0] == seq:  # slot not overwritten meanwhile, consistent copy
+                self.n_trials[:], self.n_rejected[:] = trials, rejected
+                self.event_time, self.reset_time, self.resets = float(event_time), float(reset_time), resets
+                self.seq = seq
+                return True
+        return False
+
+    def wait(self, timeout=None):  # wait for a notification (at most <timeout> s) and read the newest state; True if updated
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.recv(8)
+            self.sock.setblocking(False)
+            while True:  # drain the notifications of the publications coalesced in the newest one
+                self.sock.recv(8)
+        except (socket.timeout, BlockingIOError):
+            pass
+        return self.read()
+
+    def close(self):
+        self.sock.close()
+        self.header = None
+        self.slots = None  # OBS: views must be released before closing the block
+        self.shm.close()
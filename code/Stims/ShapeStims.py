@@ -18,6 +18,7 @@ sys.path.insert(0, DATA_PATH)
 import UnicornPy
 
 USING_CONSOLE = True
+STOP_ON_CRITERION = True  # end the block when the Receiver reaches the stopping criterion (relayed by the Console)
 DEBUG_PRINT = False
 
 if USING_CONSOLE:
@@ -213,6 +214,11 @@ def start(console_inlet):
                         if msg is not None and msg[0] == "QUIT":
                             # quit the program
                             core.quit()
+                # end the block early, the difference between rare and frequent stimuli is already significant
+                if msg is not None and msg[0] == "CRITERION" and STOP_ON_CRITERION:
+                    print("Criterion reached, block ended early")
+                    stop = True
+                    break
                 # second break to escape out of the repetition loop and restart our stims
                 if not play:
                     break